@@ -0,0 +1,137 @@
+"""
+Benchmarks
+==========
+
+A small harness for timing the hot paths of the client so that
+optimizations can be verified and regressions caught before they are
+released. Each benchmark is a callable registered with :func:`benchmark`
+and is timed with :mod:`timeit`, reporting the best and median time per
+call over a number of rounds.
+
+Results are written as JSON so that a later run can be compared against
+them with ``--compare``.
+
+"""
+import collections
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+REGISTRY = collections.OrderedDict()
+
+Result = collections.namedtuple(
+    'Result', ['name', 'group', 'rounds', 'number', 'best', 'median'])
+
+
+def benchmark(group, name=None):
+    """Register the decorated function as a benchmark. The function is
+    invoked once to return the callable that is timed, allowing for setup
+    to be excluded from the measurement.
+
+    :param str group: The group the benchmark is reported in
+    :param str name: The benchmark name, defaulting to the function name
+
+    """
+    def wrapper(func):
+        REGISTRY['{}.{}'.format(group, name or func.__name__)] = group, func
+        return func
+    return wrapper
+
+
+def run(pattern=None, rounds=5, min_time=0.2):
+    """Run the registered benchmarks, returning a list of :class:`Result`.
+
+    :param str pattern: Only run benchmarks whose name contains the pattern
+    :param int rounds: The number of timed rounds for each benchmark
+    :param float min_time: The minimum duration of each round in seconds
+    :rtype: list
+
+    """
+    results = []
+    for name, (group, setup) in REGISTRY.items():
+        if pattern and pattern not in name:
+            continue
+        func = setup()
+        timer = timeit.Timer(func)
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 2
+        timings = [timer.timeit(number) / number for _round in range(rounds)]
+        results.append(Result(name, group, rounds, number,
+                              min(timings), statistics.median(timings)))
+        report(results[-1])
+    return results
+
+
+def report(result, previous=None):
+    """Write a single result to stdout, including the change from the
+    previous result if one is provided.
+
+    :param Result result: The result to report
+    :param dict previous: The previous result for the benchmark
+
+    """
+    line = '{:<48} {:>12}  (median {:>12})'.format(
+        result.name, _format(result.best), _format(result.median))
+    if previous:
+        line += '  {:+7.1%}'.format(
+            result.best / previous['best'] - 1)
+    sys.stdout.write(line + '\n')
+
+
+def save(results, path):
+    """Save the results to ``path`` as JSON.
+
+    :param list results: The results to save
+    :param str path: The file to write
+
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as handle:
+        json.dump({
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'results': [r._asdict() for r in results]}, handle, indent=2)
+
+
+def compare(results, path, threshold=0.1):
+    """Compare the results with previously saved results, returning the
+    names of the benchmarks that are slower by more than ``threshold``.
+
+    :param list results: The current results
+    :param str path: The file the previous results were saved to
+    :param float threshold: The allowed slowdown as a fraction
+    :rtype: list
+
+    """
+    with open(path) as handle:
+        previous = {r['name']: r for r in json.load(handle)['results']}
+    sys.stdout.write('\nCompared to {}:\n'.format(path))
+    regressions = []
+    for result in results:
+        if result.name not in previous:
+            continue
+        report(result, previous[result.name])
+        if result.best > previous[result.name]['best'] * (1 + threshold):
+            regressions.append(result.name)
+    return regressions
+
+
+def _format(seconds):
+    """Format a duration using the most readable unit.
+
+    :param float seconds: The duration
+    :rtype: str
+
+    """
+    for unit, scale in [('s', 1), ('ms', 1e3), ('us', 1e6)]:
+        if seconds * scale >= 1:
+            return '{:.3f} {}'.format(seconds * scale, unit)
+    return '{:.3f} ns'.format(seconds * 1e9)
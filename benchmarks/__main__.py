@@ -0,0 +1,47 @@
+"""
+Run the benchmarks::
+
+    python -m benchmarks [--filter NAME] [--save PATH] [--compare PATH]
+
+"""
+import argparse
+import logging
+import sys
+
+import benchmarks
+from benchmarks import codec, overhead, signing  # noqa: F401
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks', description='Run the benchmark suite')
+    parser.add_argument('--filter', help='Only run matching benchmarks')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Timed rounds per benchmark (default: 5)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Minimum seconds per round (default: 0.2)')
+    parser.add_argument('--save', metavar='PATH',
+                        help='Write the results to PATH as JSON')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare the results to a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown reported as a regression when '
+                             'comparing (default: 0.1)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = benchmarks.run(args.filter, args.rounds, args.min_time)
+    if args.save:
+        benchmarks.save(results, args.save)
+    if args.compare:
+        regressions = benchmarks.compare(
+            results, args.compare, args.threshold)
+        if regressions:
+            sys.stdout.write('\nRegressions: {}\n'.format(
+                ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Benchmarks for marshalling, unmarshalling and unwrapping responses, and
+for the per-request bookkeeping of the client.
+
+"""
+from benchmarks import benchmark, items
+from sprockets_dynamodb import client, columnar, hotkeys, schema, utils
+
+
+def _register(shape):
+
+    @benchmark('marshall', shape.__name__)
+    def marshall():
+        value = shape()
+        return lambda: utils.marshall(value)
+
+    @benchmark('unmarshall', shape.__name__)
+    def unmarshall():
+        value = utils.marshall(shape())
+        return lambda: utils.unmarshall(value)
+
+    @benchmark('item_size', shape.__name__)
+    def item_size():
+        value = shape()
+        return lambda: utils.item_size(value)
+
+
+for _shape in items.SHAPES:
+    _register(_shape)
+
+
+@benchmark('unwrap')
+def get_item():
+    result = {'Item': utils.marshall(items.simple()),
+              'ConsumedCapacity': {'TableName': 'bench',
+                                   'CapacityUnits': 0.5}}
+    return lambda: client._unwrap_result('GetItem', result)
+
+
+@benchmark('unwrap')
+def put_item():
+    result = {'Attributes': utils.marshall(items.simple())}
+    return lambda: client._unwrap_result('PutItem', result)
+
+
+@benchmark('unwrap')
+def query_page():
+    page = [utils.marshall(items.simple()) for _offset in range(100)]
+    result = {'Count': 100, 'ScannedCount': 100, 'Items': page,
+              'LastEvaluatedKey': {'id': {'S': 'last'}}}
+    return lambda: client._unwrap_result('Query', result)
+
+
+@benchmark('unwrap')
+def query_page_columnar():
+    page = [utils.marshall(items.simple()) for _offset in range(100)]
+    return lambda: columnar.Columns().extend(page)
+
+
+def _register_schema(shape):
+    sample = shape()
+    compiled = schema.Schema.infer(sample)
+
+    @benchmark('schema_marshall', shape.__name__)
+    def marshall():
+        return lambda: compiled.marshall(sample)
+
+    @benchmark('schema_unmarshall', shape.__name__)
+    def unmarshall():
+        value = utils.marshall(sample)
+        return lambda: compiled.unmarshall(value)
+
+    records = schema.Schema.infer(sample, records=True)
+
+    @benchmark('schema_unmarshall_records', shape.__name__)
+    def unmarshall_records():
+        value = utils.marshall(sample)
+        return lambda: records.unmarshall(value)
+
+
+for _shape in items.SHAPES:
+    _register_schema(_shape)
+
+
+@benchmark('hot_keys')
+def record():
+    tracker = hotkeys.HotKeyTracker()
+    keys = [utils.marshall({'id': str(offset)}) for offset in range(1000)]
+    keys = iter(keys * 10000)
+    return lambda: tracker.record('bench', next(keys))
@@ -0,0 +1,58 @@
+"""
+Item shapes used by the benchmarks, modelled on the kinds of documents
+that are stored in production tables.
+
+"""
+import datetime
+import uuid
+
+
+def simple():
+    """A narrow item with a handful of scalar attributes."""
+    return {
+        'id': str(uuid.UUID(int=1)),
+        'created_at': datetime.datetime(2019, 11, 17, 12, 0, 0).isoformat(),
+        'name': 'Example Item',
+        'count': 42,
+        'score': 98.6,
+        'active': True,
+        'deleted': None
+    }
+
+
+def wide():
+    """A map with a large number of scalar attributes."""
+    item = {'id': str(uuid.UUID(int=2))}
+    for offset in range(200):
+        item['string-{}'.format(offset)] = 'value-{}'.format(offset)
+        item['number-{}'.format(offset)] = offset
+    return item
+
+
+def nested(depth=20):
+    """A document with deeply nested maps and lists."""
+    value = {'leaf': 'value', 'numbers': [1, 2, 3], 'flag': False}
+    for level in range(depth):
+        value = {'level': level, 'child': value, 'siblings': [level, 'x']}
+    return {'id': str(uuid.UUID(int=3)), 'document': value}
+
+
+def sets():
+    """An item with large string and number sets."""
+    return {
+        'id': str(uuid.UUID(int=4)),
+        'tags': {'tag-{}'.format(offset) for offset in range(1000)},
+        'scores': set(range(1000))
+    }
+
+
+def binary():
+    """An item with a large binary attribute and a binary set."""
+    return {
+        'id': str(uuid.UUID(int=5)),
+        'blob': bytes(range(256)) * 400,
+        'chunks': {bytes([offset]) * 64 for offset in range(1, 64)}
+    }
+
+
+SHAPES = [simple, wide, nested, sets, binary]
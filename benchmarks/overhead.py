@@ -0,0 +1,118 @@
+"""
+End-to-end benchmarks of the :class:`~sprockets_dynamodb.client.Client`
+overhead against a local HTTP server that returns canned responses, so
+that the measurement is dominated by request building, signing and
+response processing rather than by DynamoDB itself.
+
+"""
+import json
+
+from tornado import gen, httpserver, ioloop, netutil, web
+
+from benchmarks import benchmark, items
+from sprockets_dynamodb import client, utils
+
+PAGE_SIZE = 100
+CONCURRENCY = 100
+
+
+class CannedResponseHandler(web.RequestHandler):
+    """Returns a fixed response for each supported action."""
+
+    RESPONSES = {
+        'GetItem': json.dumps(
+            {'Item': utils.marshall(items.simple())}).encode('utf-8'),
+        'PutItem': b'{}',
+        'Query': json.dumps({
+            'Count': PAGE_SIZE, 'ScannedCount': PAGE_SIZE,
+            'Items': [utils.marshall(items.simple())
+                      for _offset in range(PAGE_SIZE)]}).encode('utf-8')}
+
+    def post(self):
+        action = self.request.headers['x-amz-target'].split('.')[-1]
+        self.set_header('Content-Type', 'application/x-amz-json-1.0')
+        self.write(self.RESPONSES[action])
+
+
+class Environment(object):
+    """Runs the canned response server and a client on a private IOLoop."""
+
+    def __init__(self):
+        self.io_loop = ioloop.IOLoop()
+        self.client = None
+        self.io_loop.run_sync(self._start)
+
+    @gen.coroutine
+    def _start(self):
+        sockets = netutil.bind_sockets(0, '127.0.0.1')
+        server = httpserver.HTTPServer(web.Application(
+            [('/', CannedResponseHandler)]))
+        server.add_sockets(sockets)
+        port = sockets[0].getsockname()[1]
+        self.client = client.Client(
+            endpoint='http://127.0.0.1:{}'.format(port),
+            region='us-east-1', access_key='benchmark',
+            secret_key='benchmark', max_clients=CONCURRENCY)
+
+    def run(self, factory, concurrency=1):
+        """Return a callable that runs ``concurrency`` requests created by
+        ``factory`` to completion.
+
+        :param callable factory: Returns the future for a single request
+        :param int concurrency: The number of concurrent requests
+        :rtype: callable
+
+        """
+        if concurrency == 1:
+            return lambda: self.io_loop.run_sync(factory)
+        return lambda: self.io_loop.run_sync(
+            lambda: gen.multi([factory() for _offset in range(concurrency)]))
+
+
+_environment = None
+
+
+def _get_environment():
+    global _environment
+    if _environment is None:
+        _environment = Environment()
+    return _environment
+
+
+@benchmark('client')
+def get_item():
+    env = _get_environment()
+    return env.run(lambda: env.client.get_item('bench', {'id': 'bench'}))
+
+
+@benchmark('client')
+def put_item():
+    env = _get_environment()
+    item = items.simple()
+    return env.run(lambda: env.client.put_item('bench', item))
+
+
+@benchmark('client')
+def query_page():
+    env = _get_environment()
+    return env.run(lambda: env.client.query(
+        'bench', key_condition_expression='#id = :id',
+        expression_attribute_names={'#id': 'id'},
+        expression_attribute_values={':id': 'bench'}))
+
+
+@benchmark('client', 'get_item_x{}'.format(CONCURRENCY))
+def concurrent_get_item():
+    env = _get_environment()
+    return env.run(lambda: env.client.get_item('bench', {'id': 'bench'}),
+                   CONCURRENCY)
+
+
+@benchmark('client')
+def query_page_streamed():
+    env = _get_environment()
+    return env.run(lambda: env.client.query(
+        'bench', key_condition_expression='#id = :id',
+        expression_attribute_names={'#id': 'id'},
+        expression_attribute_values={':id': 'bench'},
+        item_callback=lambda item: None))
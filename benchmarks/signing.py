@@ -0,0 +1,37 @@
+"""
+Benchmarks of SigV4 request signing, comparing the cached signing path of
+:class:`~sprockets_dynamodb.transport.AsyncAWSClient` with the
+:class:`tornado_aws.client.AsyncAWSClient` implementation it replaces.
+
+"""
+import json
+
+import tornado_aws
+
+from benchmarks import benchmark, items
+from sprockets_dynamodb import transport, utils
+
+BODY = json.dumps({'TableName': 'bench',
+                   'Item': utils.marshall(items.simple())}).encode('utf-8')
+
+
+def _sign(cls):
+    client = cls('dynamodb', region='us-east-1', access_key='benchmark',
+                 secret_key='benchmark', endpoint='http://127.0.0.1:8000')
+
+    def sign():
+        client._signed_request(
+            'POST', '/', {}, {
+                'x-amz-target': 'DynamoDB_20120810.PutItem',
+                'Content-Type': 'application/x-amz-json-1.0'}, BODY)
+    return sign
+
+
+@benchmark('signing')
+def tornado_aws_request():
+    return _sign(tornado_aws.AsyncAWSClient)
+
+
+@benchmark('signing')
+def transport_request():
+    return _sign(transport.AsyncAWSClient)
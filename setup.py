@@ -52,7 +52,9 @@ setuptools.setup(
     test_suite='nose.collector',
     tests_require=read_requirements('testing.txt'),
     extras_require={
-        'influxdb': ['sprockets-influxdb>=2,<3']
+        'influxdb': ['sprockets-influxdb>=2,<3'],
+        'numpy': ['numpy'],
+        'zstd': ['zstandard']
     },
     zip_safe=True
 )
@@ -0,0 +1,334 @@
+"""
+Large Attribute Offload
+=======================
+
+Items are limited to 400 KB and are charged for their full size whenever
+they are read, even when a large attribute is not needed. An
+:class:`Offload` registered for a table with
+:meth:`~sprockets_dynamodb.client.Client.register_offload` moves the
+attribute values above a size threshold of the items written by the client
+to a blob store, replacing them in the item with a small pointer map:
+
+.. code:: python
+
+    offload = Offload(FileStore('/var/lib/blobs'), threshold=32768)
+    client.register_offload('example', offload)
+    yield client.put_item('example', {'id': 'a', 'body': large_value})
+
+    result = yield client.get_item('example', {'id': 'a'})
+    item = yield offload.load(result['Item'])
+
+Items are returned with the pointers in place of the offloaded values, so
+that a blob is only fetched when it is needed. :meth:`Offload.load`
+fetches the blobs of an item, or of the named attributes, concurrently.
+
+Blobs are stored under the table name and the SHA-256 digest of their
+content, so writing the same value twice stores it once and retried writes
+do not leave partial blobs behind. Blobs are not deleted when the items
+pointing to them are overwritten or deleted.
+
+:class:`FileStore` stores blobs in a local directory and :class:`S3Store`
+in an S3 compatible bucket. Other stores implement the :class:`BlobStore`
+interface.
+
+"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+
+from tornado import gen, ioloop
+
+from sprockets_dynamodb import compression, transport, utils
+
+#: The name of the attribute that identifies a pointer map
+POINTER = '$blob'
+
+_TEXT, _BINARY, _JSON = 'S', 'B', 'J'
+
+
+class BlobStore(object):
+    """The interface of the stores blobs are offloaded to. Each method
+    returns a :class:`~tornado.concurrent.Future`.
+
+    """
+    def put(self, key, data):
+        """Store a blob.
+
+        :param str key: The blob key
+        :param bytes data: The blob content
+        :rtype: tornado.concurrent.Future
+
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the content of a blob.
+
+        :param str key: The blob key
+        :rtype: tornado.concurrent.Future
+
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Delete a blob.
+
+        :param str key: The blob key
+        :rtype: tornado.concurrent.Future
+
+        """
+        raise NotImplementedError
+
+
+class FileStore(BlobStore):
+    """Stores blobs as files in a local directory. Files are written to a
+    temporary file and renamed into place on the default executor of the
+    IOLoop.
+
+    :param str path: The directory to store the blobs in
+    :param concurrent.futures.Executor executor: The executor to perform
+        file operations on, defaulting to the executor of the IOLoop
+
+    """
+    def __init__(self, path, executor=None):
+        self.path = path
+        self.executor = executor
+
+    def put(self, key, data):
+        return self._run(self._put, self._path(key), data)
+
+    def get(self, key):
+        return self._run(self._get, self._path(key))
+
+    def delete(self, key):
+        return self._run(self._delete, self._path(key))
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.path, key))
+        if not path.startswith(os.path.normpath(self.path) + os.sep):
+            raise ValueError('Invalid blob key: {!r}'.format(key))
+        return path
+
+    def _run(self, method, *args):
+        return ioloop.IOLoop.current().run_in_executor(
+            self.executor, method, *args)
+
+    @staticmethod
+    def _put(path, data):
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(handle, 'wb') as blob:
+                blob.write(data)
+            os.replace(temporary, path)
+        except Exception:
+            os.unlink(temporary)
+            raise
+
+    @staticmethod
+    def _get(path):
+        with open(path, 'rb') as blob:
+            return blob.read()
+
+    @staticmethod
+    def _delete(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class S3Store(BlobStore):
+    """Stores blobs as objects in an S3 compatible bucket, using path style
+    requests. When ``client`` is passed, requests are signed with the
+    credentials of the DynamoDB client, including explicitly passed keys
+    and credentials refreshed in the background, and are sent to its
+    region by default. Otherwise the credentials are resolved for the
+    ``profile`` as they are for a client.
+
+    :param str bucket: The bucket name
+    :param str prefix: The prefix of the object keys
+    :param str endpoint: The S3 endpoint, defaulting to the endpoint of
+        the region
+    :param str region: The AWS region
+    :param str profile: The AWS profile to use for credentials
+    :param sprockets_dynamodb.client.Client client: The DynamoDB client to
+        share credentials with
+
+    """
+    def __init__(self, bucket, prefix='', endpoint=None, region=None,
+                 profile=None, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        if client is not None and region is None:
+            region = client._client._region
+        self._client = transport.AsyncAWSClient(
+            's3', profile=profile, region=region, endpoint=endpoint)
+        if client is not None:
+            self._client._auth_config = client._client._auth_config
+
+    def put(self, key, data):
+        return self._client.fetch('PUT', self._path(key), body=data)
+
+    @gen.coroutine
+    def get(self, key):
+        response = yield self._client.fetch('GET', self._path(key))
+        raise gen.Return(response.body)
+
+    def delete(self, key):
+        return self._client.fetch('DELETE', self._path(key))
+
+    def close(self):
+        """Close the HTTP client of the store. The credentials shared with
+        a DynamoDB client are stopped by
+        :meth:`~sprockets_dynamodb.client.Client.close`.
+
+        """
+        self._client.close()
+
+    def _path(self, key):
+        return '/{}/{}{}'.format(self.bucket, self.prefix, key)
+
+
+class Offload(object):
+    """Moves large attribute values of items to a :class:`BlobStore`.
+
+    :param BlobStore store: The store to offload values to
+    :param int threshold: The minimum size of a value in bytes for it to
+        be offloaded, see :func:`~sprockets_dynamodb.utils.item_size`
+    :param list attributes: The names of the top-level attributes that may
+        be offloaded, defaulting to every attribute
+
+    """
+    def __init__(self, store, threshold=65536, attributes=None):
+        self.store = store
+        self.threshold = threshold
+        self.attributes = frozenset(attributes) if attributes else None
+
+    def __repr__(self):
+        return '<Offload {!r} >= {}>'.format(self.store, self.threshold)
+
+    @gen.coroutine
+    def offload(self, table_name, values):
+        """Store the large values of marshalled item values, returning the
+        values with pointers in their place. The values are returned as
+        they are if there is nothing to offload.
+
+        :param str table_name: The table name
+        :param dict values: The AttributeValues of the item
+        :rtype: dict
+
+        """
+        offloaded, uploads = None, []
+        for name, value in values.items():
+            size = utils._attribute_value_size(value)
+            if not self._offloaded(name, value, size):
+                continue
+            kind, data = _encode(value)
+            key = '{}/{}'.format(
+                table_name, hashlib.sha256(data).hexdigest())
+            uploads.append(self.store.put(key, data))
+            if offloaded is None:
+                offloaded = dict(values)
+            offloaded[name] = {'M': {
+                POINTER: {'S': key}, 'type': {'S': kind},
+                'size': {'N': str(size)}}}
+        yield uploads
+        raise gen.Return(values if offloaded is None else offloaded)
+
+    def retained_size(self, values):
+        """Return the size of marshalled item values without the values
+        that :meth:`offload` would move to the store, not counting their
+        pointers. See :func:`~sprockets_dynamodb.utils.item_size`.
+
+        :param dict values: The AttributeValues of the item
+        :rtype: int
+
+        """
+        retained = 0
+        for name, value in values.items():
+            size = utils._attribute_value_size(value)
+            if not self._offloaded(name, value, size):
+                retained += len(name.encode('utf-8')) + size
+        return retained
+
+    @gen.coroutine
+    def load(self, item, attributes=None):
+        """Fetch the offloaded values of an unmarshalled item concurrently,
+        returning a :class:`dict` of the item with the values in place of
+        their pointers.
+
+        :param dict item: The item
+        :param list attributes: Only fetch the values of these attributes
+        :rtype: dict
+
+        """
+        names = [name for name, value in item.items()
+                 if (attributes is None or name in attributes) and
+                 is_pointer(value)]
+        item = dict(item)
+        if names:
+            blobs = yield [self.store.get(item[name][POINTER])
+                           for name in names]
+            for name, data in zip(names, blobs):
+                item[name] = _decode(item[name]['type'], data)
+        raise gen.Return(item)
+
+    def _offloaded(self, name, value, size):
+        """Return :data:`True` if an AttributeValue is moved to the store.
+
+        :param str name: The attribute name
+        :param dict value: The AttributeValue
+        :param int size: The size of the value
+
+        """
+        return size >= self.threshold and \
+            (self.attributes is None or name in self.attributes) and \
+            not is_pointer(value.get('M'))
+
+
+def is_pointer(value):
+    """Return :data:`True` if an unmarshalled value is a pointer to an
+    offloaded value.
+
+    :param mixed value: The value
+    :rtype: bool
+
+    """
+    return isinstance(value, dict) and POINTER in value
+
+
+def _encode(value):
+    """Return the pointer type and blob content of an AttributeValue.
+
+    :param dict value: The AttributeValue
+    :rtype: (str, bytes)
+
+    """
+    if 'S' in value:
+        return _TEXT, value['S'].encode('utf-8')
+    elif 'B' in value:
+        return _BINARY, base64.b64decode(value['B'])
+    return _JSON, json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _decode(kind, data):
+    """Return the unmarshalled value of blob content.
+
+    :param str kind: The pointer type
+    :param bytes data: The blob content
+    :rtype: mixed
+
+    """
+    if kind == _TEXT:
+        return data.decode('utf-8')
+    elif kind == _BINARY and not data.startswith(compression.MAGIC):
+        return data
+    elif kind == _BINARY:
+        return utils._unmarshall_dict(
+            {'B': base64.b64encode(data).decode('ascii')})
+    return utils._unmarshall_dict(json.loads(data.decode('utf-8')))
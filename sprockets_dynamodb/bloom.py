@@ -0,0 +1,149 @@
+"""
+Existence Filters
+=================
+
+A :class:`BloomFilter` of the keys of a table lets the
+:class:`~sprockets_dynamodb.client.Client` answer ``GetItem`` requests for
+keys that do not exist without a round trip to DynamoDB. Build the filter
+with a keys-only parallel scan of the table, which registers it with the
+client:
+
+.. code:: python
+
+    yield bloom.build(client, 'example', segments=8)
+    result = yield client.get_item('example', {'id': 'missing'})
+
+Bloom filters never report a key that was added as missing, and report a
+missing key as present at the configured false positive rate, in which
+case the request is sent as usual. Keys written through the client while
+and after the filter is built are added to it. Because writes made by
+other clients are not seen, a filter must only be used for tables that are
+written to exclusively through the client, or be rebuilt at an interval
+that is acceptable for new items to be reported as missing. Deleted keys
+remain in the filter until it is rebuilt. A PartiQL statement executed
+through the client disables the filters, since the keys it writes are
+unknown.
+
+Consistent reads are always sent to DynamoDB.
+
+"""
+import hashlib
+import logging
+import math
+
+from tornado import gen
+
+from sprockets_dynamodb import cache
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+    """A Bloom filter of the keys of a table.
+
+    :param int capacity: The number of keys the filter is sized for
+    :param float error_rate: The false positive rate at capacity
+    :param list key_names: The names of the key attributes of the table
+
+    .. attribute:: ready
+
+        :data:`True` once the filter contains every key of the table and can
+        be used to answer lookups
+
+    """
+    def __init__(self, capacity, error_rate=0.01, key_names=None):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.key_names = tuple(key_names or ())
+        self.count = 0
+        self.ready = False
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def __contains__(self, key):
+        """Return :data:`False` if the key was never added.
+
+        :param dict key: The AttributeValues of the key
+        :rtype: bool
+
+        """
+        bits = self._bits
+        for offset in self._offsets(key):
+            if not bits[offset >> 3] & (1 << (offset & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        """Add the key of an item.
+
+        :param dict key: The AttributeValues of the key, or of the item when
+            the key names are set
+
+        """
+        if self.key_names:
+            key = {name: key[name] for name in self.key_names}
+        bits = self._bits
+        for offset in self._offsets(key):
+            bits[offset >> 3] |= 1 << (offset & 7)
+        self.count += 1
+
+    def _offsets(self, key):
+        digest = hashlib.blake2b(
+            cache.key_fingerprint(key), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(first + offset * second) % size
+                for offset in range(self.hashes)]
+
+
+@gen.coroutine
+def build(client, table_name, segments=4, error_rate=0.01, capacity=None,
+          growth=2.0):
+    """Build a :class:`BloomFilter` of the keys of a table with a keys-only
+    parallel scan and register it with the client.
+
+    :param sprockets_dynamodb.client.Client client: The client
+    :param str table_name: The table to scan
+    :param int segments: The number of parallel scan segments
+    :param float error_rate: The false positive rate at capacity
+    :param int capacity: The number of keys to size the filter for,
+        defaulting to the item count of the table multiplied by ``growth``
+    :param float growth: The room left for new keys when the capacity is
+        taken from the item count
+    :rtype: BloomFilter
+
+    """
+    description = yield client.describe_table(table_name)
+    key_names = [key['AttributeName'] for key in description['KeySchema']]
+    if capacity is None:
+        capacity = int(description.get('ItemCount', 0) * growth) or 1024
+    bloom = BloomFilter(capacity, error_rate, key_names)
+    client.register_bloom_filter(table_name, bloom)
+    names = {'#k{}'.format(offset): name
+             for offset, name in enumerate(key_names)}
+
+    @gen.coroutine
+    def scan_segment(segment):
+        kwargs = {'segment': segment, 'total_segments': segments,
+                  'projection_expression': ', '.join(sorted(names)),
+                  'expression_attribute_names': names,
+                  'item_callback': bloom.add, 'raw_items': True}
+        while True:
+            result = yield client.scan(table_name, **kwargs)
+            if not result.get('LastEvaluatedKey'):
+                break
+            kwargs['exclusive_start_key'] = result['LastEvaluatedKey']
+
+    LOGGER.info('Building the key filter of %s with %i segments',
+                table_name, segments)
+    try:
+        yield [scan_segment(segment) for segment in range(segments)]
+    except Exception:
+        client.register_bloom_filter(table_name, None)
+        raise
+    bloom.ready = True
+    LOGGER.info('Built the key filter of %s with %i keys in %i bytes',
+                table_name, bloom.count, len(bloom._bits))
+    raise gen.Return(bloom)
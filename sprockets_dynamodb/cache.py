@@ -0,0 +1,500 @@
+"""
+Query Result Cache
+==================
+
+An opt-in cache of :meth:`~sprockets_dynamodb.client.Client.query` results
+for tables that are queried with the same parameters at a high rate and
+change slowly. Enable it by passing ``query_cache=True``, or a
+:class:`QueryCache`, to the :class:`~sprockets_dynamodb.client.Client`:
+
+.. code:: python
+
+    client = Client(query_cache=QueryCache(ttl=30, max_size=64 * 1024 ** 2))
+
+Results are keyed by a hash of the canonical JSON form of the marshalled
+request payload, so queries with the same key condition, filter,
+projection, values and start key share an entry regardless of the order
+the parameters were built in. Entries expire after ``ttl`` seconds and the
+least recently used entries are evicted once the estimated size of the
+cached results exceeds ``max_size`` bytes.
+
+Writes made through the same client invalidate the entries of the
+partition keys they write to, which are determined from the equality
+conditions of each query's key condition expression. Queries of a
+secondary index, and queries whose key condition cannot be parsed, are
+invalidated by any write to the table. Writes made by other clients are
+only seen once the entries expire. Queries with ``ConsistentRead`` or an
+``item_callback`` are not cached.
+
+The cached items are shared: the result that is cached and each hit have
+their own result :class:`dict` and ``Items`` list, but the items
+themselves must not be modified.
+
+A :class:`NegativeCache` remembers the keys that
+:meth:`~sprockets_dynamodb.client.Client.get_item` did not find for a few
+seconds, so that repeated lookups of missing items return immediately. It
+is enabled with ``negative_cache=True`` and is invalidated by writes in the
+same way. See :mod:`sprockets_dynamodb.bloom` for answering lookups of
+missing keys without an earlier miss.
+
+"""
+import collections
+import decimal
+import hashlib
+import json
+import re
+import sys
+import time
+
+WRITE_ACTIONS = {'BatchWriteItem', 'DeleteItem', 'PutItem',
+                 'TransactWriteItems', 'UpdateItem'}
+TABLE_ACTIONS = {'DeleteTable', 'UpdateTable'}
+STATEMENT_ACTIONS = {'BatchExecuteStatement', 'ExecuteStatement',
+                     'ExecuteTransaction'}
+
+_EQUALITY = re.compile(
+    r'(\#?[A-Za-z_]\w*)\s*=\s*(:\w+)|(:\w+)\s*=\s*(\#?[A-Za-z_]\w*)')
+
+
+class _Entry(object):
+
+    __slots__ = ('result', 'size', 'expires', 'table', 'keys')
+
+    def __init__(self, result, size, expires, table, keys):
+        self.result = result
+        self.size = size
+        self.expires = expires
+        self.table = table
+        self.keys = keys
+
+
+class QueryCache(object):
+    """A size bounded LRU cache of query results with a time to live.
+
+    :param float ttl: Seconds a result is cached for
+    :param int max_size: The maximum estimated size of the cached results
+        in bytes
+
+    .. attribute:: hits
+
+        The number of queries answered from the cache
+
+    .. attribute:: misses
+
+        The number of cacheable queries that were not in the cache
+
+    """
+    def __init__(self, ttl=60.0, max_size=16 * 1024 ** 2):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._index = collections.defaultdict(set)
+        self._names = collections.defaultdict(collections.Counter)
+        self._generations = collections.Counter()
+        self._epoch = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, parameters):
+        """Return a copy of the cached result for the query parameters, or
+        :data:`None`.
+
+        :param dict parameters: The marshalled ``Query`` payload
+        :rtype: dict
+
+        """
+        digest = _digest(parameters)
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires <= time.monotonic():
+            self._remove(digest)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return _copy(entry.result)
+
+    def generation(self, table):
+        """Return the write generation of a table, which is passed to
+        :meth:`put` so that results of queries that were in flight during a
+        write are not cached.
+
+        :param str table: The table name
+        :rtype: tuple
+
+        """
+        return self._epoch, self._generations[table]
+
+    def put(self, parameters, result, generation):
+        """Cache a copy of the unwrapped result of a query.
+
+        :param dict parameters: The marshalled ``Query`` payload
+        :param dict result: The unwrapped result
+        :param tuple generation: The :meth:`generation` of the table when
+            the query was sent
+
+        """
+        table = parameters.get('TableName')
+        if generation != self.generation(table):
+            return
+        size = _sizeof(result)
+        if size > self.max_size:
+            return
+        digest = _digest(parameters)
+        if digest in self._entries:
+            self._remove(digest)
+        keys = _partition_keys(parameters)
+        self._entries[digest] = _Entry(
+            _copy(result), size, time.monotonic() + self.ttl, table, keys)
+        self.size += size
+        for key in keys:
+            self._index[table, key].add(digest)
+            if key is not None:
+                self._names[table][key[0]] += 1
+        while self.size > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, table=None):
+        """Remove every entry of a table, or every entry.
+
+        :param str table: The table name
+
+        """
+        if table is None:
+            self._epoch += 1
+            self._entries.clear()
+            self._index.clear()
+            self._names.clear()
+            self.size = 0
+            return
+        self._generations[table] += 1
+        for digest in [digest for digest, entry in self._entries.items()
+                       if entry.table == table]:
+            self._remove(digest)
+
+    def invalidate_write(self, action, parameters):
+        """Remove the entries that a write action could make stale.
+
+        :param str action: The action name
+        :param dict parameters: The marshalled action payload
+
+        """
+        if action in STATEMENT_ACTIONS:
+            self.invalidate()
+        elif action in TABLE_ACTIONS:
+            self.invalidate(parameters.get('TableName'))
+        else:
+            for table, item in written_items(action, parameters):
+                self._invalidate_item(table, item)
+
+    def _invalidate_item(self, table, item):
+        """Remove the entries of the partition key of a written item, and
+        the entries of the table that are invalidated by any write.
+
+        :param str table: The table name
+        :param dict item: The AttributeValues of the key or item
+
+        """
+        self._generations[table] += 1
+        digests = set(self._index.get((table, None), ()))
+        names = self._names.get(table)
+        for name, value in item.items():
+            if names and name in names:
+                digests.update(self._index.get(
+                    (table, _partition_key(name, value)), ()))
+        for digest in digests:
+            self._remove(digest)
+
+    def _remove(self, digest):
+        entry = self._entries.pop(digest)
+        self.size -= entry.size
+        for key in entry.keys:
+            digests = self._index[entry.table, key]
+            digests.discard(digest)
+            if not digests:
+                del self._index[entry.table, key]
+            if key is not None:
+                names = self._names[entry.table]
+                names[key[0]] -= 1
+                if not names[key[0]]:
+                    del names[key[0]]
+
+
+def read_variant(parameters):
+    """Return the parameters of a ``GetItem`` other than its table and key
+    that change whether it finds an item: its read consistency and
+    projection.
+
+    :param dict parameters: The marshalled ``GetItem`` payload
+    :rtype: tuple
+
+    """
+    return (bool(parameters.get('ConsistentRead')),
+            parameters.get('ProjectionExpression'),
+            tuple(sorted((parameters.get('ExpressionAttributeNames') or
+                          {}).items())))
+
+
+#: The :func:`read_variant` of an eventually consistent read of a whole item
+DEFAULT_VARIANT = read_variant({})
+
+
+class NegativeCache(object):
+    """Remembers the keys that ``GetItem`` did not find for a short time, so
+    that repeated lookups of missing items do not reach DynamoDB. Writes
+    made through the client remove the keys they write from the cache.
+
+    Misses are remembered for the :func:`read_variant` of the lookup, as a
+    projected read of an item finds nothing when the item exists but does
+    not have the projected attributes.
+
+    :param float ttl: Seconds a missing key is remembered for
+    :param int max_entries: The maximum number of keys remembered, after
+        which the oldest are evicted
+
+    """
+    def __init__(self, ttl=5.0, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self._entries = collections.OrderedDict()
+        self._variants = {}
+        self._key_names = {}
+        self._generations = collections.Counter()
+        self._epoch = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, table_key):
+        """Return :data:`True` if the key of the table is known to be
+        missing.
+
+        :param tuple table_key: The table name and the AttributeValues of
+            the key, optionally followed by the :func:`read_variant` of the
+            lookup
+
+        """
+        table, key, variant = (tuple(table_key) + (DEFAULT_VARIANT,))[:3]
+        entry = table, key_fingerprint(key), variant
+        expires = self._entries.get(entry)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            self._remove(entry)
+            return False
+        self.hits += 1
+        return True
+
+    def generation(self, table):
+        """Return the write generation of a table, which is passed to
+        :meth:`add` so that a miss is not remembered when a write to the
+        table was made while the lookup was in flight.
+
+        :param str table: The table name
+        :rtype: tuple
+
+        """
+        return self._epoch, self._generations[table]
+
+    def add(self, table, key, generation, variant=DEFAULT_VARIANT):
+        """Remember that the key of the table was not found.
+
+        :param str table: The table name
+        :param dict key: The AttributeValues of the key
+        :param tuple generation: The :meth:`generation` of the table when the
+            lookup was sent
+        :param tuple variant: The :func:`read_variant` of the lookup
+
+        """
+        if generation != self.generation(table):
+            return
+        self._key_names.setdefault(table, tuple(key))
+        entry = table, key_fingerprint(key), variant
+        self._entries.pop(entry, None)
+        self._entries[entry] = time.monotonic() + self.ttl
+        self._variants.setdefault(entry[:2], set()).add(variant)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, table=None):
+        """Forget every missing key of a table, or of every table.
+
+        :param str table: The table name
+
+        """
+        if table is None:
+            self._epoch += 1
+            self._entries.clear()
+            self._variants.clear()
+            return
+        self._generations[table] += 1
+        for entry in [entry for entry in self._entries if entry[0] == table]:
+            self._remove(entry)
+
+    def invalidate_write(self, action, parameters):
+        """Forget the missing keys that a write action writes.
+
+        :param str action: The action name
+        :param dict parameters: The marshalled action payload
+
+        """
+        if action in STATEMENT_ACTIONS:
+            self.invalidate()
+            return
+        elif action in TABLE_ACTIONS:
+            self.invalidate(parameters.get('TableName'))
+            return
+        for table, item in written_items(action, parameters):
+            self._generations[table] += 1
+            names = self._key_names.get(table)
+            if names and all(name in item for name in names):
+                key = table, key_fingerprint(
+                    {name: item[name] for name in names})
+                for variant in self._variants.pop(key, ()):
+                    self._entries.pop(key + (variant,), None)
+
+    def _remove(self, entry):
+        """Forget an entry.
+
+        :param tuple entry: The table, key fingerprint and read variant
+
+        """
+        del self._entries[entry]
+        variants = self._variants.get(entry[:2])
+        if variants is not None:
+            variants.discard(entry[2])
+            if not variants:
+                del self._variants[entry[:2]]
+
+
+def key_fingerprint(key):
+    """Return a canonical byte string for the AttributeValues of a key, with
+    numbers normalized so that keys that DynamoDB considers equal have the
+    same fingerprint.
+
+    :param dict key: The AttributeValues of the key
+    :rtype: bytes
+
+    """
+    parts = []
+    for name in sorted(key):
+        (kind, value), = key[name].items()
+        if kind == 'N':
+            value = str(decimal.Decimal(value).normalize())
+        parts.append('{}\x00{}\x00{}'.format(name, kind, value))
+    return '\x01'.join(parts).encode('utf-8')
+
+
+def written_items(action, parameters):
+    """Return the table and AttributeValues of each item an action writes or
+    deletes, which are those of the key for updates and deletes and of the
+    whole item for puts.
+
+    :param str action: The action name
+    :param dict parameters: The marshalled action payload
+    :rtype: iterator
+
+    """
+    if action == 'BatchWriteItem':
+        for table, requests in parameters.get('RequestItems', {}).items():
+            for request in requests:
+                for value in request.values():
+                    yield table, value.get('Key') or value.get('Item') or {}
+    elif action == 'TransactWriteItems':
+        for request in parameters.get('TransactItems', []):
+            for kind, value in request.items():
+                if kind != 'ConditionCheck':
+                    yield value.get('TableName'), \
+                        value.get('Key') or value.get('Item') or {}
+    elif action in WRITE_ACTIONS:
+        yield parameters.get('TableName'), \
+            parameters.get('Key') or parameters.get('Item') or {}
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def _copy(result):
+    """Return a copy of an unwrapped result with its own ``Items`` list.
+
+    :param dict result: The unwrapped result
+    :rtype: dict
+
+    """
+    result = dict(result)
+    if 'Items' in result:
+        result['Items'] = list(result['Items'])
+    return result
+
+
+def _digest(parameters):
+    """Return the hash of the canonical form of the query parameters.
+
+    :param dict parameters: The marshalled ``Query`` payload
+    :rtype: bytes
+
+    """
+    return hashlib.blake2b(_canonical(parameters).encode('utf-8'),
+                           digest_size=16).digest()
+
+
+def _partition_keys(parameters):
+    """Return the :func:`_partition_key` of each equality condition of the
+    key condition expression of a query, or ``(None,)`` when any write to
+    the table must invalidate the query.
+
+    :param dict parameters: The marshalled ``Query`` payload
+    :rtype: tuple
+
+    """
+    expression = parameters.get('KeyConditionExpression')
+    if not expression or parameters.get('IndexName'):
+        return None,
+    names = parameters.get('ExpressionAttributeNames', {})
+    values = parameters.get('ExpressionAttributeValues', {})
+    keys = []
+    for match in _EQUALITY.finditer(expression):
+        name = match.group(1) or match.group(4)
+        value = values.get(match.group(2) or match.group(3))
+        if value is None:
+            return None,
+        keys.append(_partition_key(names.get(name, name), value))
+    return tuple(keys) or (None,)
+
+
+def _partition_key(name, value):
+    """Return the index key of an attribute value, normalized with
+    :func:`key_fingerprint` so that equal numbers have the same key.
+
+    :param str name: The attribute name
+    :param dict value: The AttributeValue
+    :rtype: tuple
+
+    """
+    return name, key_fingerprint({name: value})
+
+
+def _sizeof(value):
+    """Estimate the memory used by an unwrapped result.
+
+    :param mixed value: The value to measure
+    :rtype: int
+
+    """
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            _sizeof(key) + _sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value)
+    elif hasattr(value, 'items'):
+        return sys.getsizeof(value) + sum(
+            _sizeof(key) + _sizeof(item) for key, item in value.items())
+    return sys.getsizeof(value)
@@ -4,6 +4,7 @@ DynamoDB Client
 
 """
 import collections
+import contextlib
 import json
 import logging
 import os
@@ -11,18 +12,34 @@ import select as _select
 import socket
 import ssl
 import time
+from concurrent import futures
 
 from tornado import concurrent, gen, httpclient, ioloop
-import tornado_aws
 from tornado_aws import exceptions as aws_exceptions
 
-from sprockets_dynamodb import exceptions, utils
+from sprockets_dynamodb import (cache, credentials, exceptions, hotkeys,
+                                routing, transport, utils)
 
 LOGGER = logging.getLogger(__name__)
 
+Capacity = collections.namedtuple(
+    'Capacity', ['table', 'index', 'read_units', 'write_units'])
+
 Measurement = collections.namedtuple(
     'Measurement',
-    ['timestamp', 'action', 'table', 'attempt', 'duration', 'error'])
+    ['timestamp', 'action', 'table', 'attempt', 'duration', 'error',
+     'capacity', 'hot_keys'])
+Measurement.__new__.__defaults__ = ((), ())
+
+CAPACITY_ACTIONS = {'BatchGetItem', 'BatchWriteItem', 'DeleteItem', 'GetItem',
+                    'PutItem', 'Query', 'Scan', 'TransactGetItems',
+                    'TransactWriteItems', 'UpdateItem'}
+READ_ACTIONS = {'BatchGetItem', 'GetItem', 'Query', 'Scan',
+                'TransactGetItems'}
+STREAMING_ACTIONS = {'Query', 'Scan'}
+ITEM_ACTIONS = {'DeleteItem', 'GetItem', 'PutItem', 'UpdateItem'}
+PUT_ACTIONS = {'BatchWriteItem', 'PutItem', 'TransactWriteItems'}
+OFFLOAD_ACTIONS = PUT_ACTIONS
 
 
 class Client(object):
@@ -55,6 +72,56 @@ class Client(object):
     :keyword method on_error_callback: A method that is invoked when there is
         a request exception that can not automatically be retried or the
         maximum number of retries has been exceeded for a request.
+    :keyword tracer: An OpenTelemetry compatible tracer (any object that
+        implements ``start_as_current_span``) used to trace the execution of
+        actions. See :meth:`Client.set_tracer`.
+    :keyword str return_consumed_capacity: Request consumed capacity details
+        (``INDEXES`` or ``TOTAL``) for every action that supports it so that
+        they can be reported in the ``capacity`` field of each
+        :class:`Measurement`. Capacity details that were not explicitly
+        requested by the caller are removed from the result. Can also be set
+        with the :envvar:`DYNAMODB_RETURN_CONSUMED_CAPACITY` environment
+        variable.
+    :keyword bool refresh_credentials: Load the AWS credentials when the
+        client is created and refresh them in the background before they
+        expire, so that requests do not wait on credential lookups. See
+        :class:`~sprockets_dynamodb.credentials.CredentialProvider`. Enabled
+        by default, it can be disabled by setting the
+        :envvar:`DYNAMODB_REFRESH_CREDENTIALS` environment variable to
+        ``false``.
+    :keyword concurrent.futures.Executor decode_executor: An executor used
+        to decode and unmarshall response bodies of at least
+        ``decode_threshold`` bytes off of the IOLoop thread, so that large
+        ``Query`` and ``Scan`` pages do not delay other requests. With a
+        :class:`~concurrent.futures.ProcessPoolExecutor`, responses for
+        tables with a :class:`~sprockets_dynamodb.schema.Schema` that
+        returns records are still decoded on the IOLoop.
+    :keyword int decode_threshold: The response body size in bytes at which
+        responses are decoded with the ``decode_executor``. Can also be set
+        with the :envvar:`DYNAMODB_DECODE_THRESHOLD` environment variable.
+    :keyword list endpoints: Route requests over several endpoints with a
+        :class:`~sprockets_dynamodb.routing.Router`. Each endpoint is a URL,
+        or a :class:`dict` of keyword arguments such as ``endpoint`` and
+        ``region`` that override those of the client. Writes are sent to the
+        first endpoint and reads to the fastest healthy endpoint, failing
+        over to another endpoint when a read fails. Can also be set with the
+        :envvar:`DYNAMODB_ENDPOINTS` environment variable as a comma
+        separated list of URLs.
+    :keyword dict routing: Keyword arguments for the
+        :class:`~sprockets_dynamodb.routing.Router`
+    :keyword hot_keys: Track the request and throttle frequency of the keys
+        of ``GetItem``, ``PutItem``, ``UpdateItem`` and ``DeleteItem``
+        requests. Pass :data:`True` or a
+        :class:`~sprockets_dynamodb.hotkeys.HotKeyTracker`. The top keys of
+        a table are periodically added to the ``hot_keys`` field of a
+        :class:`Measurement`. Can also be enabled by setting the
+        :envvar:`DYNAMODB_HOT_KEYS` environment variable to ``true``.
+    :keyword query_cache: Cache the results of :meth:`query` until they
+        expire or are invalidated by a write through the client. Pass
+        :data:`True` or a :class:`~sprockets_dynamodb.cache.QueryCache`.
+    :keyword negative_cache: Remember the keys :meth:`get_item` did not find
+        until they expire or are written through the client. Pass
+        :data:`True` or a :class:`~sprockets_dynamodb.cache.NegativeCache`.
 
     Any of the methods invoked in the client can raise the following
     exceptions:
@@ -80,19 +147,88 @@ class Client(object):
     DynamoDB specifics.
 
     """
+    DEFAULT_DECODE_THRESHOLD = 262144
     DEFAULT_MAX_RETRIES = 3
 
     def __init__(self, **kwargs):
         self.logger = LOGGER.getChild(self.__class__.__name__)
         if os.environ.get('DYNAMODB_ENDPOINT', None):
             kwargs.setdefault('endpoint', os.environ['DYNAMODB_ENDPOINT'])
-        self._client = tornado_aws.AsyncAWSClient('dynamodb', **kwargs)
-        self._ioloop = kwargs.get('io_loop', ioloop.IOLoop.current())
-        self._max_retries = kwargs.get(
+        self._max_retries = int(kwargs.pop(
             'max_retries', os.environ.get(
-                'DYNAMODB_MAX_RETRIES', self.DEFAULT_MAX_RETRIES))
-        self._instrumentation_callback = kwargs.get('instrumentation_callback')
-        self._on_error = kwargs.get('on_error_callback')
+                'DYNAMODB_MAX_RETRIES', self.DEFAULT_MAX_RETRIES)))
+        self._instrumentation_callback = kwargs.pop(
+            'instrumentation_callback', None)
+        self._on_error = kwargs.pop('on_error_callback', None)
+        self._tracer = kwargs.pop('tracer', None)
+        self._return_consumed_capacity = kwargs.pop(
+            'return_consumed_capacity', os.environ.get(
+                'DYNAMODB_RETURN_CONSUMED_CAPACITY')) or None
+        if self._return_consumed_capacity:
+            _validate_return_consumed_capacity(self._return_consumed_capacity)
+            if self._return_consumed_capacity == 'NONE':
+                self._return_consumed_capacity = None
+        refresh_credentials = kwargs.pop(
+            'refresh_credentials', os.environ.get(
+                'DYNAMODB_REFRESH_CREDENTIALS', 'true').lower() != 'false')
+        self._decode_executor = kwargs.pop('decode_executor', None)
+        self._decode_threshold = int(kwargs.pop(
+            'decode_threshold', os.environ.get(
+                'DYNAMODB_DECODE_THRESHOLD', self.DEFAULT_DECODE_THRESHOLD)))
+        endpoints = kwargs.pop('endpoints', None)
+        if endpoints is None and os.environ.get('DYNAMODB_ENDPOINTS'):
+            endpoints = [endpoint.strip() for endpoint in
+                         os.environ['DYNAMODB_ENDPOINTS'].split(',')
+                         if endpoint.strip()]
+        routing_kwargs = kwargs.pop('routing', None) or {}
+        self.hot_keys = kwargs.pop('hot_keys', os.environ.get(
+            'DYNAMODB_HOT_KEYS', '').lower() == 'true') or None
+        if self.hot_keys is True:
+            self.hot_keys = hotkeys.HotKeyTracker()
+        self.query_cache = kwargs.pop('query_cache', None) or None
+        if self.query_cache is True:
+            self.query_cache = cache.QueryCache()
+        self.negative_cache = kwargs.pop('negative_cache', None) or None
+        if self.negative_cache is True:
+            self.negative_cache = cache.NegativeCache()
+        self._bloom_filters = {}
+        self._router = None
+        if endpoints:
+            self._router = routing.Router(
+                [self._create_endpoint(endpoint, kwargs)
+                 for endpoint in endpoints], **routing_kwargs)
+            self._client = self._router.primary.client
+        else:
+            self._client = transport.AsyncAWSClient('dynamodb', **kwargs)
+        self._ioloop = kwargs.get('io_loop', ioloop.IOLoop.current())
+        self._credentials = None
+        self._schemas = {}
+        self._compression = {}
+        self._offloads = {}
+        if refresh_credentials:
+            self._credentials = credentials.CredentialProvider(
+                self._client._auth_config, self._ioloop)
+            self._client._auth_config = self._credentials
+            self._credentials.start()
+        if self._router:
+            for endpoint in self._router.endpoints[1:]:
+                endpoint.client._auth_config = self._client._auth_config
+
+    def close(self):
+        """Stop refreshing the credentials in the background and close the
+        HTTP clients of the client's endpoints. Clients that are not used
+        for the lifetime of the IOLoop should be closed once they are no
+        longer needed, as the refresh is otherwise scheduled indefinitely.
+        The client can not be used after it has been closed.
+
+        """
+        if self._credentials is not None:
+            self._credentials.stop()
+        if self._router:
+            for endpoint in self._router.endpoints:
+                endpoint.client.close()
+        else:
+            self._client.close()
 
     def create_table(self, table_definition):
         """
@@ -259,7 +395,8 @@ class Client(object):
            latest/APIReference/API_PutItem.html
 
         """
-        payload = {'TableName': table_name, 'Item': utils.marshall(item)}
+        payload = {'TableName': table_name,
+                   'Item': self._marshall(table_name, item)}
         if condition_expression:
             payload['ConditionExpression'] = condition_expression
         if expression_attribute_names:
@@ -319,7 +456,7 @@ class Client(object):
 
         """
         payload = {'TableName': table_name,
-                   'Key': utils.marshall(key_dict),
+                   'Key': self._marshall(table_name, key_dict),
                    'ConsistentRead': consistent_read}
         if expression_attribute_names:
             payload['ExpressionAttributeNames'] = expression_attribute_names
@@ -388,7 +525,7 @@ class Client(object):
 
         """
         payload = {'TableName': table_name,
-                   'Key': utils.marshall(key_dict),
+                   'Key': self._marshall(table_name, key_dict),
                    'UpdateExpression': update_expression}
         if condition_expression:
             payload['ConditionExpression'] = condition_expression
@@ -460,7 +597,8 @@ class Client(object):
            latest/APIReference/API_DeleteItem.html
 
         """
-        payload = {'TableName': table_name, 'Key': utils.marshall(key_dict)}
+        payload = {'TableName': table_name,
+                   'Key': self._marshall(table_name, key_dict)}
         if condition_expression:
             payload['ConditionExpression'] = condition_expression
         if expression_attribute_names:
@@ -481,23 +619,104 @@ class Client(object):
             payload['ReturnValues'] = return_values
         return self.execute('DeleteItem', payload)
 
-    def batch_get_item(self):
-        """Invoke the `BatchGetItem`_ function.
+    @gen.coroutine
+    def batch_get_item(self, request_items, return_consumed_capacity=None):
+        """Invoke the `BatchGetItem`_ function, getting up to 100 items from
+        one or more tables.
+
+        :param dict request_items: A mapping of table names to the
+            ``Keys`` to get and optionally ``ConsistentRead``,
+            ``ProjectionExpression`` and ``ExpressionAttributeNames``
+        :param str return_consumed_capacity: Determines the level of detail
+            about provisioned throughput consumption that is returned in the
+            response. Should be ``None`` or one of ``INDEXES`` or ``TOTAL``
+        :rtype: dict
+
+        The ``Responses`` and the ``Keys`` of the ``UnprocessedKeys`` of the
+        result are unmarshalled, so the unprocessed keys can be passed back
+        to :meth:`batch_get_item` to retry them.
 
         .. _BatchGetItem: http://docs.aws.amazon.com/amazondynamodb/
            latest/APIReference/API_BatchGetItem.html
 
         """
-        raise NotImplementedError
+        payload = {'RequestItems': {
+            table_name: dict(request, Keys=[
+                self._marshall(table_name, key) for key in request['Keys']])
+            for table_name, request in request_items.items()}}
+        if return_consumed_capacity:
+            _validate_return_consumed_capacity(return_consumed_capacity)
+            payload['ReturnConsumedCapacity'] = return_consumed_capacity
+        result = yield self.execute('BatchGetItem', payload)
+        result = result or {}
+        result['Responses'] = {
+            table_name: [self._unmarshall_function(table_name)(item)
+                         for item in items]
+            for table_name, items in result.get('Responses', {}).items()}
+        result['UnprocessedKeys'] = {
+            table_name: dict(request, Keys=[
+                self._unmarshall_function(table_name)(key)
+                for key in request['Keys']])
+            for table_name, request in result.get(
+                'UnprocessedKeys', {}).items()}
+        raise gen.Return(result)
 
-    def batch_write_item(self):
-        """Invoke the `BatchWriteItem`_ function.
+    @gen.coroutine
+    def batch_write_item(self, request_items,
+                         return_consumed_capacity=None,
+                         return_item_collection_metrics=None):
+        """Invoke the `BatchWriteItem`_ function, putting or deleting items
+        in one or more tables. Requests are split into batches of up to 25
+        items and 16 MB, which are written one after another.
+
+        :param dict request_items: A mapping of table names to a list of
+            requests, each either ``{'PutRequest': {'Item': item}}`` or
+            ``{'DeleteRequest': {'Key': key}}``
+        :param str return_consumed_capacity: Determines the level of detail
+            about provisioned throughput consumption that is returned in the
+            response. Should be ``None`` or one of ``INDEXES`` or ``TOTAL``
+        :param str return_item_collection_metrics: Determines whether item
+            collection metrics are returned.
+        :rtype: dict
+
+        The ``UnprocessedItems``, ``ConsumedCapacity`` and
+        ``ItemCollectionMetrics`` of the batches are combined, and the
+        ``UnprocessedItems`` are unmarshalled, so they can be passed back to
+        :meth:`batch_write_item` to retry them.
 
         .. _BatchWriteItem: http://docs.aws.amazon.com/amazondynamodb/
            latest/APIReference/API_BatchWriteItem.html
 
         """
-        raise NotImplementedError
+        payload = {'RequestItems': {
+            table_name: [self._marshall_write_request(table_name, request)
+                         for request in requests]
+            for table_name, requests in request_items.items()}}
+        if return_consumed_capacity:
+            _validate_return_consumed_capacity(return_consumed_capacity)
+            payload['ReturnConsumedCapacity'] = return_consumed_capacity
+        if return_item_collection_metrics:
+            _validate_return_item_collection_metrics(
+                return_item_collection_metrics)
+            payload['ReturnItemCollectionMetrics'] = \
+                return_item_collection_metrics
+        result = {'UnprocessedItems': {}}
+        for request_items in utils.split_batch_write(payload['RequestItems']):
+            batch = yield self.execute(
+                'BatchWriteItem', dict(payload, RequestItems=request_items))
+            batch = batch or {}
+            for key in ('UnprocessedItems', 'ItemCollectionMetrics'):
+                for table_name, values in batch.get(key, {}).items():
+                    result.setdefault(key, {}).setdefault(
+                        table_name, []).extend(values)
+            if 'ConsumedCapacity' in batch:
+                result.setdefault('ConsumedCapacity', []).extend(
+                    batch['ConsumedCapacity'])
+        result['UnprocessedItems'] = {
+            table_name: [self._unmarshall_write_request(table_name, request)
+                         for request in requests]
+            for table_name, requests in result['UnprocessedItems'].items()}
+        raise gen.Return(result)
 
     def query(self, table_name,
               index_name=None,
@@ -511,7 +730,9 @@ class Client(object):
               exclusive_start_key=None,
               limit=None,
               scan_index_forward=True,
-              return_consumed_capacity=None):
+              return_consumed_capacity=None,
+              item_callback=None,
+              raw_items=False):
         """A `Query`_ operation uses the primary key of a table or a secondary
         index to directly access items from that table or index.
 
@@ -598,6 +819,11 @@ class Client(object):
             the default behavior. If set to ``False``, DynamoDB reads the
             results in reverse order by sort key value, and then returns the
             results to the client.
+        :param callable item_callback: When set, the response is decoded as
+            it is received and each item is passed to the callback instead
+            of being returned in ``Items``. See :meth:`execute`.
+        :param bool raw_items: Pass the AttributeValues of each item to
+            ``item_callback`` instead of unmarshalling them.
         :param str select: The attributes to be returned in the result. You can
             retrieve all item attributes, specific item attributes, the count
             of matching items, or in the case of an index, some or all of the
@@ -644,13 +870,14 @@ class Client(object):
             _validate_select(select)
             payload['Select'] = select
         if exclusive_start_key:
-            payload['ExclusiveStartKey'] = utils.marshall(exclusive_start_key)
+            payload['ExclusiveStartKey'] = self._marshall(
+                table_name, exclusive_start_key)
         if limit:
             payload['Limit'] = limit
         if return_consumed_capacity:
             _validate_return_consumed_capacity(return_consumed_capacity)
             payload['ReturnConsumedCapacity'] = return_consumed_capacity
-        return self.execute('Query', payload)
+        return self.execute('Query', payload, item_callback, raw_items)
 
     def scan(self,
              table_name,
@@ -665,7 +892,9 @@ class Client(object):
              select=None,
              limit=None,
              exclusive_start_key=None,
-             return_consumed_capacity=None):
+             return_consumed_capacity=None,
+             item_callback=None,
+             raw_items=False):
         """The `Scan`_ operation returns one or more items and item attributes
         by accessing every item in a table or a secondary index.
 
@@ -689,6 +918,12 @@ class Client(object):
         you need a consistent copy of the data, as of the time that the *Scan*
         begins, you can set the ``consistent_read`` parameter to ``True``.
 
+        When ``item_callback`` is set, the response is decoded as it is
+        received and each item is passed to the callback instead of being
+        returned in ``Items``. See :meth:`execute`. Set ``raw_items`` to pass
+        the AttributeValues of each item to the callback instead of
+        unmarshalling them.
+
         :rtype: dict
 
         .. _Scan: http://docs.aws.amazon.com/amazondynamodb/
@@ -709,7 +944,7 @@ class Client(object):
                 utils.marshall(expression_attribute_values)
         if projection_expression:
             payload['ProjectionExpression'] = projection_expression
-        if segment:
+        if segment is not None:
             payload['Segment'] = segment
         if total_segments:
             payload['TotalSegments'] = total_segments
@@ -717,16 +952,18 @@ class Client(object):
             _validate_select(select)
             payload['Select'] = select
         if exclusive_start_key:
-            payload['ExclusiveStartKey'] = utils.marshall(exclusive_start_key)
+            payload['ExclusiveStartKey'] = self._marshall(
+                table_name, exclusive_start_key)
         if limit:
             payload['Limit'] = limit
         if return_consumed_capacity:
             _validate_return_consumed_capacity(return_consumed_capacity)
             payload['ReturnConsumedCapacity'] = return_consumed_capacity
-        return self.execute('Scan', payload)
+        return self.execute('Scan', payload, item_callback, raw_items)
 
     @gen.coroutine
-    def execute(self, action, parameters):
+    def execute(self, action, parameters, item_callback=None,
+                raw_items=False):
         """
         Execute a DynamoDB action with the given parameters. The method will
         retry requests that failed due to OS level errors or when being
@@ -734,6 +971,10 @@ class Client(object):
 
         :param str action: DynamoDB action to invoke
         :param dict parameters: parameters to send into the action
+        :param callable item_callback: For ``Query`` and ``Scan``, invoked
+            with each unmarshalled item as it is decoded from the response
+        :param bool raw_items: Pass the AttributeValues of each item to
+            ``item_callback`` instead of unmarshalling them
         :rtype: tornado.concurrent.Future
 
         This method creates a future that will resolve to the result
@@ -742,6 +983,19 @@ class Client(object):
         easier for you.  It does this for the ``GetItem`` and ``Query``
         functions currently.
 
+        When ``item_callback`` is set for a ``Query`` or ``Scan``, the
+        response body is decoded as it is received rather than buffered and
+        each item is passed to the callback as soon as it has arrived,
+        lowering the peak memory use and the time to the first item for
+        large pages. The returned ``Items`` is empty. Items that were passed
+        to the callback before an attempt failed are not passed again when
+        the request is retried. An exception raised by the callback fails
+        the attempt in the same way as a connection error.
+
+        If the client was created with ``return_consumed_capacity``, the
+        capacity details are requested for every action that supports them
+        and are reported to the instrumentation callback.
+
         :raises:
             :exc:`~sprockets_dynamodb.exceptions.DynamoDBException`
             :exc:`~sprockets_dynamodb.exceptions.ConfigNotFound`
@@ -761,33 +1015,191 @@ class Client(object):
             :exc:`~sprockets_dynamodb.exceptions.ValidationException`
 
         """
+        strip_capacity = False
+        if self._return_consumed_capacity and \
+                action in CAPACITY_ACTIONS and \
+                'ReturnConsumedCapacity' not in parameters:
+            parameters = dict(parameters)
+            parameters['ReturnConsumedCapacity'] = \
+                self._return_consumed_capacity
+            strip_capacity = True
+        if action in PUT_ACTIONS:
+            # Items are checked without the values that will be offloaded
+            # first, so that no blobs are stored for rejected items
+            error = _oversized_item(action, parameters, self._offloads)
+            if error is None and self._offloads and \
+                    action in OFFLOAD_ACTIONS:
+                parameters = yield self._offload(action, parameters)
+                error = _oversized_item(action, parameters)
+            if error is not None:
+                self._on_exception(error)
+                raise gen.Return(None)
+        unmarshall = self._unmarshall_function(parameters.get('TableName'))
+        stream = _ItemStream(
+            item_callback, _identity if raw_items else unmarshall) \
+            if item_callback and action in STREAMING_ACTIONS else None
         measurements = collections.deque([], self._max_retries)
-        for attempt in range(1, self._max_retries + 1):
-            try:
-                result = yield self._execute(
-                    action, parameters, attempt, measurements)
-            except (exceptions.InternalServerError,
-                    exceptions.RequestException,
-                    exceptions.ThrottlingException,
-                    exceptions.ThroughputExceeded,
-                    exceptions.ServiceUnavailable) as error:
-                if attempt == self._max_retries:
-                    if self._instrumentation_callback:
-                        self._instrumentation_callback(measurements)
+        read, failed, endpoint = action in READ_ACTIONS, set(), None
+        hot_key = self.hot_keys.item_key(parameters) \
+            if self.hot_keys and action in ITEM_ACTIONS else None
+        cached = self.query_cache is not None and action == 'Query' and \
+            stream is None and not parameters.get('ConsistentRead')
+        if cached:
+            result = self.query_cache.get(parameters)
+            if result is not None:
+                raise gen.Return(result)
+            generation = self.query_cache.generation(
+                parameters.get('TableName'))
+        lookup = action == 'GetItem' and not parameters.get('ConsistentRead')
+        if lookup and self._known_missing(parameters):
+            raise gen.Return(_finish_result(
+                action, {}, unmarshall, strip_capacity))
+        if lookup and self.negative_cache is not None:
+            generation = self.negative_cache.generation(
+                parameters.get('TableName'))
+        result = None
+        # The result is returned once the spans have exited, since
+        # gen.Return is an exception that tracers would record as an error
+        with self._start_span(action, parameters), \
+                self._track_writes(action, parameters):
+            for attempt in range(1, self._max_retries + 1):
+                if hot_key:
+                    self.hot_keys.record(*hot_key)
+                # Streamed attempts resume by item count, so stay on the
+                # endpoint of the first attempt
+                if self._router and (endpoint is None or stream is None):
+                    endpoint = self._router.select(read, failed)
+                try:
+                    with self._start_span(action, parameters, attempt) as span:
+                        result = yield self._execute(
+                            action, parameters, attempt, measurements, span,
+                            stream, strip_capacity,
+                            endpoint.client if endpoint else None)
+                except (exceptions.InternalServerError,
+                        exceptions.RequestException,
+                        exceptions.ThrottlingException,
+                        exceptions.ThroughputExceeded,
+                        exceptions.ServiceUnavailable) as error:
+                    if endpoint:
+                        self._router.record(endpoint, measurements[-1])
+                    if hot_key and isinstance(
+                            error, (exceptions.ThrottlingException,
+                                    exceptions.ThroughputExceeded)):
+                        self.hot_keys.record(*hot_key, throttled=True)
+                    if attempt == self._max_retries:
+                        self._instrument(measurements, hot_key)
+                        self._on_exception(error)
+                    if read and endpoint and stream is None and \
+                            measurements[-1].error in routing.FAILURES:
+                        failed.add(endpoint)
+                        if self._router.select(read, failed) not in failed:
+                            self.logger.warning(
+                                '%r on attempt %i from %s, failing over',
+                                error, attempt, endpoint.name)
+                            continue
+                    duration = self._sleep_duration(attempt)
+                    self.logger.warning(
+                        '%r on attempt %i, sleeping %.2f seconds',
+                        error, attempt, duration)
+                    yield gen.sleep(duration)
+                except exceptions.DynamoDBException as error:
+                    if endpoint and measurements:
+                        self._router.record(endpoint, measurements[-1])
+                    self._instrument(measurements, hot_key)
                     self._on_exception(error)
-                duration = self._sleep_duration(attempt)
-                self.logger.warning('%r on attempt %i, sleeping %.2f seconds',
-                                    error, attempt, duration)
-                yield gen.sleep(duration)
-            except exceptions.DynamoDBException as error:
-                if self._instrumentation_callback:
-                    self._instrumentation_callback(measurements)
-                self._on_exception(error)
-            else:
-                if self._instrumentation_callback:
-                    self._instrumentation_callback(measurements)
-                self.logger.debug('%s result: %r', action, result)
-                raise gen.Return(_unwrap_result(action, result))
+                else:
+                    if endpoint:
+                        self._router.record(endpoint, measurements[-1])
+                    self._instrument(measurements, hot_key)
+                    self.logger.debug('%s result: %r', action, result)
+                    result = result.result if isinstance(result, _Decoded) \
+                        else _finish_result(action, result, unmarshall,
+                                            strip_capacity)
+                    if cached:
+                        self.query_cache.put(parameters, result, generation)
+                    elif lookup and self.negative_cache is not None and \
+                            not (result or {}).get('Item'):
+                        self.negative_cache.add(
+                            parameters['TableName'], parameters['Key'],
+                            generation, cache.read_variant(parameters))
+                    break
+        raise gen.Return(result)
+
+    def register_schema(self, table_name, schema):
+        """Register the :class:`~sprockets_dynamodb.schema.Schema` used to
+        marshall and unmarshall the items of a table, replacing the generic
+        :mod:`~sprockets_dynamodb.utils` functions. Pass :data:`None` to
+        remove the schema for a table.
+
+        :param str table_name: The table the schema describes
+        :param schema: The table schema
+        :type schema: sprockets_dynamodb.schema.Schema
+
+        """
+        self.logger.debug('Setting schema for %s: %r', table_name, schema)
+        if schema is None:
+            self._schemas.pop(table_name, None)
+        else:
+            self._schemas[table_name] = schema
+
+    def register_compression(self, table_name, compression):
+        """Register the :class:`~sprockets_dynamodb.compression.Compression`
+        applied to the items written to a table. Pass :data:`None` to stop
+        compressing the items of a table; values that were already
+        compressed are still decompressed when read.
+
+        :param str table_name: The table name
+        :param compression: The attribute compression
+        :type compression: sprockets_dynamodb.compression.Compression
+
+        """
+        self.logger.debug('Setting compression for %s: %r', table_name,
+                          compression)
+        if compression is None:
+            self._compression.pop(table_name, None)
+        else:
+            self._compression[table_name] = compression
+
+    def register_offload(self, table_name, offload):
+        """Register the :class:`~sprockets_dynamodb.blobstore.Offload` that
+        moves the large attribute values of the items put into a table by
+        ``PutItem``, ``BatchWriteItem`` and ``TransactWriteItems`` to a blob
+        store. Pass :data:`None` to stop offloading the values of a table.
+
+        Items that would still exceed the maximum item size once their
+        values are offloaded are rejected before anything is stored. An item
+        that only exceeds it because of the pointers that replace its
+        values is rejected after its values were stored, leaving their
+        blobs behind.
+
+        :param str table_name: The table name
+        :param offload: The attribute offload
+        :type offload: sprockets_dynamodb.blobstore.Offload
+
+        """
+        self.logger.debug('Setting offload for %s: %r', table_name, offload)
+        if offload is None:
+            self._offloads.pop(table_name, None)
+        else:
+            self._offloads[table_name] = offload
+
+    def register_bloom_filter(self, table_name, bloom):
+        """Register the :class:`~sprockets_dynamodb.bloom.BloomFilter` of
+        the keys of a table, which is used to answer :meth:`get_item` for
+        missing keys without a request once it is ready. Keys written
+        through the client are added to it. Pass :data:`None` to remove the
+        filter of a table.
+
+        :param str table_name: The table the filter describes
+        :param bloom: The filter
+        :type bloom: sprockets_dynamodb.bloom.BloomFilter
+
+        """
+        self.logger.debug('Setting key filter for %s: %r', table_name, bloom)
+        if bloom is None:
+            self._bloom_filters.pop(table_name, None)
+        else:
+            self._bloom_filters[table_name] = bloom
 
     def set_error_callback(self, callback):
         """Assign a method to invoke when a request has encountered an
@@ -809,18 +1221,62 @@ class Client(object):
         self.logger.debug('Setting instrumentation callback: %r', callback)
         self._instrumentation_callback = callback
 
-    def _execute(self, action, parameters, attempt, measurements):
+    def set_tracer(self, tracer):
+        """Assign an OpenTelemetry compatible tracer that is used to create a
+        span for each action executed, with a child span for each attempt.
+        Spans are created with ``tracer.start_as_current_span`` so they are
+        parented by, and propagate, the active span context. Tracing is
+        disabled when the tracer is :data:`None`.
+
+        :param tracer: The tracer to use
+
+        """
+        self.logger.debug('Setting tracer: %r', tracer)
+        self._tracer = tracer
+
+    @staticmethod
+    def _create_endpoint(endpoint, kwargs):
+        """Create the routing endpoint for a URL or a dict of client keyword
+        arguments.
+
+        :param endpoint: The endpoint URL or keyword arguments
+        :type endpoint: str or dict
+        :param dict kwargs: The keyword arguments of the client
+        :rtype: sprockets_dynamodb.routing.Endpoint
+
+        """
+        if not isinstance(endpoint, dict):
+            endpoint = {'endpoint': endpoint}
+        kwargs = dict(kwargs, **endpoint)
+        return routing.Endpoint(
+            kwargs.get('endpoint') or kwargs.get('region'),
+            transport.AsyncAWSClient('dynamodb', **kwargs))
+
+    def _execute(self, action, parameters, attempt, measurements,
+                 span=None, stream=None, strip_capacity=False, client=None):
         """Invoke a DynamoDB action
 
         :param str action: DynamoDB action to invoke
         :param dict parameters: parameters to send into the action
         :param int attempt: Which attempt number this is
         :param list measurements: A list for accumulating request measurements
+        :param span: The span for the attempt, if tracing
+        :param stream: Receives the items of a streamed response
+        :type stream: _ItemStream
+        :param bool strip_capacity: Remove the consumed capacity from a
+            result that is decoded by the ``decode_executor``
+        :param client: The client of the endpoint selected by the router
+        :type client: sprockets_dynamodb.transport.AsyncAWSClient
         :rtype: tornado.concurrent.Future
 
         """
         future = concurrent.Future()
         start = time.time()
+        body = json.dumps(parameters).encode('utf-8')
+        if span is not None and span is not _NOOP_SPAN:
+            span.set_attribute('http.request.body.size', len(body))
+
+        table = parameters.get('TableName', 'Unknown')
 
         def handle_response(request):
             """Invoked by the IOLoop when fetch has a response to process.
@@ -828,19 +1284,199 @@ class Client(object):
             :param tornado.concurrent.Future request: The request future
 
             """
+            schema = self._schemas.get(table)
+            if decoder is None and self._offload_decode(request, schema):
+                decoding = ioloop.IOLoop.current().run_in_executor(
+                    self._decode_executor, _decode_response,
+                    request.result().body, action, schema, strip_capacity)
+                ioloop.IOLoop.current().add_future(
+                    decoding, lambda decoded: self._on_response(
+                        action, table, attempt, start, request, future,
+                        measurements, span, decoded=decoded))
+                return
             self._on_response(
-                action, parameters.get('TableName', 'Unknown'), attempt,
-                start, request, future, measurements)
-
-        ioloop.IOLoop.current().add_future(self._client.fetch(
-            'POST', '/',
-            body=json.dumps(parameters).encode('utf-8'),
-            headers={
-                'x-amz-target': 'DynamoDB_20120810.{}'.format(action),
-                'Content-Type': 'application/x-amz-json-1.0',
-            }), handle_response)
+                action, table, attempt, start, request, future,
+                measurements, span, decoder)
+
+        headers = {
+            'x-amz-target': 'DynamoDB_20120810.{}'.format(action),
+            'Content-Type': 'application/x-amz-json-1.0',
+        }
+        client = client or self._client
+        if stream is None:
+            decoder = None
+            request = client.fetch(
+                'POST', '/', body=body, headers=headers)
+        else:
+            decoder = stream.decoder()
+            request = client.stream(
+                'POST', '/', body=body, headers=headers,
+                streaming_callback=decoder.feed)
+        ioloop.IOLoop.current().add_future(request, handle_response)
         return future
 
+    def _instrument(self, measurements, hot_key=None):
+        """Invoke the instrumentation callback with the measurements of an
+        action, adding the hot keys of the table to the last measurement when
+        they are due to be reported.
+
+        :param list measurements: The measurements of the action
+        :param tuple hot_key: The table and key of an item action
+
+        """
+        if not self._instrumentation_callback:
+            return
+        if hot_key and measurements:
+            report = self.hot_keys.report(hot_key[0])
+            if report:
+                measurements[-1] = measurements[-1]._replace(hot_keys=report)
+        self._instrumentation_callback(measurements)
+
+    def _known_missing(self, parameters):
+        """Return :data:`True` if the key of a ``GetItem`` is known not to
+        exist from the Bloom filter of the table or the negative cache.
+
+        :param dict parameters: The ``GetItem`` parameters
+        :rtype: bool
+
+        """
+        table_name, key = parameters.get('TableName'), parameters.get('Key')
+        bloom = self._bloom_filters.get(table_name)
+        if bloom is not None and bloom.ready and key not in bloom:
+            return True
+        return self.negative_cache is not None and \
+            (table_name, key, cache.read_variant(parameters)) in \
+            self.negative_cache
+
+    def _marshall(self, table_name, values):
+        """Marshall item values with the schema registered for the table,
+        or with :func:`~sprockets_dynamodb.utils.marshall`, and compress
+        them with the compression registered for the table.
+
+        :param str table_name: The table the values belong to
+        :param dict values: The values to marshall
+        :rtype: dict
+
+        """
+        schema = self._schemas.get(table_name)
+        if schema is None:
+            values = utils.marshall(values)
+        else:
+            values = schema.marshall(values)
+        compression = self._compression.get(table_name)
+        if compression is None:
+            return values
+        return compression.compress(values)
+
+    def _marshall_write_request(self, table_name, request):
+        """Marshall a ``PutRequest`` or ``DeleteRequest`` for a batch write.
+
+        :param str table_name: The table name
+        :param dict request: The request
+        :rtype: dict
+
+        """
+        if 'PutRequest' in request:
+            return {'PutRequest': {'Item': self._marshall(
+                table_name, request['PutRequest']['Item'])}}
+        return {'DeleteRequest': {'Key': self._marshall(
+            table_name, request['DeleteRequest']['Key'])}}
+
+    def _unmarshall_write_request(self, table_name, request):
+        """Unmarshall an unprocessed ``PutRequest`` or ``DeleteRequest``.
+
+        :param str table_name: The table name
+        :param dict request: The request
+        :rtype: dict
+
+        """
+        unmarshall = self._unmarshall_function(table_name)
+        if 'PutRequest' in request:
+            return {'PutRequest': {'Item': unmarshall(
+                request['PutRequest']['Item'])}}
+        return {'DeleteRequest': {'Key': unmarshall(
+            request['DeleteRequest']['Key'])}}
+
+    def _unmarshall_function(self, table_name):
+        """Return the function used to unmarshall the items of a table.
+
+        :param str table_name: The table name
+        :rtype: callable
+
+        """
+        schema = self._schemas.get(table_name)
+        if schema is None:
+            return utils.unmarshall
+        return schema.unmarshall
+
+    @gen.coroutine
+    def _offload(self, action, parameters):
+        """Offload the large values of the items put into tables with a
+        registered :class:`~sprockets_dynamodb.blobstore.Offload`,
+        returning a copy of the parameters if any were offloaded.
+
+        :param str action: The action, one of :data:`OFFLOAD_ACTIONS`
+        :param dict parameters: The action parameters
+        :rtype: dict
+
+        """
+        @gen.coroutine
+        def offload(table_name, item):
+            if table_name not in self._offloads:
+                raise gen.Return(item)
+            result = yield self._offloads[table_name].offload(
+                table_name, item)
+            raise gen.Return(result)
+
+        parameters = dict(parameters)
+        if action == 'PutItem':
+            parameters['Item'] = yield offload(
+                parameters['TableName'], parameters['Item'])
+        elif action == 'BatchWriteItem':
+            request_items = {}
+            for table_name, requests in parameters['RequestItems'].items():
+                puts = [offset for offset, request in enumerate(requests)
+                        if 'PutRequest' in request]
+                items = yield [offload(table_name,
+                                       requests[offset]['PutRequest']['Item'])
+                               for offset in puts]
+                requests = list(requests)
+                for offset, item in zip(puts, items):
+                    requests[offset] = {'PutRequest': {'Item': item}}
+                request_items[table_name] = requests
+            parameters['RequestItems'] = request_items
+        else:
+            transact_items = []
+            for request in parameters['TransactItems']:
+                if 'Put' in request:
+                    item = yield offload(request['Put']['TableName'],
+                                         request['Put']['Item'])
+                    request = dict(request, Put=dict(request['Put'],
+                                                     Item=item))
+                transact_items.append(request)
+            parameters['TransactItems'] = transact_items
+        raise gen.Return(parameters)
+
+    def _offload_decode(self, response, schema):
+        """Return :data:`True` if the response should be decoded with the
+        ``decode_executor``.
+
+        :param tornado.concurrent.Future response: The HTTP request future
+        :param schema: The schema registered for the table
+        :type schema: sprockets_dynamodb.schema.Schema
+        :rtype: bool
+
+        """
+        if self._decode_executor is None or response.exception():
+            return False
+        http_response = response.result()
+        if not http_response or not http_response.body or \
+                len(http_response.body) < self._decode_threshold:
+            return False
+        return schema is None or schema.record_class is None or \
+            not isinstance(self._decode_executor,
+                           futures.ProcessPoolExecutor)
+
     def _on_exception(self, error):
         """Handle exceptions that can not be retried.
 
@@ -853,7 +1489,7 @@ class Client(object):
         self._on_error(error)
 
     def _on_response(self, action, table, attempt, start, response, future,
-                     measurements):
+                     measurements, span=None, decoder=None, decoded=None):
         """Invoked when the HTTP request to the DynamoDB has returned and
         is responsible for setting the future result or exception based upon
         the HTTP response provided.
@@ -865,13 +1501,18 @@ class Client(object):
         :param tornado.concurrent.Future response: The HTTP request future
         :param tornado.concurrent.Future future: The action execution future
         :param list measurements: The measurement accumulator
+        :param span: The span for the attempt, if tracing
+        :param decoder: The decoder for a streamed response
+        :type decoder: sprockets_dynamodb.transport.PageDecoder
+        :param concurrent.futures.Future decoded: The result of decoding the
+            response with the ``decode_executor``
 
         """
         self.logger.debug('%s on %s request #%i = %r',
                           action, table, attempt, response)
-        now, exception = time.time(), None
+        now, exception, capacity = time.time(), None, ()
         try:
-            future.set_result(self._process_response(response))
+            result = self._process_response(response, decoder, decoded)
         except aws_exceptions.ConfigNotFound as error:
             exception = exceptions.ConfigNotFound(str(error))
         except aws_exceptions.ConfigParserError as error:
@@ -897,6 +1538,11 @@ class Client(object):
                             'body', str(error.code)))
         except Exception as error:
             exception = error
+        else:
+            capacity = _consumed_capacity(
+                action, {'ConsumedCapacity': result.capacity}
+                if isinstance(result, _Decoded) else result)
+            future.set_result(result)
 
         if exception:
             future.set_exception(exception)
@@ -904,15 +1550,84 @@ class Client(object):
         measurements.append(
             Measurement(now, action, table, attempt, max(now, start) - start,
                         exception.__class__.__name__
-                        if exception else exception))
+                        if exception else exception, capacity))
+        if span is not None and span is not _NOOP_SPAN:
+            _trace_response(span, response, measurements[-1],
+                            decoder.size if decoder else None)
+
+    @contextlib.contextmanager
+    def _track_writes(self, action, parameters):
+        """Context manager that adds the keys written by an action to the
+        Bloom filters of their tables when the write is sent, and removes
+        the cached queries and missing keys the write could make stale both
+        when it is sent and when it completes.
+
+        :param str action: The action being executed
+        :param dict parameters: The action parameters
+
+        """
+        caches = [value for value in (self.query_cache, self.negative_cache)
+                  if value is not None]
+        if action in READ_ACTIONS or not (caches or self._bloom_filters):
+            yield
+            return
+        for value in caches:
+            value.invalidate_write(action, parameters)
+        if action in cache.STATEMENT_ACTIONS:
+            for table_name, bloom in self._bloom_filters.items():
+                if bloom.ready:
+                    self.logger.warning('Disabling the key filter of %s for '
+                                        '%s', table_name, action)
+                    bloom.ready = False
+        elif action == 'DeleteTable':
+            self._bloom_filters.pop(parameters.get('TableName'), None)
+        for table_name, item in cache.written_items(action, parameters):
+            bloom = self._bloom_filters.get(table_name)
+            # Writes without the key attributes are rejected by DynamoDB
+            if bloom is not None and \
+                    all(name in item for name in bloom.key_names):
+                bloom.add(item)
+        try:
+            yield
+        finally:
+            for value in caches:
+                value.invalidate_write(action, parameters)
+
+    def _start_span(self, action, parameters, attempt=None):
+        """Return the context manager for a span tracing the execution of
+        an action, or an attempt of the action when ``attempt`` is set. When
+        no tracer is assigned a shared no-op span is returned.
+
+        :param str action: The action being executed
+        :param dict parameters: The parameters for the action
+        :param int attempt: The attempt number
+        :rtype: contextlib.AbstractContextManager
+
+        """
+        if self._tracer is None:
+            return _NOOP_SPAN
+        attributes = {
+            'db.system': 'dynamodb',
+            'db.operation': action,
+            'aws.dynamodb.table_names': [
+                parameters.get('TableName', 'Unknown')]}
+        if attempt is None:
+            return self._tracer.start_as_current_span(
+                'DynamoDB.{}'.format(action), attributes=attributes)
+        attributes['aws.dynamodb.attempt'] = attempt
+        return self._tracer.start_as_current_span(
+            'DynamoDB.{} #{}'.format(action, attempt), attributes=attributes)
 
     @staticmethod
-    def _process_response(response):
+    def _process_response(response, decoder=None, decoded=None):
         """Process the raw AWS response, returning either the mapped exception
         or deserialized response.
 
         :param tornado.concurrent.Future response: The request future
-        :rtype: dict or list
+        :param decoder: The decoder for a streamed response
+        :type decoder: sprockets_dynamodb.transport.PageDecoder
+        :param decoded: The future of decoding the response in an executor
+        :rtype: dict or list or _Decoded
         :raises:  sprockets_dynamodb.exceptions.DynamoDBException
 
         """
@@ -923,6 +1638,10 @@ class Client(object):
                     raise exceptions.MAP[error.args[1]['type']](
                         error.args[1]['message'])
             raise error
+        if decoder is not None:
+            return decoder.close()
+        elif decoded is not None:
+            return decoded.result()
         http_response = response.result()
         if not http_response or not http_response.body:
             raise exceptions.DynamoDBException('empty response')
@@ -940,23 +1659,221 @@ class Client(object):
         return (float(2 ** attempt) * 100) / 1000
 
 
-def _unwrap_result(action, result):
+class _NoopSpan(object):
+    """Stands in for both the span context manager and the span when there
+    is no tracer assigned to the client."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _identity(value):
+    return value
+
+
+_Decoded = collections.namedtuple('_Decoded', ['capacity', 'result'])
+
+
+def _decode_response(body, action, schema=None, strip_capacity=False):
+    """Decode and unwrap a response body. Invoked in the ``decode_executor``
+    of the client, so it only depends on its arguments.
+
+    :param bytes body: The response body
+    :param str action: The action name
+    :param schema: The schema registered for the table
+    :type schema: sprockets_dynamodb.schema.Schema
+    :param bool strip_capacity: Remove the consumed capacity from the result
+    :rtype: _Decoded
+
+    """
+    result = json.loads(body.decode('utf-8'))
+    capacity = result.get('ConsumedCapacity') \
+        if isinstance(result, dict) else None
+    return _Decoded(capacity, _finish_result(
+        action, result, utils.unmarshall if schema is None
+        else schema.unmarshall, strip_capacity))
+
+
+def _finish_result(action, result, unmarshall, strip_capacity):
+    """Remove the capacity details that were not requested by the caller
+    and unwrap the result.
+
+    :param str action: The action name
+    :param result: The deserialized response of the action
+    :param callable unmarshall: The function used to unmarshall items
+    :param bool strip_capacity: Remove the consumed capacity from the result
+    :rtype: dict | None
+
+    """
+    if strip_capacity and isinstance(result, dict):
+        result.pop('ConsumedCapacity', None)
+    return _unwrap_result(action, result, unmarshall)
+
+
+class _ItemStream(object):
+    """Passes the items of a streamed ``Query`` or ``Scan`` to the callback,
+    skipping the items that were delivered by a previous attempt.
+
+    :param callable callback: The item callback
+    :param callable unmarshall: The function used to unmarshall each item
+
+    """
+    def __init__(self, callback, unmarshall=utils.unmarshall):
+        self.callback = callback
+        self.delivered = 0
+        self.unmarshall = unmarshall
+
+    def decoder(self):
+        """Return the decoder for an attempt.
+
+        :rtype: sprockets_dynamodb.transport.PageDecoder
+
+        """
+        received = [0]
+
+        def on_item(item):
+            received[0] += 1
+            if received[0] > self.delivered:
+                self.callback(self.unmarshall(item))
+                self.delivered += 1
+
+        return transport.PageDecoder(on_item)
+
+
+def _oversized_item(action, parameters, offloads=None):
+    """Return a :exc:`~sprockets_dynamodb.exceptions.ValidationException`
+    if an item put by the action exceeds the maximum item size, as DynamoDB
+    would reject the request.
+
+    :param str action: The action, one of :data:`PUT_ACTIONS`
+    :param dict parameters: The action parameters
+    :param dict offloads: The offloads by table name, whose items are
+        measured without the values they would offload
+    :rtype: sprockets_dynamodb.exceptions.ValidationException or None
+
+    """
+    if action == 'PutItem':
+        items = [(parameters.get('TableName'), parameters.get('Item') or {})]
+    elif action == 'BatchWriteItem':
+        items = [(table_name, request['PutRequest']['Item'])
+                 for table_name, requests in
+                 parameters.get('RequestItems', {}).items()
+                 for request in requests if 'PutRequest' in request]
+    else:
+        items = [(request['Put'].get('TableName'), request['Put']['Item'])
+                 for request in parameters.get('TransactItems', [])
+                 if 'Put' in request]
+    for table_name, item in items:
+        offload = (offloads or {}).get(table_name)
+        size = utils.item_size(item, marshalled=True) if offload is None \
+            else offload.retained_size(item)
+        if size > utils.MAX_ITEM_SIZE:
+            return exceptions.ValidationException(
+                'Item of {} bytes exceeds the maximum item size'.format(size))
+
+
+def _trace_response(span, response, measurement, size=None):
+    """Add the outcome of an attempt to its span.
+
+    :param span: The span for the attempt
+    :param tornado.concurrent.Future response: The HTTP request future
+    :param Measurement measurement: The measurement for the attempt
+    :param int size: The size of a streamed response body
+
+    """
+    if measurement.error:
+        span.set_attribute('error.type', measurement.error)
+    if measurement.capacity:
+        span.set_attribute('aws.dynamodb.consumed_capacity', [
+            json.dumps(dict(capacity._asdict()))
+            for capacity in measurement.capacity])
+    if size is not None:
+        span.set_attribute('http.response.body.size', size)
+    elif not response.exception():
+        body = getattr(response.result(), 'body', None)
+        if body is not None:
+            span.set_attribute('http.response.body.size', len(body))
+
+
+def _capacity_units(action, value):
+    """Return the read and write capacity units from a single
+    ``ConsumedCapacity`` or ``Capacity`` structure, using the action to
+    determine the type of capacity when only the total is provided.
+
+    :param str action: The action name
+    :param dict value: The capacity structure
+    :rtype: (float, float)
+
+    """
+    if 'ReadCapacityUnits' in value or 'WriteCapacityUnits' in value:
+        return (float(value.get('ReadCapacityUnits', 0)),
+                float(value.get('WriteCapacityUnits', 0)))
+    elif action in READ_ACTIONS:
+        return float(value.get('CapacityUnits', 0)), 0.0
+    return 0.0, float(value.get('CapacityUnits', 0))
+
+
+def _consumed_capacity(action, result):
+    """Return the capacity consumed by an action, aggregated by table and
+    index, as a tuple of :class:`Capacity` values. Table level capacity is
+    reported with an index of :data:`None`.
+
+    :param str action: The action name
+    :param result: The deserialized response of the action
+    :type result: list or dict
+    :rtype: tuple
+
+    """
+    values = result.get('ConsumedCapacity') \
+        if isinstance(result, dict) else None
+    if not values:
+        return ()
+    totals = collections.OrderedDict()
+
+    def add(table, index, value):
+        read_units, write_units = _capacity_units(action, value)
+        current = totals.get((table, index), (0.0, 0.0))
+        totals[(table, index)] = (current[0] + read_units,
+                                  current[1] + write_units)
+
+    for value in values if isinstance(values, list) else [values]:
+        table = value.get('TableName', 'Unknown')
+        add(table, None, value.get('Table', value))
+        for key in ['LocalSecondaryIndexes', 'GlobalSecondaryIndexes']:
+            for index, units in value.get(key, {}).items():
+                add(table, index, units)
+    return tuple(Capacity(table, index, read_units, write_units)
+                 for (table, index), (read_units, write_units)
+                 in totals.items())
+
+
+def _unwrap_result(action, result, unmarshall=utils.unmarshall):
     """Unwrap a request response and return only the response data.
 
     :param str action: The action name
     :param result: The result of the action
     :type: result: list or dict
+    :param callable unmarshall: The function used to unmarshall items
     :rtype: dict | None
 
     """
     if not result:
         return
     elif action in {'DeleteItem', 'PutItem', 'UpdateItem'}:
-        return _unwrap_delete_put_update_item(result)
+        return _unwrap_delete_put_update_item(result, unmarshall)
     elif action == 'GetItem':
-        return _unwrap_get_item(result)
+        return _unwrap_get_item(result, unmarshall)
     elif action == 'Query' or action == 'Scan':
-        return _unwrap_query_scan(result)
+        return _unwrap_query_scan(result, unmarshall)
     elif action == 'CreateTable':
         return _unwrap_create_table(result)
     elif action == 'DescribeTable':
@@ -964,15 +1881,16 @@ def _unwrap_result(action, result):
     return result
 
 
-def _unwrap_delete_put_update_item(result):
+def _unwrap_delete_put_update_item(result, unmarshall=utils.unmarshall):
     response = {
-       'Attributes': utils.unmarshall(result.get('Attributes', {}) if result else {})
+       'Attributes': unmarshall(result.get('Attributes', {})
+                                if result else {})
     }
     if 'ConsumedCapacity' in result:
         response['ConsumedCapacity'] = result['ConsumedCapacity']
     if 'ItemCollectionMetrics' in result:
         response['ItemCollectionMetrics'] = {
-            'ItemCollectionKey': utils.unmarshall(
+            'ItemCollectionKey': unmarshall(
                 result['ItemCollectionMetrics'].get('ItemCollectionKey', {})),
             'SizeEstimateRangeGB':
                 result['ItemCollectionMetrics'].get('SizeEstimateRangeGB',
@@ -981,24 +1899,24 @@ def _unwrap_delete_put_update_item(result):
     return response
 
 
-def _unwrap_get_item(result):
+def _unwrap_get_item(result, unmarshall=utils.unmarshall):
     response = {
-       'Item': utils.unmarshall(result['Item'] if result else {})
+       'Item': unmarshall(result.get('Item', {}) if result else {})
     }
     if 'ConsumedCapacity' in result:
         response['ConsumedCapacity'] = result['ConsumedCapacity']
     return response
 
 
-def _unwrap_query_scan(result):
+def _unwrap_query_scan(result, unmarshall=utils.unmarshall):
     response = {
         'Count': result.get('Count', 0),
-        'Items': [utils.unmarshall(i) for i in result.get('Items', [])],
+        'Items': [unmarshall(i) for i in result.get('Items', [])],
         'ScannedCount': result.get('ScannedCount', 0)
     }
     if 'LastEvaluatedKey' in result:
         response['LastEvaluatedKey'] = \
-            utils.unmarshall(result['LastEvaluatedKey'])
+            unmarshall(result['LastEvaluatedKey'])
     if 'ConsumedCapacity' in result:
         response['ConsumedCapacity'] = result['ConsumedCapacity']
     return response
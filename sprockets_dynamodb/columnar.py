@@ -0,0 +1,296 @@
+"""
+Columnar Results
+================
+
+Accumulates the items of ``Query`` and ``Scan`` responses in a buffer per
+attribute, so that large result sets are held as compact arrays rather
+than as a :class:`dict` per item and can be handed to vectorised code as
+NumPy arrays. The AttributeValues of each item are still decoded from the
+JSON of the response and are appended to the columns instead of being
+unmarshalled, which takes about as long as unmarshalling them: columns
+reduce the memory held for large results, not the time to decode them.
+
+.. code:: python
+
+    columns = yield columnar.scan(client, 'example')
+    arrays = columns.arrays()
+    arrays['count'].mean()
+
+``N`` attributes are stored as 64-bit integers until a value with a
+fraction, an exponent or that does not fit is encountered, after which the
+column is stored as 64-bit floats. ``BOOL`` attributes are stored as bytes.
+Both are returned as :class:`numpy.ma.MaskedArray` with the items that did
+not have the attribute, or where it was ``NULL``, masked. Every other type,
+and attributes whose type differs between items, are stored as unmarshalled
+values in an object array with :data:`None` for missing values. Numbers of
+a column that becomes an object column are converted as
+:func:`~sprockets_dynamodb.utils.unmarshall` converts them.
+
+NumPy is only required to build the arrays and can be installed with the
+``numpy`` extra.
+
+"""
+import array
+
+from tornado import gen
+
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
+
+from sprockets_dynamodb import utils
+
+NUMBER = 'N'
+BOOL = 'BOOL'
+OBJECT = 'O'
+
+
+class Column(object):
+    """The values of one attribute for every row in :class:`Columns`.
+
+    :param str kind: :data:`NUMBER`, :data:`BOOL` or :data:`OBJECT`
+    :param int rows: The number of preceding rows without the attribute
+
+    .. attribute:: values
+
+        An :class:`array.array` of numbers, a :class:`bytearray` of booleans
+        or a :class:`list` of objects
+
+    .. attribute:: mask
+
+        A :class:`bytearray` with ``1`` for each row without a value, or
+        :data:`None` for object columns
+
+    """
+    __slots__ = ('kind', 'values', 'mask', 'integers')
+
+    def __init__(self, kind, rows=0):
+        self.kind = kind
+        self.integers = None
+        if kind == OBJECT:
+            self.values, self.mask = [None] * rows, None
+        elif kind == NUMBER:
+            self.values, self.mask = array.array('q', bytes(8 * rows)), \
+                bytearray(b'\x01' * rows)
+        else:
+            self.values, self.mask = bytearray(rows), \
+                bytearray(b'\x01' * rows)
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, row, value):
+        """Append the AttributeValue for a row, padding the rows before it
+        that did not have the attribute.
+
+        :param int row: The offset of the row
+        :param dict value: The AttributeValue
+
+        """
+        if len(self.values) < row:
+            self.pad(row)
+        if self.kind == NUMBER:
+            number = value.get('N')
+            if number is not None:
+                return self._append_number(number)
+        elif self.kind == BOOL:
+            flag = value.get('BOOL')
+            if flag is not None:
+                self.values.append(flag)
+                self.mask.append(0)
+                return
+        else:
+            string = value.get('S')
+            self.values.append(string if string is not None
+                               else utils._unmarshall_dict(value))
+            return
+        if 'NULL' in value:
+            self.values.append(0)
+            self.mask.append(1)
+        else:
+            self._to_objects()
+            self.values.append(utils._unmarshall_dict(value))
+
+    def pad(self, rows):
+        """Pad the column with missing values to the number of rows.
+
+        :param int rows: The number of rows
+
+        """
+        missing = rows - len(self.values)
+        if self.kind == OBJECT:
+            self.values.extend([None] * missing)
+        elif self.kind == NUMBER:
+            self.values.frombytes(bytes(missing * self.values.itemsize))
+            self.mask.extend(b'\x01' * missing)
+        else:
+            self.values.extend(bytes(missing))
+            self.mask.extend(b'\x01' * missing)
+
+    def array(self):
+        """Return the column as a NumPy array.
+
+        :rtype: numpy.ndarray or numpy.ma.MaskedArray
+
+        """
+        if self.kind == OBJECT:
+            values = numpy.empty(len(self.values), dtype=object)
+            values[:] = self.values
+            return values
+        dtype = numpy.bool_ if self.kind == BOOL else \
+            numpy.float64 if self.values.typecode == 'd' else numpy.int64
+        return numpy.ma.MaskedArray(
+            numpy.frombuffer(self.values, dtype=dtype).copy(),
+            numpy.frombuffer(self.mask, dtype=numpy.bool_).copy())
+
+    def _append_number(self, number):
+        if self.values.typecode == 'q':
+            if '.' not in number and 'e' not in number and \
+                    'E' not in number:
+                try:
+                    self.values.append(int(number))
+                except OverflowError:
+                    pass
+                else:
+                    self.mask.append(0)
+                    return
+            # Keep the integers exactly, for converting to objects
+            self.integers = {row: value for row, (value, missing) in
+                             enumerate(zip(self.values, self.mask))
+                             if not missing}
+            self.values = array.array('d', self.values)
+        if '.' not in number:
+            self.integers[len(self.values)] = utils._to_number(number)
+        self.values.append(float(number))
+        self.mask.append(0)
+
+    def _to_objects(self):
+        """Convert the column to an object column after a value of another
+        type was encountered.
+
+        """
+        if self.kind == NUMBER and self.values.typecode == 'q':
+            values = self.values.tolist()
+        elif self.kind == NUMBER:
+            values = [self.integers.get(row, value) for row, value in
+                      enumerate(self.values.tolist())]
+        else:
+            values = [bool(v) for v in self.values]
+        self.values = [None if missing else value
+                       for value, missing in zip(values, self.mask)]
+        self.kind, self.mask, self.integers = OBJECT, None, None
+
+
+class Columns(object):
+    """Accumulates items as columns of attribute values.
+
+    Pass :meth:`append` as the ``item_callback`` of
+    :meth:`~sprockets_dynamodb.client.Client.query` or
+    :meth:`~sprockets_dynamodb.client.Client.scan` with ``raw_items=True``
+    to decode the items of each page into the columns as they are received.
+
+    :param dict types: Optional type codes by attribute name, fixing the kind
+        of a column instead of taking it from the first value. ``N`` and
+        ``BOOL`` are stored as numbers and booleans, other codes as objects.
+
+    """
+    def __init__(self, types=None):
+        self.columns = {}
+        self.rows = 0
+        for name, kind in (types or {}).items():
+            self.columns[name] = Column(
+                kind if kind in {NUMBER, BOOL} else OBJECT)
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, item):
+        """Append an item as a row.
+
+        :param dict item: The AttributeValues of the item
+
+        """
+        row, columns = self.rows, self.columns
+        for name, value in item.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = Column(_kind(value), row)
+            column.append(row, value)
+        self.rows = row + 1
+
+    def extend(self, items):
+        """Append a page of items as rows.
+
+        :param list items: The AttributeValues of each item
+
+        """
+        for item in items:
+            self.append(item)
+
+    def arrays(self):
+        """Return the columns as NumPy arrays by attribute name.
+
+        :rtype: dict
+        :raises RuntimeError: if NumPy is not installed
+
+        """
+        if numpy is None:
+            raise RuntimeError('numpy is required for columnar arrays')
+        result = {}
+        for name, column in self.columns.items():
+            if len(column) < self.rows:
+                column.pad(self.rows)
+            result[name] = column.array()
+        return result
+
+
+def _kind(value):
+    if 'N' in value:
+        return NUMBER
+    elif 'BOOL' in value:
+        return BOOL
+    return OBJECT
+
+
+@gen.coroutine
+def query(client, table_name, columns=None, **kwargs):
+    """Query the table, decoding every page into columns.
+
+    :param sprockets_dynamodb.client.Client client: The client
+    :param str table_name: The table to query
+    :param Columns columns: The columns to append the items to
+    :param kwargs: Arguments for
+        :meth:`~sprockets_dynamodb.client.Client.query`
+    :rtype: Columns
+
+    """
+    columns = yield _paginate(client.query, table_name, columns, kwargs)
+    raise gen.Return(columns)
+
+
+@gen.coroutine
+def scan(client, table_name, columns=None, **kwargs):
+    """Scan the table, decoding every page into columns.
+
+    :param sprockets_dynamodb.client.Client client: The client
+    :param str table_name: The table to scan
+    :param Columns columns: The columns to append the items to
+    :param kwargs: Arguments for
+        :meth:`~sprockets_dynamodb.client.Client.scan`
+    :rtype: Columns
+
+    """
+    columns = yield _paginate(client.scan, table_name, columns, kwargs)
+    raise gen.Return(columns)
+
+
+@gen.coroutine
+def _paginate(method, table_name, columns, kwargs):
+    columns = Columns() if columns is None else columns
+    kwargs.update(item_callback=columns.append, raw_items=True)
+    while True:
+        result = yield method(table_name, **kwargs)
+        if not result.get('LastEvaluatedKey'):
+            raise gen.Return(columns)
+        kwargs['exclusive_start_key'] = result['LastEvaluatedKey']
@@ -0,0 +1,181 @@
+"""
+Attribute Compression
+=====================
+
+DynamoDB charges read and write capacity by item size, so large text, JSON
+and binary attributes are cheaper to store compressed. A
+:class:`Compression` registered for a table with
+:meth:`~sprockets_dynamodb.client.Client.register_compression` compresses
+the named top-level attributes of the items written by the client when
+their encoded size reaches a threshold:
+
+.. code:: python
+
+    client.register_compression('example', Compression(['body', 'doc']))
+
+Compressed values are stored as binary (``B``) values tagged with a magic
+prefix, the codec and the type of the original value, and are decompressed
+by :func:`~sprockets_dynamodb.utils.unmarshall`, so reading them requires
+no configuration. Strings and binary values are compressed as they are,
+while other values (maps, lists, sets and numbers) are compressed as the
+JSON of their AttributeValue. A value is only stored compressed when that
+makes it smaller. Binary values that begin with the magic prefix but can
+not be decompressed, because they were not written compressed or are
+corrupt, are returned as they are.
+
+Values are compressed with :mod:`zlib` by default, or with zstd by passing
+``codec='zstd'`` when `zstandard <https://pypi.org/project/zstandard/>`_
+is installed. Values compressed with zstd can only be read where zstandard
+is installed, and reading them elsewhere raises :exc:`UnsupportedCodec`
+rather than returning the compressed bytes.
+
+Compressed attributes can not be used in key, condition or filter
+expressions, or as key attributes, and are written as they are by update
+expressions.
+
+"""
+import base64
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: nocover
+    zstandard = None
+
+MAGIC = b'\xffSDZ'
+
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+_CODECS = {ZLIB: b'z', ZSTD: b's'}
+_TYPES = {'B': b'B', 'S': b'S'}
+_JSON = b'J'
+
+
+class UnsupportedCodec(ValueError):
+    """Raised when a value is compressed with a codec that is not supported
+    or not installed."""
+
+
+class Compression(object):
+    """Compresses the large values of the named attributes of a table.
+
+    :param list attributes: The names of the top-level attributes to
+        compress
+    :param int threshold: The minimum encoded size of a value in bytes for
+        it to be compressed
+    :param str codec: ``zlib`` or ``zstd``
+    :param int level: The compression level, defaulting to the default
+        level of the codec
+    :raises UnsupportedCodec: if the codec is not supported or not
+        installed
+
+    """
+    def __init__(self, attributes, threshold=1024, codec=ZLIB, level=None):
+        if codec not in _CODECS:
+            raise UnsupportedCodec('Unsupported codec: {!r}'.format(codec))
+        elif codec == ZSTD and zstandard is None:
+            raise UnsupportedCodec('zstandard is not installed')
+        self.attributes = frozenset(attributes)
+        self.threshold = threshold
+        self.codec = codec
+        self.level = level
+        self._prefix = MAGIC + _CODECS[codec]
+        if codec == ZSTD:
+            self._compress = zstandard.ZstdCompressor(
+                level=3 if level is None else level).compress
+        else:
+            self._compress = (
+                lambda data: zlib.compress(data, -1 if level is None
+                                           else level))
+
+    def __repr__(self):
+        return '<Compression {} {} >= {}>'.format(
+            self.codec, sorted(self.attributes), self.threshold)
+
+    def compress(self, values):
+        """Compress the large values of the configured attributes of
+        marshalled item values, returning a new :class:`dict` if any were
+        compressed.
+
+        :param dict values: The AttributeValues of the item
+        :rtype: dict
+
+        """
+        compressed = None
+        for name in self.attributes.intersection(values):
+            value = self.compress_value(values[name])
+            if value is not None:
+                if compressed is None:
+                    compressed = dict(values)
+                compressed[name] = value
+        return values if compressed is None else compressed
+
+    def compress_value(self, value):
+        """Return the compressed form of an AttributeValue, or :data:`None`
+        if it is below the threshold or does not get smaller.
+
+        :param dict value: The AttributeValue
+        :rtype: dict
+
+        """
+        kind, data = next(iter(value.items()))
+        if kind == 'S':
+            data = data.encode('utf-8')
+        elif kind == 'B':
+            data = base64.b64decode(data)
+        elif kind == 'NULL' or kind == 'BOOL':
+            return None
+        else:
+            data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        if len(data) < self.threshold:
+            return None
+        compressed = self._compress(data)
+        if len(compressed) + len(MAGIC) + 2 >= len(data):
+            return None
+        return {'B': base64.b64encode(
+            self._prefix + _TYPES.get(kind, _JSON) +
+            compressed).decode('ascii')}
+
+
+def decompress(data):
+    """Return the original AttributeValue of a compressed binary value, or
+    :data:`None` if the value was not compressed. A ``B`` value is returned
+    as :class:`bytes` rather than base64 encoded.
+
+    :param bytes data: The binary value
+    :rtype: dict
+    :raises UnsupportedCodec: if the codec is not supported or not
+        installed
+    :raises ValueError: if the value can not be decompressed
+
+    """
+    if not data.startswith(MAGIC) or len(data) < len(MAGIC) + 2:
+        return None
+    codec, kind = data[4:5], data[5:6]
+    try:
+        if codec == b'z':
+            data = zlib.decompress(data[6:])
+        elif codec == b's':
+            if zstandard is None:
+                raise UnsupportedCodec(
+                    'zstandard is required to decompress value')
+            data = zstandard.ZstdDecompressor().decompress(data[6:])
+        else:
+            raise UnsupportedCodec(
+                'Unsupported compression codec: {!r}'.format(codec))
+    except zlib.error as error:
+        raise ValueError('Invalid compressed value: {}'.format(error))
+    except Exception as error:
+        if zstandard is None or \
+                not isinstance(error, zstandard.ZstdError):
+            raise
+        raise ValueError('Invalid compressed value: {}'.format(error))
+    if kind == b'S':
+        return {'S': data.decode('utf-8')}
+    elif kind == b'B':
+        return {'B': data}
+    elif kind == _JSON:
+        return json.loads(data.decode('utf-8'))
+    raise ValueError('Unsupported compressed value type: {!r}'.format(kind))
@@ -0,0 +1,192 @@
+"""
+Counter Coalescing
+==================
+
+Counters kept with an ``UpdateItem`` request per event, such as
+``ADD views :one``, cost a write per event and concentrate throttling on
+the keys of the busiest counters. A :class:`CounterAggregator` buffers
+increments in memory, merging them by table, key and attribute, and writes
+a single ``UpdateItem`` per key on an interval or once a number of
+increments are pending:
+
+.. code:: python
+
+    counters = CounterAggregator(client, interval=1.0)
+    counters.start()
+    ...
+    counters.increment('pages', {'id': page_id}, 'views')
+    ...
+    yield counters.stop()
+
+:meth:`~CounterAggregator.increment` returns a future that resolves when
+the increment has been written, or raises the error that prevented it.
+Callers that need an increment to be durable can wait for it, while others
+can ignore it. Increments are held in memory until they are flushed, so at
+most the increments of one interval, or ``max_pending`` increments, are
+lost if the process exits without calling
+:meth:`~CounterAggregator.stop`. Increments whose ``UpdateItem`` fails are
+not retried beyond the retries of the client, since the update may have
+been applied.
+
+"""
+import collections
+import logging
+
+from tornado import concurrent, gen, ioloop
+
+from sprockets_dynamodb import cache, utils
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Pending(object):
+    """The merged increments of a key."""
+
+    __slots__ = ('key', 'counts', 'future')
+
+    def __init__(self, key):
+        self.key = key
+        self.counts = collections.Counter()
+        self.future = concurrent.Future()
+
+
+class CounterAggregator(object):
+    """Merges counter increments and writes them periodically.
+
+    :param sprockets_dynamodb.client.Client client: The client to write with
+    :param float interval: Seconds between flushes
+    :param int max_pending: Flush as soon as this many increments are
+        pending
+    :param int concurrency: The maximum number of ``UpdateItem`` requests
+        in flight during a flush
+
+    """
+    def __init__(self, client, interval=1.0, max_pending=10000,
+                 concurrency=16):
+        self.client = client
+        self.interval = interval
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.increments = 0
+        self._pending = collections.OrderedDict()
+        self._callback = None
+        self._flushing = None
+
+    def __len__(self):
+        """Return the number of keys with pending increments.
+
+        :rtype: int
+
+        """
+        return len(self._pending)
+
+    def start(self):
+        """Start flushing the pending increments every ``interval``
+        seconds.
+
+        """
+        if self._callback is None:
+            self._callback = ioloop.PeriodicCallback(
+                self.flush, self.interval * 1000)
+            self._callback.start()
+
+    @gen.coroutine
+    def stop(self):
+        """Stop flushing on the interval and flush the pending increments.
+
+        """
+        if self._callback is not None:
+            self._callback.stop()
+            self._callback = None
+        yield self.flush()
+
+    def increment(self, table_name, key_dict, attribute, amount=1):
+        """Add to a counter, returning a future that resolves once the
+        increment has been written.
+
+        :param str table_name: The table name
+        :param dict key_dict: The key of the item
+        :param str attribute: The name of the counter attribute
+        :param int amount: The amount to add, which may be negative
+        :rtype: tornado.concurrent.Future
+
+        """
+        fingerprint = table_name, cache.key_fingerprint(
+            utils.marshall(key_dict))
+        pending = self._pending.get(fingerprint)
+        if pending is None:
+            pending = self._pending[fingerprint] = _Pending(key_dict)
+        pending.counts[attribute] += amount
+        self.increments += 1
+        if self.increments == self.max_pending:
+            ioloop.IOLoop.current().add_callback(self.flush)
+        return pending.future
+
+    def flush(self):
+        """Write the pending increments, returning a future that resolves
+        when they have been written. The increments of a flush started
+        while another is in progress are written after it.
+
+        :rtype: tornado.concurrent.Future
+
+        """
+        if not self._pending and self._flushing is not None:
+            return self._flushing
+        pending = list(self._pending.items())
+        self._pending = collections.OrderedDict()
+        self.increments = 0
+        self._flushing = self._flush(pending, self._flushing)
+        return self._flushing
+
+    @gen.coroutine
+    def _flush(self, pending, previous):
+        """Write the merged increments of each key, once the previous flush
+        has finished.
+
+        :param list pending: The table and fingerprint of each key, with
+            its merged increments
+        :param tornado.concurrent.Future previous: The previous flush
+
+        """
+        if previous is not None:
+            yield previous
+        if not pending:
+            return
+        LOGGER.debug('Flushing the counters of %i keys', len(pending))
+        for offset in range(0, len(pending), self.concurrency):
+            yield [self._write(table_name, entry) for (table_name, _key),
+                   entry in pending[offset:offset + self.concurrency]]
+
+    @gen.coroutine
+    def _write(self, table_name, pending):
+        """Write the merged increments of a key.
+
+        :param str table_name: The table name
+        :param _Pending pending: The merged increments
+
+        """
+        counts = [(name, amount) for name, amount in pending.counts.items()
+                  if amount]
+        if not counts:
+            pending.future.set_result(None)
+            return
+        names, values, clauses = {}, {}, []
+        for offset, (name, amount) in enumerate(counts):
+            names['#c{}'.format(offset)] = name
+            values[':c{}'.format(offset)] = amount
+            clauses.append('#c{0} :c{0}'.format(offset))
+        try:
+            yield self.client.update_item(
+                table_name, pending.key,
+                update_expression='ADD ' + ', '.join(clauses),
+                expression_attribute_names=names,
+                expression_attribute_values=values)
+        except Exception as error:
+            LOGGER.error('Failed to write the counters of %r in %s: %s',
+                         pending.key, table_name, error)
+            pending.future.set_exception(error)
+            # The error is logged here, so unobserved futures are not
+            # reported again when they are garbage collected
+            pending.future.exception()
+        else:
+            pending.future.set_result(None)
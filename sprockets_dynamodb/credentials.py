@@ -0,0 +1,197 @@
+"""
+Credential Management
+=====================
+
+Keeps the AWS credentials used by the client current in the background so
+that requests do not wait on the instance metadata API or the credentials
+file when credentials rotate.
+
+"""
+import calendar
+import logging
+import time
+
+from tornado import concurrent, gen, ioloop
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CredentialProvider(object):
+    """Wraps the :class:`tornado_aws.config.Authorization` of a client,
+    loading the credentials when started and refreshing them in the
+    background ahead of their expiration.
+
+    The provider stands in for the authorization object of the
+    :class:`tornado_aws.client.AsyncAWSClient`, so requests only wait for
+    credentials when none have been loaded yet. Concurrent refreshes, such
+    as those started by every in-flight request when AWS rejects the
+    current credentials, share a single lookup.
+
+    Temporary credentials are refreshed :attr:`REFRESH_MARGIN` seconds
+    before they expire. Instance or container credentials without an
+    expiration are reloaded every :attr:`REFRESH_INTERVAL` seconds. Failed
+    refreshes are retried every :attr:`RETRY_INTERVAL` seconds while the
+    current credentials are kept.
+
+    Static credentials, passed to the client or read from the environment
+    or the credentials file, can not be re-resolved without losing the
+    explicitly passed keys, so they are never refreshed or reset.
+
+    :param tornado_aws.config.Authorization authorization: The wrapped
+        authorization
+    :param tornado.ioloop.IOLoop io_loop: The IOLoop to schedule refreshes on
+
+    """
+    REFRESH_MARGIN = 300
+    REFRESH_INTERVAL = 900
+    RETRY_INTERVAL = 15
+
+    def __init__(self, authorization, io_loop=None):
+        self._authorization = authorization
+        self._ioloop = io_loop or ioloop.IOLoop.current()
+        self._refreshing = None
+        self._stopped = False
+        self._timeout = None
+
+    @property
+    def access_key(self):
+        return self._authorization.access_key
+
+    @property
+    def expiration(self):
+        """The expiration of the current credentials as a UNIX timestamp,
+        or :data:`None` if they do not expire.
+
+        :rtype: float or None
+
+        """
+        value = getattr(self._authorization, '_expiration', None)
+        if not value or self.static:
+            return None
+        try:
+            return float(calendar.timegm(
+                time.strptime(value, '%Y-%m-%dT%H:%M:%SZ')))
+        except (TypeError, ValueError):
+            LOGGER.warning('Could not parse credential expiration: %r', value)
+            return None
+
+    @property
+    def local_credentials(self):
+        return self._authorization.local_credentials
+
+    @property
+    def secret_key(self):
+        return self._authorization.secret_key
+
+    @property
+    def security_token(self):
+        return self._authorization.security_token
+
+    @property
+    def static(self):
+        """Indicates if the credentials were passed to the client or read
+        from the environment or credentials file, rather than fetched from
+        the instance or container metadata API.
+
+        :rtype: bool
+
+        """
+        return bool(self._authorization.local_credentials)
+
+    def needs_credentials(self):
+        """Returns :data:`True` only if no credentials have been loaded, as
+        expiring credentials are refreshed in the background.
+
+        :rtype: bool
+
+        """
+        return self._authorization.needs_credentials()
+
+    def refresh(self):
+        """Refresh the credentials, returning the future of the refresh that
+        is already in progress if there is one.
+
+        :rtype: tornado.concurrent.Future
+
+        """
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = self._refresh()
+        return self._refreshing
+
+    def reset(self):
+        """Discard the credentials after they were rejected by AWS so that
+        the next request waits for a refresh. Static credentials are kept.
+
+        """
+        if self.static:
+            return
+        if self._refreshing is None or self._refreshing.done():
+            self._authorization.reset()
+
+    def start(self):
+        """Load the credentials if they have not been loaded and schedule
+        the background refresh.
+
+        """
+        self._stopped = False
+        if self.needs_credentials():
+            self._ioloop.add_callback(self._on_timeout)
+        elif not self.static:
+            self._schedule(self._refresh_delay())
+
+    def stop(self):
+        """Stop refreshing the credentials in the background, until
+        :meth:`start` is called again. Credentials are still loaded when a
+        request needs them.
+
+        """
+        self._stopped = True
+        self._cancel()
+
+    @gen.coroutine
+    def _refresh(self):
+        if self.static and not self.needs_credentials():
+            return
+        LOGGER.debug('Refreshing credentials')
+        try:
+            result = self._authorization.refresh()
+            if concurrent.is_future(result):
+                yield result
+        except Exception as error:
+            LOGGER.warning('Failed to refresh credentials: %s', error)
+            self._schedule(self.RETRY_INTERVAL)
+            raise
+        if not self.static:
+            self._schedule(self._refresh_delay())
+
+    def _refresh_delay(self):
+        """Return the number of seconds until the credentials should be
+        refreshed.
+
+        :rtype: float
+
+        """
+        expiration = self.expiration
+        if expiration is None:
+            return self.REFRESH_INTERVAL
+        return max(expiration - self.REFRESH_MARGIN - time.time(),
+                   self.RETRY_INTERVAL)
+
+    def _cancel(self):
+        if self._timeout is not None:
+            self._ioloop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _schedule(self, delay):
+        self._cancel()
+        if self._stopped:
+            return
+        LOGGER.debug('Refreshing credentials in %.2f seconds', delay)
+        self._timeout = self._ioloop.call_later(delay, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timeout = None
+        if self._stopped:
+            return
+        future = self.refresh()
+        self._ioloop.add_future(future, lambda f: f.exception())
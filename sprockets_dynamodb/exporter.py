@@ -0,0 +1,319 @@
+"""
+Table Export
+============
+
+Exports the items of a table to newline-delimited JSON files with a
+parallel scan. Each segment of the scan writes the items of each page to
+its own files as the pages are received, so memory use is bounded by a
+page of items per segment rather than the size of the table. Items are
+encoded, compressed and written on an executor so that large exports do
+not block the IOLoop.
+
+.. code:: python
+
+    exporter = Exporter(client, 'example', '/tmp/export', segments=8,
+                        compress=True, read_capacity=500)
+    progress = yield exporter.run()
+
+Files are named ``<table>-<segment>-<part>.ndjson``, with a ``.gz`` suffix
+when compressed, and a new part is started once a file reaches
+``max_file_size`` bytes. The state of every segment is written to a
+checkpoint file in the directory after each page, and running an export
+with the same directory resumes it from the checkpoint, discarding anything
+written after it. When a segment fails, the other segments stop after
+their current page and the error is raised once they have stopped.
+
+Items are unmarshalled before they are written, with sets written as
+sorted lists and binary values as base64 encoded strings. Pass
+``raw_items=True`` to write the AttributeValues of each item instead,
+which preserves the types of all values.
+
+"""
+import collections
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+
+from tornado import gen, ioloop, locks
+
+from sprockets_dynamodb import utils
+
+LOGGER = logging.getLogger(__name__)
+
+Progress = collections.namedtuple(
+    'Progress', ['items', 'pages', 'bytes', 'read_units', 'elapsed',
+                 'segments_done'])
+
+
+class Exporter(object):
+    """Exports a table to newline-delimited JSON files.
+
+    :param sprockets_dynamodb.client.Client client: The client to scan with
+    :param str table_name: The table to export
+    :param str path: The directory the files are written to
+    :param int segments: The number of parallel scan segments
+    :param bool compress: Compress the files with gzip
+    :param int max_file_size: Start a new file for a segment once the
+        current file reaches this size in bytes. Files are rolled between
+        pages, so they can exceed the size by up to a page of items.
+    :param str checkpoint: The checkpoint file, defaulting to
+        ``<table>.checkpoint.json`` in the directory
+    :param float read_capacity: Limit the export to this many read capacity
+        units per second
+    :param bool raw_items: Write the AttributeValues of each item
+    :param callable progress_callback: Invoked with a :class:`Progress`
+        after each page
+    :param float progress_interval: Seconds between progress log entries
+    :param int buffer_size: The write buffer size of each file
+    :param concurrent.futures.Executor executor: The executor to encode and
+        write items on, defaulting to the executor of the IOLoop
+    :param scan_kwargs: Additional arguments for
+        :meth:`~sprockets_dynamodb.client.Client.scan`, such as
+        ``filter_expression`` or ``limit``
+
+    """
+    def __init__(self, client, table_name, path, segments=4, compress=False,
+                 max_file_size=None, checkpoint=None, read_capacity=None,
+                 raw_items=False, progress_callback=None,
+                 progress_interval=10, buffer_size=65536, executor=None,
+                 **scan_kwargs):
+        self.client = client
+        self.table_name = table_name
+        self.path = path
+        self.segments = segments
+        self.compress = compress
+        self.max_file_size = max_file_size
+        self.checkpoint = checkpoint or os.path.join(
+            path, '{}.checkpoint.json'.format(table_name))
+        self.limiter = utils.CapacityLimiter(read_capacity) \
+            if read_capacity else None
+        self.raw_items = raw_items
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.buffer_size = buffer_size
+        self.executor = executor
+        self.scan_kwargs = scan_kwargs
+        self._checkpoint_lock = locks.Lock()
+        self._failed = False
+        self._state = None
+        self._started = None
+        self._logged = None
+        self._totals = None
+
+    @gen.coroutine
+    def run(self):
+        """Export the table, resuming from the checkpoint if there is one.
+
+        :rtype: Progress
+
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._state = self._load_checkpoint()
+        self._started = self._logged = time.monotonic()
+        self._totals = collections.Counter()
+        self._failed = False
+        LOGGER.info('Exporting %s to %s with %i segments',
+                    self.table_name, self.path, self.segments)
+        error = None
+        waiter = gen.WaitIterator(*[self._export_segment(segment)
+                                    for segment in range(self.segments)])
+        while not waiter.done():
+            try:
+                yield waiter.next()
+            except Exception as exc:
+                if error is None:
+                    LOGGER.error('Export of segment %i of %s failed, '
+                                 'stopping: %s', waiter.current_index,
+                                 self.table_name, exc)
+                    error, self._failed = exc, True
+        if error is not None:
+            raise error
+        progress = self.progress()
+        LOGGER.info('Exported %i items from %s in %.2f seconds',
+                    progress.items, self.table_name, progress.elapsed)
+        raise gen.Return(progress)
+
+    def progress(self):
+        """Return the progress of the export. Items, pages, bytes and read
+        units are counted from the start of this run.
+
+        :rtype: Progress
+
+        """
+        return Progress(
+            self._totals['items'], self._totals['pages'],
+            self._totals['bytes'], self._totals['read_units'],
+            time.monotonic() - self._started,
+            sum(1 for state in self._state.values() if state['done']))
+
+    @gen.coroutine
+    def _export_segment(self, segment):
+        state = self._state[str(segment)]
+        if state['done']:
+            return
+        writer = _SegmentWriter(self, segment, state)
+        try:
+            while not self._failed:
+                kwargs = dict(self.scan_kwargs,
+                              segment=segment,
+                              total_segments=self.segments,
+                              item_callback=writer.write,
+                              raw_items=self.raw_items,
+                              return_consumed_capacity='TOTAL')
+                if state['key']:
+                    kwargs['exclusive_start_key'] = \
+                        utils.unmarshall(state['key'])
+                result = yield self.client.scan(self.table_name, **kwargs)
+                written, size, part, offset = yield self._run(
+                    writer.end_page)
+                self._totals['bytes'] += size
+                key = result.get('LastEvaluatedKey')
+                state.update(key=utils.marshall(dict(key)) if key else None,
+                             done=not key, items=state['items'] + written,
+                             part=part, offset=offset)
+                yield self._write_checkpoint()
+                units = float(result.get('ConsumedCapacity', {}).get(
+                    'CapacityUnits', 0))
+                self._on_page(written, units)
+                if state['done']:
+                    break
+                if self.limiter:
+                    delay = self.limiter.delay(units)
+                    if delay:
+                        yield gen.sleep(delay)
+        finally:
+            yield self._run(writer.close)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint) as handle:
+                checkpoint = json.load(handle)
+        except FileNotFoundError:
+            checkpoint = None
+        if checkpoint:
+            if checkpoint['segments'] != self.segments or \
+                    checkpoint['compress'] != self.compress:
+                raise ValueError('The checkpoint in {} was written with '
+                                 'different settings'.format(self.checkpoint))
+            LOGGER.info('Resuming export of %s from %s',
+                        self.table_name, self.checkpoint)
+            return checkpoint['state']
+        return {str(segment): {'key': None, 'done': False, 'items': 0,
+                               'part': 0, 'offset': 0}
+                for segment in range(self.segments)}
+
+    @gen.coroutine
+    def _write_checkpoint(self):
+        """Write the checkpoint on the executor. Writes are serialized so
+        that an older state never replaces a newer one.
+
+        """
+        with (yield self._checkpoint_lock.acquire()):
+            yield self._run(_write_file, self.checkpoint, json.dumps(
+                {'table': self.table_name, 'segments': self.segments,
+                 'compress': self.compress, 'state': self._state}))
+
+    def _run(self, method, *args):
+        return ioloop.IOLoop.current().run_in_executor(
+            self.executor, method, *args)
+
+    def _on_page(self, items, units):
+        self._totals.update(items=items, pages=1, read_units=units)
+        progress = self.progress()
+        if self.progress_callback:
+            self.progress_callback(progress)
+        if time.monotonic() - self._logged >= self.progress_interval:
+            self._logged = time.monotonic()
+            LOGGER.info('Exported %i items from %s (%.1f items/s, %.1f '
+                        'read units/s)', progress.items, self.table_name,
+                        progress.items / progress.elapsed,
+                        progress.read_units / progress.elapsed)
+
+
+class _SegmentWriter(object):
+    """Writes the items of a segment to its current file. Items are
+    collected as they are received and are encoded and written by
+    :meth:`end_page`, which runs on the executor. Compressed pages are
+    written as separate gzip members so that the file can be truncated to
+    the end of the last checkpointed page when an export is resumed.
+
+    :param Exporter exporter: The exporter
+    :param int segment: The segment
+    :param dict state: The checkpoint state of the segment, which is only
+        read, as the checkpoint is written on the IOLoop
+
+    """
+    def __init__(self, exporter, segment, state):
+        self.exporter = exporter
+        self.segment = segment
+        self.part = state['part']
+        self.offset = state['offset']
+        self._items = []
+        self._file = None
+        self._encoder = json.JSONEncoder(
+            default=None if exporter.raw_items else utils.json_default,
+            separators=(',', ':'))
+
+    def write(self, item):
+        self._items.append(item)
+
+    def end_page(self):
+        """Write the items received since the last page, rolling over to a
+        new file when the current one has reached the maximum size, and
+        return the number of items, the uncompressed size of their lines and
+        the part and offset of the end of the page.
+
+        :rtype: (int, int, int, int)
+
+        """
+        items, self._items = self._items, []
+        if self._file is None:
+            self._open()
+        data = b''.join(self._encoder.encode(item).encode('utf-8') + b'\n'
+                        for item in items)
+        if data:
+            self._file.write(gzip.compress(data)
+                             if self.exporter.compress else data)
+        self._file.flush()
+        self.offset = self._file.tell()
+        if self.exporter.max_file_size and \
+                self.offset >= self.exporter.max_file_size:
+            self._file.close()
+            self._file = None
+            self.part, self.offset = self.part + 1, 0
+        return len(items), len(data), self.part, self.offset
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def _open(self):
+        path = os.path.join(
+            self.exporter.path, '{}-{:04d}-{:04d}.ndjson{}'.format(
+                self.exporter.table_name, self.segment, self.part,
+                '.gz' if self.exporter.compress else ''))
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'wb',
+                          buffering=self.exporter.buffer_size)
+        self._file.truncate(self.offset)
+        self._file.seek(self.offset)
+
+
+def _write_file(path, data):
+    """Replace the content of a file with a temporary file renamed into
+    place.
+
+    :param str path: The file path
+    :param str data: The content
+
+    """
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(handle, 'w') as output:
+            output.write(data)
+        os.replace(temporary, path)
+    except Exception:
+        os.unlink(temporary)
+        raise
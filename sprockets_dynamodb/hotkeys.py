@@ -0,0 +1,270 @@
+"""
+Hot Key Detection
+=================
+
+Tracks the most frequently accessed keys of each table so that the keys
+behind hot partition throttling can be identified. The
+:class:`~sprockets_dynamodb.client.Client` feeds the key of every
+``GetItem``, ``PutItem``, ``UpdateItem`` and ``DeleteItem`` attempt into a
+:class:`HotKeyTracker` when created with ``hot_keys=True``, along with the
+attempts that were throttled.
+
+.. code:: python
+
+    client = Client(hot_keys=True)
+    ...
+    for hot_key in client.hot_keys.top('example'):
+        print(hot_key.key, hot_key.requests, hot_key.throttle_rate)
+
+Each table has a pair of count-min sketches, counting the requests and the
+throttled requests for each key in a fixed amount of memory, and a heap of
+the keys with the highest estimated request counts. Recording a key costs a
+hash and a few counter updates regardless of how many distinct keys a
+table has. The estimates can overcount but never undercount, with an error
+that shrinks as the sketch width grows. Counts are halved every ``window``
+seconds so that the estimates follow the current traffic.
+
+The top keys of a table are added to the ``hot_keys`` field of the last
+:class:`~sprockets_dynamodb.client.Measurement` of an action at most once
+per ``report_interval`` seconds, so that they can be reported from the
+instrumentation callback.
+
+"""
+import array
+import collections
+import heapq
+import time
+
+from sprockets_dynamodb import utils
+
+HotKey = collections.namedtuple(
+    'HotKey', ['table', 'key', 'requests', 'throttles', 'throttle_rate'])
+
+_MASK = (1 << 64) - 1
+
+
+class CountMinSketch(object):
+    """Estimates the frequency of hashed values in fixed memory.
+
+    :param int width: The number of counters in each row
+    :param int depth: The number of rows, each with its own hash function
+
+    """
+    __slots__ = ('width', 'depth', 'counters')
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counters = array.array('Q', bytes(8 * width * depth))
+
+    def add(self, value, count=1):
+        """Add to the count of a hashed value, returning its new estimate.
+
+        :param int value: The hash of the value
+        :param int count: The amount to add
+        :rtype: int
+
+        """
+        counters, estimate = self.counters, None
+        for offset in self._offsets(value):
+            counters[offset] += count
+            if estimate is None or counters[offset] < estimate:
+                estimate = counters[offset]
+        return estimate
+
+    def estimate(self, value):
+        """Return the estimated count of a hashed value.
+
+        :param int value: The hash of the value
+        :rtype: int
+
+        """
+        counters = self.counters
+        return min(counters[offset] for offset in self._offsets(value))
+
+    def decay(self):
+        """Halve every counter."""
+        self.counters = array.array(
+            'Q', [counter >> 1 for counter in self.counters])
+
+    def _offsets(self, value):
+        # Derive the row hashes from two halves of one hash
+        value &= _MASK
+        first, second = value & 0xffffffff, (value >> 32) | 1
+        width = self.width
+        return [row * width + (first + row * second) % width
+                for row in range(self.depth)]
+
+
+class _Table(object):
+    """The sketches and top keys of a table."""
+
+    __slots__ = ('requests', 'throttles', 'top', 'heap', 'decayed',
+                 'reported')
+
+    def __init__(self, width, depth, now):
+        self.requests = CountMinSketch(width, depth)
+        self.throttles = CountMinSketch(width, depth)
+        self.top = {}
+        self.heap = []
+        self.decayed = now
+        self.reported = now
+
+
+class HotKeyTracker(object):
+    """Tracks the request and throttle frequency of the keys of each table.
+
+    :param int top: The number of keys tracked as hot keys per table
+    :param int width: The number of counters in each sketch row
+    :param int depth: The number of rows in each sketch
+    :param float window: Seconds between halving the counts, or :data:`None`
+        to never age them
+    :param float report_interval: Minimum seconds between adding the hot
+        keys of a table to a measurement, or :data:`None` to never add them
+
+    """
+    def __init__(self, top=10, width=2048, depth=4, window=60.0,
+                 report_interval=60.0):
+        self.size = top
+        self.width = width
+        self.depth = depth
+        self.window = window
+        self.report_interval = report_interval
+        self._tables = {}
+        self._key_names = {}
+
+    def item_key(self, parameters):
+        """Return the table and key of the parameters of an item action, or
+        :data:`None` if the key is unknown. The names of the key attributes
+        of a table are learned from the ``Key`` of the requests that have
+        one, so the key of a ``PutItem`` can only be determined once the
+        table has been read, updated or deleted from.
+
+        :param dict parameters: The action parameters
+        :rtype: tuple
+
+        """
+        table = parameters.get('TableName')
+        if 'Key' in parameters:
+            key = parameters['Key']
+            if table not in self._key_names:
+                self._key_names[table] = tuple(key)
+            return table, key
+        names, item = self._key_names.get(table), parameters.get('Item')
+        if names and item and all(name in item for name in names):
+            return table, {name: item[name] for name in names}
+        return None
+
+    def record(self, table, key, throttled=False):
+        """Count a request for the key of an item.
+
+        :param str table: The table name
+        :param dict key: The AttributeValues of the key
+        :param bool throttled: The request was throttled
+
+        """
+        state = self._table(table)
+        key = _canonical(key)
+        hashed = hash(key)
+        if throttled:
+            state.throttles.add(hashed)
+            return
+        count = state.requests.add(hashed)
+        top = state.top
+        if key in top or len(top) < self.size:
+            top[key] = count
+            heapq.heappush(state.heap, (count, key))
+        elif count > state.heap[0][0]:
+            while state.heap[0][1] not in top or \
+                    top[state.heap[0][1]] != state.heap[0][0]:
+                heapq.heappop(state.heap)
+            if count > state.heap[0][0]:
+                del top[heapq.heappop(state.heap)[1]]
+                top[key] = count
+                heapq.heappush(state.heap, (count, key))
+        if len(state.heap) > 4 * self.size:
+            state.heap = [(value, name) for name, value in top.items()]
+            heapq.heapify(state.heap)
+
+    def top(self, table, count=None):
+        """Return the keys of the table with the most requests, heaviest
+        first.
+
+        :param str table: The table name
+        :param int count: The number of keys to return, defaulting to all
+            of the tracked keys
+        :rtype: list(HotKey)
+
+        """
+        state = self._tables.get(table)
+        if state is None:
+            return []
+        result = []
+        for key in state.top:
+            hashed = hash(key)
+            requests = state.requests.estimate(hashed)
+            throttles = min(state.throttles.estimate(hashed), requests)
+            result.append(HotKey(
+                table, utils.unmarshall(_attribute_values(key)), requests,
+                throttles, throttles / requests if requests else 0.0))
+        result.sort(key=lambda hot_key: hot_key.requests, reverse=True)
+        return result[:count]
+
+    def report(self, table):
+        """Return the top keys of the table if the report interval has
+        elapsed since they were last returned, otherwise an empty tuple.
+
+        :param str table: The table name
+        :rtype: tuple(HotKey)
+
+        """
+        state = self._tables.get(table)
+        if state is None or self.report_interval is None:
+            return ()
+        now = time.monotonic()
+        if now - state.reported < self.report_interval:
+            return ()
+        state.reported = now
+        return tuple(self.top(table))
+
+    def reset(self, table=None):
+        """Discard the counts of a table, or of every table.
+
+        :param str table: The table name
+
+        """
+        if table is None:
+            self._tables.clear()
+        else:
+            self._tables.pop(table, None)
+
+    def _table(self, table):
+        now = time.monotonic()
+        state = self._tables.get(table)
+        if state is None:
+            state = self._tables[table] = _Table(self.width, self.depth, now)
+        elif self.window and now - state.decayed >= self.window:
+            state.decayed = now
+            state.requests.decay()
+            state.throttles.decay()
+            for key in state.top:
+                state.top[key] >>= 1
+            state.heap = [(value, key) for key, value in state.top.items()]
+            heapq.heapify(state.heap)
+        return state
+
+
+def _canonical(key):
+    """Return a hashable form of the AttributeValues of a key.
+
+    :param dict key: The AttributeValues of the key
+    :rtype: tuple
+
+    """
+    return tuple(sorted((name, kind, value)
+                        for name, attribute in key.items()
+                        for kind, value in attribute.items()))
+
+
+def _attribute_values(key):
+    return {name: {kind: value} for name, kind, value in key}
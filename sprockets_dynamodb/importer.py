@@ -0,0 +1,307 @@
+"""
+Table Import
+============
+
+Loads newline-delimited JSON or CSV files into a table with concurrent
+``BatchWriteItem`` requests. Records are parsed lazily from a memory map of
+the file, or streamed when the file is gzip compressed, and only the
+batches that are in flight are held in memory, so the memory use of an
+import does not grow with the size of the file.
+
+.. code:: python
+
+    importer = Importer(client, 'example', '/tmp/items.ndjson',
+                        concurrency=16, write_capacity=1000)
+    progress = yield importer.run()
+
+NDJSON records are marshalled with the schema registered for the table
+with :meth:`~sprockets_dynamodb.client.Client.register_schema`, or
+:func:`~sprockets_dynamodb.utils.marshall` when there is none. Pass
+``raw_items=True`` for files that contain AttributeValues, such as those
+written by :class:`~sprockets_dynamodb.exporter.Exporter` with
+``raw_items=True``. CSV columns are imported as strings unless a type is
+declared for them, and empty columns are omitted.
+
+Items that DynamoDB returns as unprocessed are retried with an
+exponential backoff. The requests of a batch must not contain the same key
+more than once.
+
+"""
+import collections
+import csv
+import gzip
+import io
+import json
+import logging
+import mmap
+import os
+import time
+
+from tornado import gen, locks
+
+from sprockets_dynamodb import exceptions, utils
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_SIZE = 25
+
+Progress = collections.namedtuple(
+    'Progress', ['items', 'batches', 'bytes', 'write_units', 'retries',
+                 'elapsed'])
+
+_CONVERTERS = {
+    'S': str,
+    'N': utils._to_number,
+    'BOOL': lambda value: value.lower() in {'1', 'true', 'yes', 'y'}
+}
+
+
+class Importer(object):
+    """Imports the records of a file into a table.
+
+    :param sprockets_dynamodb.client.Client client: The client to write with
+    :param str table_name: The table to import into
+    :param str path: The file to import, with a ``.csv`` or ``.ndjson``
+        extension, optionally followed by ``.gz``
+    :param str file_format: ``csv`` or ``ndjson``, overriding the format
+        determined by the file extension
+    :param dict types: For CSV files, the type codes (``S``, ``N`` or
+        ``BOOL``) of columns that are not strings
+    :param bool raw_items: NDJSON records are AttributeValues
+    :param int concurrency: The maximum number of batches in flight
+    :param float write_capacity: Limit the import to this many write
+        capacity units per second
+    :param int max_retries: The number of times unprocessed items are
+        retried before the import fails
+    :param callable progress_callback: Invoked with a :class:`Progress`
+        after each batch
+    :param float progress_interval: Seconds between progress log entries
+
+    """
+    RETRY_DELAY = 0.05
+    MAX_RETRY_DELAY = 5.0
+
+    def __init__(self, client, table_name, path, file_format=None,
+                 types=None, raw_items=False, concurrency=8,
+                 write_capacity=None, max_retries=10,
+                 progress_callback=None, progress_interval=10):
+        self.client = client
+        self.table_name = table_name
+        self.path = path
+        self.file_format = file_format or _file_format(path)
+        if self.file_format not in {'csv', 'ndjson'}:
+            raise ValueError('Unsupported file format: {}'.format(
+                self.file_format))
+        self.types = {name: _CONVERTERS[kind]
+                      for name, kind in (types or {}).items()}
+        self.raw_items = raw_items
+        self.concurrency = concurrency
+        self.limiter = utils.CapacityLimiter(write_capacity) \
+            if write_capacity else None
+        self.max_retries = max_retries
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self._position = None
+        self._started = None
+        self._logged = None
+        self._totals = collections.Counter()
+
+    @gen.coroutine
+    def run(self):
+        """Import the file, returning the progress once every batch has been
+        written.
+
+        :rtype: Progress
+        :raises: :exc:`~sprockets_dynamodb.exceptions.DynamoDBException` if
+            a batch could not be written
+
+        """
+        self._started = self._logged = time.monotonic()
+        self._totals = collections.Counter()
+        LOGGER.info('Importing %s into %s', self.path, self.table_name)
+        semaphore = locks.Semaphore(self.concurrency)
+        pending, failed = set(), []
+
+        def on_done(future):
+            pending.discard(future)
+            semaphore.release()
+            if future.exception() is not None:
+                failed.append(future)
+
+        with _LineSource(self.path) as (handle, position):
+            self._position = position
+            for batch, units in self._batches(handle):
+                yield semaphore.acquire()
+                if failed:
+                    break
+                if self.limiter:
+                    delay = self.limiter.delay(units)
+                    if delay:
+                        yield gen.sleep(delay)
+                future = self._write(batch, units)
+                pending.add(future)
+                future.add_done_callback(on_done)
+            yield list(pending)
+            self._totals['bytes'] = position()
+            self._position = None
+        if failed:
+            failed[0].result()
+        progress = self.progress()
+        LOGGER.info('Imported %i items into %s in %.2f seconds',
+                    progress.items, self.table_name, progress.elapsed)
+        raise gen.Return(progress)
+
+    def progress(self):
+        """Return the progress of the import.
+
+        :rtype: Progress
+
+        """
+        return Progress(
+            self._totals['items'], self._totals['batches'],
+            self._position() if self._position else self._totals['bytes'],
+            self._totals['write_units'], self._totals['retries'],
+            time.monotonic() - self._started)
+
+    def _batches(self, handle):
+        """Return the marshalled ``PutRequest`` of each record in batches,
+        along with the write capacity units the batch is estimated to
+        consume. Batches are split to stay within the request size limit.
+
+        :rtype: iterator
+        :raises: :exc:`~sprockets_dynamodb.exceptions.ValidationException`
+            if an item exceeds the maximum item size
+
+        """
+        batch, size, units = [], 0, 0.0
+        for item in self._records(handle):
+            if not self.raw_items:
+                item = self.client._marshall(self.table_name, item)
+            item_size = utils.item_size(item, marshalled=True)
+            if item_size > utils.MAX_ITEM_SIZE:
+                raise exceptions.ValidationException(
+                    'Item of {} bytes exceeds the maximum item size'.format(
+                        item_size))
+            if batch and size + item_size > utils.MAX_BATCH_WRITE_SIZE:
+                yield batch, units
+                batch, size, units = [], 0, 0.0
+            batch.append({'PutRequest': {'Item': item}})
+            size += item_size
+            units += utils.write_units(item_size)
+            if len(batch) == BATCH_SIZE:
+                yield batch, units
+                batch, size, units = [], 0, 0.0
+        if batch:
+            yield batch, units
+
+    def _records(self, lines):
+        """Parse the records from the lines of the file.
+
+        :param iterator lines: The lines of the file as bytes
+        :rtype: iterator
+
+        """
+        if self.file_format == 'ndjson':
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        types = self.types
+        reader = csv.reader(line.decode('utf-8') for line in lines)
+        header = next(reader, [])
+        for row in reader:
+            yield {name: types[name](value) if name in types else value
+                   for name, value in zip(header, row) if value != ''}
+
+    @gen.coroutine
+    def _write(self, requests, charged=0.0):
+        """Write a batch, retrying the unprocessed items until all of them
+        have been written. The write capacity limiter was charged with the
+        estimated units of the batch before it was sent, and is charged with
+        the difference once the consumed units are known.
+
+        :param list requests: The ``PutRequest`` of each item
+        :param float charged: The units charged to the limiter in advance
+
+        """
+        items = len(requests)
+        for attempt in range(self.max_retries + 1):
+            result = yield self.client.execute('BatchWriteItem', {
+                'RequestItems': {self.table_name: requests},
+                'ReturnConsumedCapacity': 'TOTAL'})
+            units = sum(float(value.get('CapacityUnits', 0))
+                        for value in (result or {}).get(
+                            'ConsumedCapacity', []))
+            self._totals['write_units'] += units
+            requests = ((result or {}).get('UnprocessedItems') or {}).get(
+                self.table_name)
+            if self.limiter:
+                delay = self.limiter.delay(units - charged)
+                charged = 0.0
+                if delay:
+                    yield gen.sleep(delay)
+            if not requests:
+                break
+            self._totals['retries'] += 1
+            LOGGER.debug('Retrying %i unprocessed items', len(requests))
+            yield gen.sleep(min(self.RETRY_DELAY * 2 ** attempt,
+                                self.MAX_RETRY_DELAY))
+        else:
+            raise exceptions.ThroughputExceeded(
+                '{} items were still unprocessed after {} retries'.format(
+                    len(requests), self.max_retries))
+        self._on_batch(items)
+
+    def _on_batch(self, items):
+        self._totals.update(items=items, batches=1)
+        progress = self.progress()
+        if self.progress_callback:
+            self.progress_callback(progress)
+        if time.monotonic() - self._logged >= self.progress_interval:
+            self._logged = time.monotonic()
+            LOGGER.info('Imported %i items into %s (%.1f items/s, %.1f '
+                        'write units/s)', progress.items, self.table_name,
+                        progress.items / progress.elapsed,
+                        progress.write_units / progress.elapsed)
+
+
+class _LineSource(object):
+    """Context manager that returns an iterator of the lines of a file and
+    a function returning the number of bytes read. Uncompressed files are
+    memory-mapped, gzip compressed files are streamed.
+
+    :param str path: The file path
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+        self._map = None
+
+    def __enter__(self):
+        if self.path.endswith('.gz'):
+            self._handle = open(self.path, 'rb')
+            lines = io.BufferedReader(gzip.GzipFile(fileobj=self._handle))
+            return lines, self._handle.tell
+        self._handle = open(self.path, 'rb')
+        if not os.fstat(self._handle.fileno()).st_size:
+            return iter(()), self._handle.tell
+        self._map = mmap.mmap(self._handle.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+        return iter(self._map.readline, b''), self._map.tell
+
+    def __exit__(self, *args):
+        if self._map is not None:
+            self._map.close()
+        self._handle.close()
+
+
+def _file_format(path):
+    """Return the file format from the extension of the path.
+
+    :param str path: The file path
+    :rtype: str
+
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    return os.path.splitext(name)[1].lstrip('.').lower()
@@ -1,16 +1,34 @@
+import collections
+import json
+import logging
 import os
+import time
 
-from tornado import web
+try:
+    import contextvars
+except ImportError:  # pragma: nocover
+    contextvars = None
+
+from tornado import gen, ioloop, iostream, web
 
 try:
     import sprockets_influxdb as influxdb
 except ImportError:
     influxdb = None
 
-from sprockets_dynamodb import exceptions
+from sprockets_dynamodb import cache, client, exceptions, utils
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_GET_SIZE = 100
 
 INFLUXDB_DATABASE = 'dynamodb'
 INFLUXDB_MEASUREMENT = os.getenv('SERVICE', 'DynamoDB')
+INFLUXDB_CAPACITY_MEASUREMENT = '{}-capacity'.format(INFLUXDB_MEASUREMENT)
+INFLUXDB_HOT_KEY_MEASUREMENT = '{}-hot-keys'.format(INFLUXDB_MEASUREMENT)
+
+_CAPACITY_TALLY = contextvars.ContextVar(
+    'sprockets_dynamodb_capacity', default=None) if contextvars else None
 
 
 def _no_creds_should_return_429():
@@ -27,15 +45,140 @@ class DynamoDBMixin(object):
     """The DynamoDBMixin is an opinionated :class:`~tornado.web.RequestHandler`
     mixin class that
 
+    Set :attr:`DYNAMODB_CAPACITY_TALLY` to :data:`True` to have the capacity
+    consumed by the DynamoDB requests made while handling a request tallied
+    by ``(table, index)`` in the :attr:`dynamodb_read_units` and
+    :attr:`dynamodb_write_units` counters. The client must be configured to
+    return consumed capacity for there to be anything to tally. The counters
+    are held in a context variable that is set when the handler is
+    initialized, and Tornado executes each request in a task with its own
+    copy of that context, so concurrent requests are tallied separately.
+    Handlers initialized in the same context outside of Tornado, such as in
+    tests, share the tally of the handler that was initialized last.
+
+    :attr:`dynamodb` is a :class:`RequestScope` for the request, which can
+    be used in place of ``self.application.dynamodb`` to memoize reads and
+    batch concurrent :meth:`~RequestScope.get_item` calls. When it is used,
+    a summary of its calls is logged at :attr:`DYNAMODB_SUMMARY_LEVEL` when
+    the request finishes.
+
+    :meth:`stream_dynamodb_items` writes the items of a query or scan to the
+    response as they are received, page by page.
+
     """
+    DYNAMODB_CAPACITY_TALLY = False
+    DYNAMODB_SUMMARY_LEVEL = logging.DEBUG
+
     def initialize(self):
         super(DynamoDBMixin, self).initialize()
+        self._dynamodb_scope = None
+        self._dynamodb_disconnected = False
+        self.dynamodb_read_units = collections.Counter()
+        self.dynamodb_write_units = collections.Counter()
         self.application.dynamodb.set_error_callback(
             self._on_dynamodb_exception)
-        if influxdb:
+        tally = self.DYNAMODB_CAPACITY_TALLY and _CAPACITY_TALLY is not None
+        if _CAPACITY_TALLY is not None:
+            _CAPACITY_TALLY.set(
+                (self.dynamodb_read_units, self.dynamodb_write_units)
+                if tally else None)
+        if influxdb or tally:
             self.application.dynamodb.set_instrumentation_callback(
                 self._record_dynamodb_execution)
 
+    @property
+    def dynamodb(self):
+        """The request-scoped DynamoDB data accessor.
+
+        :rtype: RequestScope
+
+        """
+        if self._dynamodb_scope is None:
+            self._dynamodb_scope = RequestScope(self.application.dynamodb)
+        return self._dynamodb_scope
+
+    @gen.coroutine
+    def stream_dynamodb_items(self, action, table_name, ndjson=False,
+                              max_items=None, **kwargs):
+        """Paginate a query or scan, writing the items to the response as a
+        JSON array, or as newline delimited JSON when ``ndjson`` is set. The
+        items are encoded as each page is received and the response is
+        flushed between pages, so only a single page is held in memory. If
+        the client disconnects, pagination stops after the current page.
+
+        .. code:: python
+
+            @gen.coroutine
+            def get(self, user_id):
+                yield self.stream_dynamodb_items(
+                    'query', 'events', key_condition_expression='id = :id',
+                    expression_attribute_values={':id': user_id})
+
+        Binary values are encoded as base64 and sets as sorted lists. The
+        response headers are sent with the first page, so an error from a
+        later page closes the connection instead of returning an error
+        response.
+
+        :param str action: ``query`` or ``scan``
+        :param str table_name: The table name
+        :param bool ndjson: Write newline delimited JSON instead of an array
+        :param int max_items: Stop paginating once this many items have been
+            written
+        :param kwargs: The arguments for
+            :meth:`~sprockets_dynamodb.client.Client.query` or
+            :meth:`~sprockets_dynamodb.client.Client.scan`
+        :returns: The number of items written
+        :rtype: int
+        :raises ValueError: if the action is not supported
+
+        """
+        if action not in {'query', 'scan'}:
+            raise ValueError('Unsupported action: {}'.format(action))
+        method = getattr(self.application.dynamodb, action)
+        encoder = json.JSONEncoder(default=utils.json_default,
+                                   separators=(',', ':'))
+        written = [0]
+
+        def write(item):
+            if ndjson:
+                self.write(encoder.encode(item) + '\n')
+            else:
+                self.write((',' if written[0] else '[') +
+                           encoder.encode(item))
+            written[0] += 1
+
+        self.set_header('Content-Type', 'application/x-ndjson'
+                        if ndjson else 'application/json')
+        while not self._dynamodb_disconnected:
+            result = yield method(table_name, item_callback=write, **kwargs)
+            try:
+                yield self.flush()
+            except iostream.StreamClosedError:
+                self._dynamodb_disconnected = True
+            if not result.get('LastEvaluatedKey') or \
+                    (max_items and written[0] >= max_items):
+                break
+            kwargs['exclusive_start_key'] = result['LastEvaluatedKey']
+        if not ndjson and not self._dynamodb_disconnected:
+            self.write(']' if written[0] else '[]')
+        raise gen.Return(written[0])
+
+    def on_connection_close(self):
+        self._dynamodb_disconnected = True
+        super(DynamoDBMixin, self).on_connection_close()
+
+    def on_finish(self):
+        if self._dynamodb_scope is not None:
+            stats = self._dynamodb_scope.stats
+            getattr(self, 'logger', LOGGER).log(
+                self.DYNAMODB_SUMMARY_LEVEL,
+                'DynamoDB: %i calls, %i cache hits, %i requests (%i batched '
+                'gets), %.1f read units, %.1f write units, %.3f seconds',
+                stats['calls'], stats['hits'], stats['requests'],
+                stats['batches'], sum(self.dynamodb_read_units.values()),
+                sum(self.dynamodb_write_units.values()), stats['duration'])
+        super(DynamoDBMixin, self).on_finish()
+
     def _on_dynamodb_exception(self, error):
         """Dynamically handle DynamoDB exceptions, returning HTTP error
         responses.
@@ -57,7 +200,15 @@ class DynamoDBMixin(object):
 
     @staticmethod
     def _record_dynamodb_execution(measurements):
+        tally = _CAPACITY_TALLY.get() if _CAPACITY_TALLY is not None else None
         for row in measurements:
+            if tally:
+                for capacity in row.capacity:
+                    key = capacity.table, capacity.index
+                    tally[0][key] += capacity.read_units
+                    tally[1][key] += capacity.write_units
+            if not influxdb:
+                continue
             measurement = influxdb.Measurement(INFLUXDB_DATABASE,
                                                INFLUXDB_MEASUREMENT)
             measurement.set_timestamp(row.timestamp)
@@ -68,3 +219,311 @@ class DynamoDBMixin(object):
                 measurement.set_tag('error', row.error)
             measurement.set_field('duration', row.duration)
             influxdb.add_measurement(measurement)
+            for capacity in row.capacity:
+                measurement = influxdb.Measurement(
+                    INFLUXDB_DATABASE, INFLUXDB_CAPACITY_MEASUREMENT)
+                measurement.set_timestamp(row.timestamp)
+                measurement.set_tag('action', row.action)
+                measurement.set_tag('table', capacity.table)
+                if capacity.index:
+                    measurement.set_tag('index', capacity.index)
+                measurement.set_field('read_units', capacity.read_units)
+                measurement.set_field('write_units', capacity.write_units)
+                influxdb.add_measurement(measurement)
+            for rank, hot_key in enumerate(row.hot_keys, 1):
+                measurement = influxdb.Measurement(
+                    INFLUXDB_DATABASE, INFLUXDB_HOT_KEY_MEASUREMENT)
+                measurement.set_timestamp(row.timestamp)
+                measurement.set_tag('table', hot_key.table)
+                measurement.set_tag('rank', rank)
+                measurement.set_field('key', ','.join(
+                    '{}={}'.format(name, value)
+                    for name, value in sorted(hot_key.key.items())))
+                measurement.set_field('requests', hot_key.requests)
+                measurement.set_field('throttles', hot_key.throttles)
+                measurement.set_field('throttle_rate', hot_key.throttle_rate)
+                influxdb.add_measurement(measurement)
+
+
+class RequestScope(object):
+    """Wraps the :class:`~sprockets_dynamodb.client.Client` for a single
+    request, memoizing reads for the life of the request and combining the
+    :meth:`get_item` calls made in the same IOLoop iteration into
+    ``BatchGetItem`` requests. Writes through the scope, including those
+    made with :meth:`execute`, remove the memoized reads they could make
+    stale. Every other client method is passed through.
+
+    .. code:: python
+
+        user, account = yield [
+            self.dynamodb.get_item('users', {'id': user_id}),
+            self.dynamodb.get_item('accounts', {'id': account_id})]
+
+    Memoized results are shared between callers and must not be modified.
+
+    :param sprockets_dynamodb.client.Client client: The client
+
+    .. attribute:: stats
+
+        A :class:`collections.Counter` of the ``calls`` made to the scope,
+        the ``hits`` answered from memoized results, the ``requests`` sent to
+        DynamoDB, the ``batches`` of gets among them and their ``duration``
+        in seconds
+
+    """
+    MAX_RETRIES = 5
+    RETRY_DELAY = 0.05
+
+    def __init__(self, client):
+        self.client = client
+        self.stats = collections.Counter()
+        self._memo = {}
+        self._pending = collections.OrderedDict()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def get_item(self, table_name, key_dict, consistent_read=False):
+        """Get an item, returning the memoized result of an earlier call for
+        the same key. Calls made in the same IOLoop iteration are sent as
+        ``BatchGetItem`` requests.
+
+        :param str table_name: The table name
+        :param dict key_dict: The key of the item
+        :param bool consistent_read: Use a strongly consistent read
+        :rtype: tornado.concurrent.Future
+
+        The future resolves to ``{'Item': item}``, or :data:`None` if the
+        item does not exist, as with
+        :meth:`~sprockets_dynamodb.client.Client.get_item`.
+
+        """
+        self.stats['calls'] += 1
+        memo = 'GetItem', table_name, bool(consistent_read), \
+            cache.key_fingerprint(utils.marshall(key_dict))
+        if memo in self._memo:
+            self.stats['hits'] += 1
+            return self._memo[memo]
+        future = self._memo[memo] = gen.Future()
+        if not self._pending:
+            ioloop.IOLoop.current().add_callback(self._flush)
+        self._pending[memo] = key_dict, future
+        return future
+
+    def query(self, table_name, **kwargs):
+        """Query a table, returning the memoized result of an earlier query
+        with the same arguments. See
+        :meth:`~sprockets_dynamodb.client.Client.query`.
+
+        :param str table_name: The table name
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._memoized('Query', self.client.query, table_name, kwargs)
+
+    def scan(self, table_name, **kwargs):
+        """Scan a table, returning the memoized result of an earlier scan
+        with the same arguments. See
+        :meth:`~sprockets_dynamodb.client.Client.scan`.
+
+        :param str table_name: The table name
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._memoized('Scan', self.client.scan, table_name, kwargs)
+
+    def put_item(self, table_name, item, *args, **kwargs):
+        """Put an item and forget the memoized reads of the table. See
+        :meth:`~sprockets_dynamodb.client.Client.put_item`.
+
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._write([table_name], self.client.put_item, table_name,
+                           item, *args, **kwargs)
+
+    def update_item(self, table_name, key_dict, *args, **kwargs):
+        """Update an item and forget the memoized reads of the table. See
+        :meth:`~sprockets_dynamodb.client.Client.update_item`.
+
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._write([table_name], self.client.update_item,
+                           table_name, key_dict, *args, **kwargs)
+
+    def delete_item(self, table_name, key_dict, *args, **kwargs):
+        """Delete an item and forget the memoized reads of the table. See
+        :meth:`~sprockets_dynamodb.client.Client.delete_item`.
+
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._write([table_name], self.client.delete_item,
+                           table_name, key_dict, *args, **kwargs)
+
+    def batch_write_item(self, request_items, *args, **kwargs):
+        """Write a batch and forget the memoized reads of its tables. See
+        :meth:`~sprockets_dynamodb.client.Client.batch_write_item`.
+
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._write(list(request_items), self.client.batch_write_item,
+                           request_items, *args, **kwargs)
+
+    def execute(self, action, parameters, *args, **kwargs):
+        """Execute an action, forgetting the memoized reads of the tables
+        it writes to, or every memoized read if they can not be determined
+        from the parameters. See
+        :meth:`~sprockets_dynamodb.client.Client.execute`.
+
+        :rtype: tornado.concurrent.Future
+
+        """
+        if action in client.READ_ACTIONS:
+            return self._call(self.client.execute, action, parameters,
+                              *args, **kwargs)
+        return self._write(_write_tables(parameters), self.client.execute,
+                           action, parameters, *args, **kwargs)
+
+    @gen.coroutine
+    def _call(self, method, *args, **kwargs):
+        """Invoke a client method, counting the request and its duration.
+
+        :param callable method: The client method
+        :rtype: mixed
+
+        """
+        self.stats['requests'] += 1
+        start = time.monotonic()
+        try:
+            result = yield method(*args, **kwargs)
+        finally:
+            self.stats['duration'] += time.monotonic() - start
+        raise gen.Return(result)
+
+    def _forget(self, table_names):
+        """Forget the memoized reads of the tables, or every memoized read
+        when no tables are given.
+
+        :param list table_names: The table names
+
+        """
+        for memo in [memo for memo in self._memo
+                     if not table_names or memo[1] in table_names]:
+            del self._memo[memo]
+
+    @gen.coroutine
+    def _write(self, table_names, method, *args, **kwargs):
+        """Invoke a client method that writes to the tables, forgetting
+        their memoized reads before the write and again once it has
+        finished, as reads made while it was in flight may be stale.
+
+        :param list table_names: The tables written to
+        :param callable method: The client method
+        :rtype: mixed
+
+        """
+        self._forget(table_names)
+        try:
+            result = yield self._call(method, *args, **kwargs)
+        finally:
+            self._forget(table_names)
+        raise gen.Return(result)
+
+    def _memoized(self, action, method, table_name, kwargs):
+        self.stats['calls'] += 1
+        if kwargs.get('item_callback'):
+            return self._call(method, table_name, **kwargs)
+        memo = action, table_name, cache._canonical(utils.marshall(kwargs))
+        if memo in self._memo:
+            self.stats['hits'] += 1
+            return self._memo[memo]
+        future = self._memo[memo] = self._call(method, table_name, **kwargs)
+        future.add_done_callback(
+            lambda value: value.exception() is None or
+            self._memo.pop(memo, None))
+        return future
+
+    @gen.coroutine
+    def _flush(self):
+        """Send the pending gets, in batches of up to 100 keys per table and
+        read consistency.
+
+        """
+        pending, self._pending = self._pending, collections.OrderedDict()
+        groups = collections.OrderedDict()
+        for memo, value in pending.items():
+            groups.setdefault(memo[1:3], []).append((memo, value))
+        batches = []
+        for (table_name, consistent), requests in groups.items():
+            for offset in range(0, len(requests), BATCH_GET_SIZE):
+                batches.append(self._get_batch(
+                    table_name, consistent,
+                    requests[offset:offset + BATCH_GET_SIZE]))
+        yield batches
+
+    @gen.coroutine
+    def _get_batch(self, table_name, consistent, requests):
+        """Get the items of a batch and resolve their futures.
+
+        :param str table_name: The table name
+        :param bool consistent: Use strongly consistent reads
+        :param list requests: The memo key, item key and future of each get
+
+        """
+        futures = {memo[3]: future for memo, (_key, future) in requests}
+        try:
+            if len(requests) == 1:
+                result = yield self._call(
+                    self.client.get_item, table_name, requests[0][1][0],
+                    consistent_read=consistent)
+                futures.popitem()[1].set_result(result)
+                return
+            self.stats['batches'] += 1
+            keys = [key for _memo, (key, _future) in requests]
+            for attempt in range(self.MAX_RETRIES + 1):
+                result = yield self._call(
+                    self.client.batch_get_item, {table_name: {
+                        'Keys': keys, 'ConsistentRead': consistent}})
+                for item in result['Responses'].get(table_name, []):
+                    fingerprint = cache.key_fingerprint(utils.marshall(
+                        {name: item[name] for name in keys[0]}))
+                    future = futures.pop(fingerprint, None)
+                    if future is not None:
+                        future.set_result({'Item': item})
+                keys = result['UnprocessedKeys'].get(
+                    table_name, {}).get('Keys')
+                if not keys:
+                    break
+                yield gen.sleep(self.RETRY_DELAY * 2 ** attempt)
+            else:
+                raise exceptions.ThroughputExceeded(
+                    '{} keys were still unprocessed after {} retries'.format(
+                        len(keys), self.MAX_RETRIES))
+            for future in futures.values():
+                future.set_result(None)
+        except Exception as error:
+            for memo, (_key, future) in requests:
+                if not future.done():
+                    self._memo.pop(memo, None)
+                    future.set_exception(error)
+
+
+def _write_tables(parameters):
+    """Return the names of the tables written to by the parameters of an
+    action, which is empty if they can not be determined.
+
+    :param dict parameters: The action parameters
+    :rtype: set
+
+    """
+    tables = set(parameters.get('RequestItems') or ())
+    if parameters.get('TableName'):
+        tables.add(parameters['TableName'])
+    for request in parameters.get('TransactItems') or ():
+        for value in request.values():
+            if isinstance(value, dict) and value.get('TableName'):
+                tables.add(value['TableName'])
+    return tables
@@ -0,0 +1,268 @@
+"""
+Multi-Process Scans
+===================
+
+A single process scanning a table is limited by the CPU time it takes to
+decode and unmarshall the responses long before it uses the read capacity
+of the table. :class:`ParallelScan` spreads the segments of a parallel scan
+over worker processes, each with its own IOLoop and
+:class:`~sprockets_dynamodb.client.Client`, so that a full table scan
+scales with the number of cores.
+
+Items can be streamed back to the parent process, where they are passed to
+a callback:
+
+.. code:: python
+
+    scan = ParallelScan('example', processes=4)
+    result = yield scan.run(item_callback=items.append)
+
+or processed in the workers, for example to write them to a file per
+worker, so that nothing is sent back to the parent:
+
+.. code:: python
+
+    result = yield scan.run_in_workers(functools.partial(write, path))
+
+Items are sent to the parent in batches encoded with :mod:`marshal`, which
+supports every type that :func:`~sprockets_dynamodb.utils.unmarshall`
+returns and is considerably cheaper to decode than JSON. The batches are
+received on a thread per worker, so that the IOLoop of the parent is not
+blocked while a large batch is read from the pipe.
+
+"""
+import asyncio
+import collections
+import logging
+import marshal
+import multiprocessing
+import os
+import time
+from concurrent import futures
+
+from tornado import gen, ioloop
+
+from sprockets_dynamodb import exceptions
+
+LOGGER = logging.getLogger(__name__)
+
+Result = collections.namedtuple(
+    'Result', ['items', 'pages', 'read_units', 'elapsed'])
+
+
+class ParallelScan(object):
+    """Scans a table with a segment per worker process, or more.
+
+    :param str table_name: The table to scan
+    :param int processes: The number of worker processes, defaulting to the
+        number of CPUs
+    :param int segments_per_process: The number of segments each worker
+        scans concurrently
+    :param dict client_kwargs: Keyword arguments for the
+        :class:`~sprockets_dynamodb.client.Client` of each worker
+    :param int batch_size: The maximum number of items in each batch sent
+        to the parent process
+    :param multiprocessing.context.BaseContext context: The multiprocessing
+        context used to start the workers. With the ``spawn`` and
+        ``forkserver`` start methods, callbacks run in the workers must be
+        importable.
+    :param scan_kwargs: Additional arguments for
+        :meth:`~sprockets_dynamodb.client.Client.scan`
+
+    """
+    def __init__(self, table_name, processes=None, segments_per_process=1,
+                 client_kwargs=None, batch_size=1000, context=None,
+                 **scan_kwargs):
+        self.table_name = table_name
+        self.processes = processes or os.cpu_count() or 1
+        self.segments = self.processes * segments_per_process
+        self.client_kwargs = client_kwargs or {}
+        self.batch_size = batch_size
+        self.context = context or multiprocessing.get_context()
+        self.scan_kwargs = scan_kwargs
+
+    def run(self, item_callback):
+        """Scan the table, passing each item to the callback in the parent
+        process as the batches are received from the workers.
+
+        :param callable item_callback: Invoked with each unmarshalled item
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._run(item_callback, None)
+
+    def run_in_workers(self, page_callback):
+        """Scan the table, invoking the callback in the worker processes
+        with the segment and items of each page.
+
+        :param callable page_callback: Invoked with the segment and the list
+            of unmarshalled items of each page
+        :rtype: tornado.concurrent.Future
+
+        """
+        return self._run(None, page_callback)
+
+    @gen.coroutine
+    def _run(self, item_callback, page_callback):
+        started = time.monotonic()
+        executor = futures.ThreadPoolExecutor(self.processes)
+        workers, totals, error = [], collections.Counter(), None
+        LOGGER.info('Scanning %s with %i processes', self.table_name,
+                    self.processes)
+        try:
+            for offset in range(self.processes):
+                workers.append(_Worker(self, offset, page_callback))
+            waiter = gen.WaitIterator(*[
+                _receive(worker, executor, item_callback)
+                for worker in workers])
+            while not waiter.done():
+                try:
+                    totals.update((yield waiter.next()))
+                except Exception as exc:
+                    if error is None:
+                        error = exc
+                        for worker in workers:
+                            worker.terminate()
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.close()
+            executor.shutdown(wait=False)
+        if error is not None:
+            raise error
+        raise gen.Return(Result(totals['items'], totals['pages'],
+                                totals['read_units'],
+                                time.monotonic() - started))
+
+
+@gen.coroutine
+def _receive(worker, executor, item_callback):
+    """Receive the messages of a worker on the executor until it has
+    finished, passing the items to the callback on the IOLoop.
+
+    :param _Worker worker: The worker
+    :param concurrent.futures.Executor executor: The executor to read the
+        pipe on
+    :param callable item_callback: Invoked with each unmarshalled item
+    :rtype: dict
+    :raises: sprockets_dynamodb.exceptions.DynamoDBException
+
+    """
+    io_loop = ioloop.IOLoop.current()
+    while True:
+        try:
+            message = yield io_loop.run_in_executor(executor, worker.receive)
+        except Exception as error:
+            LOGGER.debug('Worker %i failed: %r', worker.offset, error)
+            message = ('error', 'Worker {} exited unexpectedly'.format(
+                worker.offset))
+        if message[0] == 'items':
+            for item in message[1]:
+                item_callback(item)
+            continue
+        worker.finished = True
+        if message[0] == 'error':
+            raise exceptions.DynamoDBException(message[1])
+        raise gen.Return(message[1])
+
+
+class _Worker(object):
+    """The parent side of a worker process.
+
+    :param ParallelScan scan: The scan
+    :param int offset: The offset of the worker
+    :param callable page_callback: The callback run in the worker
+
+    """
+    def __init__(self, scan, offset, page_callback):
+        self.offset = offset
+        self.finished = False
+        self.connection, child = scan.context.Pipe(duplex=False)
+        self.process = scan.context.Process(
+            target=_worker_main, daemon=True,
+            args=(child, scan.table_name,
+                  list(range(offset, scan.segments, scan.processes)),
+                  scan.segments, scan.client_kwargs, scan.scan_kwargs,
+                  scan.batch_size, page_callback))
+        self.process.start()
+        child.close()
+
+    def receive(self):
+        return marshal.loads(self.connection.recv_bytes())
+
+    def close(self):
+        self.connection.close()
+        self.process.join()
+
+    def terminate(self):
+        """Stop the worker if it has not finished, which ends a receive in
+        progress once the pipe is closed by the exiting process.
+
+        """
+        if not self.finished:
+            self.process.terminate()
+
+
+def _worker_main(connection, table_name, segments, total_segments,
+                 client_kwargs, scan_kwargs, batch_size, page_callback):
+    """Run the scans for the segments of a worker on a new IOLoop.
+
+    :param multiprocessing.connection.Connection connection: The connection
+        to the parent process
+
+    """
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    try:
+        totals = ioloop.IOLoop.current().run_sync(
+            lambda: _scan_segments(connection, table_name, segments,
+                                   total_segments, client_kwargs,
+                                   scan_kwargs, batch_size, page_callback))
+    except Exception as error:
+        connection.send_bytes(marshal.dumps(
+            ('error', '{}: {}'.format(error.__class__.__name__, error))))
+    else:
+        connection.send_bytes(marshal.dumps(('done', dict(totals))))
+    finally:
+        connection.close()
+
+
+@gen.coroutine
+def _scan_segments(connection, table_name, segments, total_segments,
+                   client_kwargs, scan_kwargs, batch_size, page_callback):
+    from sprockets_dynamodb import client as dynamodb
+
+    client = dynamodb.Client(**client_kwargs)
+    totals = collections.Counter()
+
+    @gen.coroutine
+    def scan_segment(segment):
+        kwargs = dict(scan_kwargs, segment=segment,
+                      total_segments=total_segments,
+                      return_consumed_capacity='TOTAL')
+        while True:
+            items = []
+
+            def on_item(item):
+                items.append(item)
+                if page_callback is None and len(items) >= batch_size:
+                    connection.send_bytes(marshal.dumps(('items', items[:])))
+                    del items[:]
+
+            kwargs['item_callback'] = on_item
+            result = yield client.scan(table_name, **kwargs)
+            totals.update(items=result['Count'], pages=1)
+            totals['read_units'] += float(result.get(
+                'ConsumedCapacity', {}).get('CapacityUnits', 0))
+            if page_callback is not None:
+                page_callback(segment, items)
+            elif items:
+                connection.send_bytes(marshal.dumps(('items', items)))
+            if not result.get('LastEvaluatedKey'):
+                break
+            kwargs['exclusive_start_key'] = result['LastEvaluatedKey']
+
+    try:
+        yield [scan_segment(segment) for segment in segments]
+    finally:
+        client.close()
+    raise gen.Return(totals)
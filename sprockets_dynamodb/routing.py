@@ -0,0 +1,169 @@
+"""
+Endpoint Routing
+================
+
+Routes the requests of a :class:`~sprockets_dynamodb.client.Client` over
+several DynamoDB endpoints, such as the regions of a global table or a set
+of local replicas. Writes are pinned to the first endpoint. Reads are sent
+to the healthy endpoint with the lowest moving average latency, and are
+retried on another endpoint when an endpoint fails.
+
+.. code:: python
+
+    client = Client(endpoints=[
+        'https://dynamodb.us-east-1.amazonaws.com',
+        {'endpoint': 'https://dynamodb.us-west-2.amazonaws.com',
+         'region': 'us-west-2'}])
+
+The latency and error rate of each endpoint are tracked as exponentially
+weighted moving averages of the
+:class:`~sprockets_dynamodb.client.Measurement` of every attempt. An
+endpoint that returns ``ServiceUnavailable`` is not used for reads for
+:attr:`Router.cooldown` seconds, and one whose error rate exceeds
+:attr:`Router.error_threshold` is only used when no other endpoint is
+healthy. A small fraction of reads is sent to another endpoint so that the
+latency of every endpoint stays current. Probes include unhealthy endpoints
+that have not failed for :attr:`Router.cooldown` seconds, so that the error
+rate of an endpoint that recovers falls below the threshold again.
+
+"""
+import random
+import time
+
+FAILURES = {'InternalFailure', 'InternalServerError', 'RequestException',
+            'ServiceUnavailable', 'TimeoutException'}
+
+
+class Endpoint(object):
+    """The state of a single endpoint.
+
+    :param str name: The endpoint URL
+    :param client: The AWS client that sends requests to the endpoint
+    :type client: sprockets_dynamodb.transport.AsyncAWSClient
+
+    """
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.unavailable_until = 0.0
+        self.failed_at = None
+
+    def __repr__(self):
+        return '<Endpoint {} latency={} error_rate={:.2f}>'.format(
+            self.name, self.latency, self.error_rate)
+
+    def healthy(self, threshold, now):
+        """Return :data:`True` if the endpoint is not cooling down and its
+        error rate is below the threshold.
+
+        :param float threshold: The error rate threshold
+        :param float now: The current monotonic time
+        :rtype: bool
+
+        """
+        return self.unavailable_until <= now and self.error_rate < threshold
+
+    def probeable(self, threshold, cooldown, now):
+        """Return :data:`True` if the endpoint is healthy, or is unhealthy
+        but has not failed for ``cooldown`` seconds.
+
+        :param float threshold: The error rate threshold
+        :param float cooldown: Seconds since the last failure after which an
+            unhealthy endpoint is probed
+        :param float now: The current monotonic time
+        :rtype: bool
+
+        """
+        return self.healthy(threshold, now) or (
+            self.unavailable_until <= now and
+            (self.failed_at is None or self.failed_at + cooldown <= now))
+
+
+class Router(object):
+    """Selects the endpoint for each attempt of an action.
+
+    :param list endpoints: The :class:`Endpoint` of each endpoint, the first
+        of which receives all writes
+    :param float alpha: The weight of each measurement in the moving
+        averages
+    :param float error_threshold: The error rate at which an endpoint is
+        considered unhealthy
+    :param float cooldown: Seconds an endpoint is not used for reads after
+        returning ``ServiceUnavailable``
+    :param float probe_rate: The fraction of reads sent to another endpoint
+        than the fastest, including unhealthy endpoints that have not failed
+        for ``cooldown`` seconds
+    :param int seed: Seed for the random selection of probed endpoints
+
+    """
+    def __init__(self, endpoints, alpha=0.2, error_threshold=0.5,
+                 cooldown=30.0, probe_rate=0.05, seed=None):
+        if not endpoints:
+            raise ValueError('At least one endpoint is required')
+        self.endpoints = list(endpoints)
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.probe_rate = probe_rate
+        self._random = random.Random(seed)
+
+    @property
+    def primary(self):
+        """The endpoint writes are pinned to.
+
+        :rtype: Endpoint
+
+        """
+        return self.endpoints[0]
+
+    def select(self, read, exclude=()):
+        """Return the endpoint for an attempt.
+
+        :param bool read: The action only reads data
+        :param set exclude: Endpoints that failed earlier attempts of the
+            action
+        :rtype: Endpoint
+
+        """
+        if not read:
+            return self.primary
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints
+                      if endpoint not in exclude]
+        if not candidates:
+            return self.primary
+        probes = [endpoint for endpoint in candidates
+                  if endpoint.probeable(
+                      self.error_threshold, self.cooldown, now)]
+        if len(probes) > 1 and self._random.random() < self.probe_rate:
+            return self._random.choice(probes)
+        healthy = [endpoint for endpoint in candidates
+                   if endpoint.healthy(self.error_threshold, now)]
+        # Endpoints without a measured latency are tried first
+        return min(healthy or candidates,
+                   key=lambda endpoint: endpoint.latency or 0.0)
+
+    def record(self, endpoint, measurement):
+        """Update the moving averages of an endpoint with the measurement of
+        an attempt.
+
+        :param Endpoint endpoint: The endpoint of the attempt
+        :param measurement: The measurement of the attempt
+        :type measurement: sprockets_dynamodb.client.Measurement
+
+        """
+        failed = measurement.error in FAILURES
+        endpoint.requests += 1
+        endpoint.error_rate += self.alpha * (
+            (1.0 if failed else 0.0) - endpoint.error_rate)
+        if failed:
+            endpoint.failed_at = time.monotonic()
+        if measurement.error == 'ServiceUnavailable':
+            endpoint.unavailable_until = endpoint.failed_at + self.cooldown
+        if not failed:
+            endpoint.latency = measurement.duration \
+                if endpoint.latency is None else endpoint.latency + \
+                self.alpha * (measurement.duration - endpoint.latency)
@@ -0,0 +1,319 @@
+"""
+Table Schemas
+=============
+
+:func:`~sprockets_dynamodb.utils.marshall` and
+:func:`~sprockets_dynamodb.utils.unmarshall` determine the type of every
+attribute of every item they process. When the attributes of a table have
+stable types, a :class:`Schema` can be registered for the table with
+:meth:`~sprockets_dynamodb.client.Client.register_schema` so that items
+are transcoded with functions specialised for each attribute instead.
+
+.. code:: python
+
+    schema = Schema({'id': 'S', 'count': 'N', 'tags': 'SS',
+                     'address': {'street': 'S', 'zip': 'S'}})
+    client.register_schema('example', schema)
+
+Values that do not match the declared type, attributes that are not in the
+schema and empty values are transcoded with the generic functions, so the
+results are always the same as those of the :mod:`~sprockets_dynamodb.utils`
+functions.
+
+In the codec benchmarks the compiled functions are about 1.5 to 2 times as
+fast as the generic functions for items of scalar attributes, and only
+slightly faster for items whose cost is in transcoding the elements of
+nested lists, sets or binary values.
+
+Passing ``records=True`` makes the schema unmarshall items into
+:class:`Record` instances, which store the declared attributes in
+``__slots__`` instead of a per-item :class:`dict`. Records are read-only
+mappings that compare equal to the equivalent :class:`dict` and can be
+converted with :meth:`Record.as_dict` when a mutable copy is needed, at a
+fraction of the memory when large result sets are held in memory.
+
+.. code:: python
+
+    client.register_schema('example', Schema.infer(sample, records=True))
+    result = yield client.get_item('example', {'id': 'a'})
+    result['Item'].count, result['Item']['count']
+
+"""
+import base64
+import collections.abc
+import keyword
+
+from sprockets_dynamodb import utils
+
+TYPES = {'B', 'BOOL', 'BS', 'L', 'M', 'N', 'NS', 'NULL', 'S', 'SS'}
+
+
+class Schema(object):
+    """Marshalls and unmarshalls items using functions compiled from the
+    attribute types of a table.
+
+    :param dict attributes: A mapping of attribute names to DynamoDB type
+        codes (``S``, ``N``, ``B``, ``BOOL``, ``SS``, ``NS``, ``BS``, ``L``,
+        ``M`` or ``NULL``). The attributes of a map can be declared by
+        providing a nested mapping or :class:`Schema` instead of ``M``.
+    :param bool records: Unmarshall items into instances of
+        :attr:`record_class` instead of :class:`dict`. Maps within items are
+        unmarshalled as declared by their own schema.
+    :raises ValueError: if an unsupported type code is specified
+
+    """
+    def __init__(self, attributes, records=False):
+        self.attributes = {}
+        for name, kind in attributes.items():
+            if isinstance(kind, dict):
+                kind = Schema(kind)
+            elif not isinstance(kind, Schema) and kind not in TYPES:
+                raise ValueError('Unsupported type for {}: {!r}'.format(
+                    name, kind))
+            self.attributes[name] = kind
+        #: The :class:`Record` subclass items are unmarshalled into, or
+        #: :data:`None` if items are unmarshalled into :class:`dict`
+        self.record_class = _record_class(self.attributes) \
+            if records else None
+        # The compiled functions shadow the generic methods below
+        self.marshall = _compile_marshall(self.attributes)
+        self.unmarshall = _compile_unmarshall(self.attributes,
+                                              self.record_class)
+
+    def __reduce__(self):
+        # The compiled functions can not be pickled, they are compiled
+        # again when the schema is unpickled
+        return Schema, (self.attributes, self.record_class is not None)
+
+    def __repr__(self):
+        return '<Schema {!r}>'.format(self.attributes)
+
+    @classmethod
+    def infer(cls, *samples, records=False):
+        """Create a schema from the attribute types of one or more sample
+        items. Attributes that are empty or that have conflicting types in
+        the samples are left to the generic functions.
+
+        :param dict samples: The sample items
+        :param bool records: Unmarshall items into :class:`Record` instances
+        :rtype: Schema
+
+        """
+        types = {}
+        for sample in samples:
+            for name, value in sample.items():
+                if isinstance(value, dict):
+                    kind = cls.infer(value)
+                else:
+                    kind, = utils._marshall_value(value).keys()
+                if kind == 'NULL':
+                    continue
+                current = types.setdefault(name, kind)
+                if isinstance(current, Schema) and isinstance(kind, Schema):
+                    types[name] = cls(dict(current.attributes,
+                                           **kind.attributes))
+                elif current != kind and current is not None:
+                    types[name] = None
+        return cls({k: v for k, v in types.items() if v is not None},
+                   records)
+
+    def marshall(self, values):
+        """Marshall a :class:`dict` into AttributeValues.
+
+        :param dict values: The values to marshall
+        :rtype: dict
+        :raises ValueError: if an unsupported type is encountered
+
+        """
+        return utils.marshall(values)  # pragma: nocover
+
+    def unmarshall(self, values):
+        """Transform AttributeValues into a native :class:`dict`, or a
+        :class:`Record` if the schema was created with ``records=True``.
+
+        :param dict values: The AttributeValues to unmarshall
+        :rtype: dict or Record
+        :raises ValueError: if an unsupported type code is encountered
+
+        """
+        return utils.unmarshall(values)  # pragma: nocover
+
+
+class Record(collections.abc.Mapping):
+    """A read-only mapping of the attributes of an item, stored in the
+    ``__slots__`` of a subclass created for each :class:`Schema`.
+    Attributes that are not in the schema are kept in a :class:`dict` that
+    is only allocated when an item has them.
+
+    Declared attributes whose names are valid identifiers can also be read
+    as attributes of the record.
+
+    :param dict values: The attribute values
+
+    """
+    __slots__ = ('_extra',)
+
+    _fields = ()
+    _slots = {}
+
+    def __init__(self, values=None):
+        self._extra = None
+        for name, value in (values or {}).items():
+            slot = self._slots.get(name)
+            if slot is not None:
+                setattr(self, slot, value)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[name] = value
+
+    def __getitem__(self, key):
+        slot = self._slots.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __iter__(self):
+        for name, slot in self._fields:
+            if hasattr(self, slot):
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _name in self)
+
+    def __repr__(self):
+        return '<Record {!r}>'.format(self.as_dict())
+
+    def as_dict(self):
+        """Return the attributes of the record as a :class:`dict`.
+
+        :rtype: dict
+
+        """
+        return dict(self)
+
+
+_ENCODE = {
+    'S': ['if v.__class__ is str and v:',
+          '    {store} = {{"S": v}}'],
+    'N': ['if v.__class__ is int or v.__class__ is float:',
+          '    {store} = {{"N": str(v)}}'],
+    'BOOL': ['if v is True or v is False:',
+             '    {store} = {{"BOOL": v}}'],
+    'B': ['if v.__class__ is bytes and v:',
+          '    {store} = {{"B": b64encode(v).decode("ascii")}}'],
+    'SS': ['if v.__class__ is set and v and '
+           'all(i.__class__ is str for i in v):',
+           '    {store} = {{"SS": sorted(v)}}'],
+    'M': ['if v.__class__ is dict:',
+          '    {store} = {{"M": nested[{name}].marshall(v)}}']
+}
+
+_DECODE = {
+    'S': ['if "S" in v:', '    {store} = v["S"]'],
+    'N': ['if "N" in v:',
+          '    n = v["N"]',
+          '    {store} = float(n) if "." in n else int(n)'],
+    'BOOL': ['if "BOOL" in v:', '    {store} = v["BOOL"]'],
+    'SS': ['if "SS" in v:', '    {store} = set(v["SS"])'],
+    'M': ['if "M" in v:', '    {store} = nested[{name}].unmarshall(v["M"])']
+}
+
+
+def _compile(name, attributes, templates, generic, record=None):
+    """Generate a function that transcodes each attribute in the schema with
+    the template for its type, and every other attribute with the generic
+    function.
+
+    :param str name: The name of the generated function
+    :param dict attributes: The schema attributes
+    :param dict templates: The source templates by type code
+    :param callable generic: The generic function for a single value
+    :param type record: The :class:`Record` subclass to return instead of
+        a :class:`dict`
+    :rtype: callable
+
+    """
+    lines = ['def {}(values):'.format(name)]
+    if record is None:
+        lines.append('    r = {}')
+    else:
+        lines += ['    r = new(record)', '    r._extra = None',
+                  '    found = 0']
+    for attribute, kind in attributes.items():
+        literal = repr(attribute)
+        if record is None:
+            store = 'r[{}]'.format(literal)
+        else:
+            store = 'r.{}'.format(record._slots[attribute])
+        template = templates.get('M' if isinstance(kind, Schema) else kind)
+        lines += ['    v = values.get({}, missing)'.format(literal),
+                  '    if v is not missing:']
+        if record is not None:
+            lines.append('        found += 1')
+        if template:
+            lines += ['        ' + line.format(name=literal, store=store)
+                      for line in template]
+            lines += ['        else:',
+                      '            {} = generic(v)'.format(store)]
+        else:
+            lines.append('        {} = generic(v)'.format(store))
+    if record is None:
+        lines += ['    if len(r) != len(values):',
+                  '        for key in values:',
+                  '            if key not in r:',
+                  '                r[key] = generic(values[key])']
+    else:
+        lines += ['    if found != len(values):',
+                  '        r._extra = {key: generic(value)',
+                  '                    for key, value in values.items()',
+                  '                    if key not in record._slots}']
+    lines.append('    return r')
+    namespace = {'b64encode': base64.b64encode, 'generic': generic,
+                 'missing': object(), 'new': object.__new__,
+                 'record': record,
+                 'nested': {k: v for k, v in attributes.items()
+                            if isinstance(v, Schema)}}
+    exec(compile('\n'.join(lines), '<schema {}>'.format(name), 'exec'),
+         namespace)
+    return namespace[name]
+
+
+def _compile_marshall(attributes):
+    return _compile('marshall', attributes, _ENCODE, utils._marshall_value)
+
+
+def _compile_unmarshall(attributes, record=None):
+    return _compile('unmarshall', attributes, _DECODE,
+                    utils._unmarshall_dict, record)
+
+
+def _record_class(attributes):
+    """Create a :class:`Record` subclass with a slot for each attribute.
+    Attributes that are valid identifiers are stored in a slot of the same
+    name so they can be read as attributes of the record, every other
+    attribute is stored in a positional slot.
+
+    :param dict attributes: The schema attributes
+    :rtype: type
+
+    """
+    reserved = set(dir(Record))
+    slots = {}
+    for offset, name in enumerate(attributes):
+        if (name.isidentifier() and not keyword.iskeyword(name) and
+                not name.startswith('_') and name not in reserved):
+            slots[name] = name
+        else:
+            slots[name] = '_{}'.format(offset)
+    return type('Record', (Record,), {
+        '__slots__': tuple(slots.values()),
+        '_fields': tuple(slots.items()),
+        '_slots': slots})
@@ -0,0 +1,256 @@
+"""
+Write Sharding
+==============
+
+A single partition key value is limited to the throughput of one
+partition. A :class:`ShardedTable` spreads the items of each logical
+partition key value over a number of shards by suffixing the stored value
+with a shard number, and fans reads out across every shard concurrently:
+
+.. code:: python
+
+    events = ShardedTable(client, 'events', 'id', shards=8, shard_by='ts')
+    yield events.put_item({'id': 'popular', 'ts': 1500000000, 'n': 1})
+    result = yield events.query('popular', '#ts > :ts',
+                                expression_attribute_names={'#ts': 'ts'},
+                                expression_attribute_values={':ts': 0})
+
+The partition key ``popular`` is stored as ``popular#0`` through
+``popular#7``. Items are written to a random shard, or to the shard chosen
+by hashing the ``shard_by`` attribute, which lets :meth:`get_item`,
+:meth:`update_item` and :meth:`delete_item` address a single shard when
+the attribute is part of the key. Otherwise every shard is read, or
+written, for them.
+
+Items are returned with the logical partition key value. The results of a
+:meth:`~ShardedTable.query` are merged in range key order.
+
+The partition key must be a string attribute and the shard count of a
+table can not be changed without moving its items.
+
+"""
+import heapq
+import random
+import zlib
+
+from tornado import gen
+
+from sprockets_dynamodb import cache, utils
+
+
+class ShardedTable(object):
+    """Reads and writes the items of a table with a sharded partition key.
+
+    :param sprockets_dynamodb.client.Client client: The client
+    :param str table_name: The table name
+    :param str partition_key: The name of the partition key attribute
+    :param int shards: The number of shards of each partition key value
+    :param str range_key: The name of the range key attribute, used to
+        merge query results in order
+    :param str shard_by: The attribute whose value is hashed to choose the
+        shard of an item, defaulting to a random shard
+    :param str separator: The separator of the value and shard number
+    :raises ValueError: if the shard count is less than one
+
+    """
+    def __init__(self, client, table_name, partition_key, shards,
+                 range_key=None, shard_by=None, separator='#'):
+        if shards < 1:
+            raise ValueError('shards must be at least one')
+        self.client = client
+        self.table_name = table_name
+        self.partition_key = partition_key
+        self.shards = shards
+        self.range_key = range_key
+        self.shard_by = shard_by
+        self.separator = separator
+        self._random = random.Random()
+
+    def shard_values(self, value):
+        """Return the stored partition key value of every shard of a
+        logical value.
+
+        :param str value: The logical partition key value
+        :rtype: list(str)
+
+        """
+        return ['{}{}{}'.format(value, self.separator, shard)
+                for shard in range(self.shards)]
+
+    def shard_of(self, values):
+        """Return the shard of an item or key, or :data:`None` if it can
+        not be determined because ``shard_by`` is not set or not present.
+
+        :param dict values: The item or key
+        :rtype: int
+
+        """
+        if self.shard_by is None or self.shard_by not in values:
+            return None
+        return zlib.crc32(cache.key_fingerprint(utils.marshall(
+            {self.shard_by: values[self.shard_by]}))) % self.shards
+
+    def put_item(self, item, **kwargs):
+        """Put an item into its shard. See
+        :meth:`~sprockets_dynamodb.client.Client.put_item`.
+
+        :param dict item: The item, with the logical partition key value
+        :rtype: tornado.concurrent.Future
+
+        """
+        shard = self.shard_of(item)
+        if shard is None:
+            shard = self._random.randrange(self.shards)
+        return self.client.put_item(
+            self.table_name, self._sharded(item, shard), **kwargs)
+
+    @gen.coroutine
+    def get_item(self, key_dict, **kwargs):
+        """Get an item from its shard, or from every shard when its shard
+        can not be determined from the key. See
+        :meth:`~sprockets_dynamodb.client.Client.get_item`.
+
+        :param dict key_dict: The key, with the logical partition key value
+        :rtype: dict
+
+        """
+        results = yield [self.client.get_item(self.table_name, key, **kwargs)
+                         for key in self._keys(key_dict)]
+        found = None
+        for result in results:
+            if result and result.get('Item'):
+                found = dict(result, Item=self._logical(result['Item']))
+                break
+        if found is None and results:
+            found = results[0]
+        raise gen.Return(found)
+
+    @gen.coroutine
+    def update_item(self, key_dict, **kwargs):
+        """Update an item in its shard. See
+        :meth:`~sprockets_dynamodb.client.Client.update_item`.
+
+        :param dict key_dict: The key, with the logical partition key value
+        :rtype: dict
+        :raises ValueError: if the shard of the item can not be determined
+            from the key
+
+        """
+        shard = self.shard_of(key_dict)
+        if shard is None:
+            raise ValueError('The shard of an item must be determined by '
+                             'its key to update it')
+        result = yield self.client.update_item(
+            self.table_name, self._sharded(key_dict, shard), **kwargs)
+        if result and result.get('Attributes') and \
+                self.partition_key in result['Attributes']:
+            result['Attributes'] = self._logical(result['Attributes'])
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def delete_item(self, key_dict, **kwargs):
+        """Delete an item from its shard, or from every shard when its shard
+        can not be determined from the key. See
+        :meth:`~sprockets_dynamodb.client.Client.delete_item`.
+
+        :param dict key_dict: The key, with the logical partition key value
+
+        """
+        yield [self.client.delete_item(self.table_name, key, **kwargs)
+               for key in self._keys(key_dict)]
+
+    @gen.coroutine
+    def query(self, value, range_condition=None,
+              expression_attribute_names=None,
+              expression_attribute_values=None, scan_index_forward=True,
+              limit=None, sort=True, **kwargs):
+        """Query every shard of a logical partition key value concurrently,
+        reading every page, and merge the items.
+
+        :param str value: The logical partition key value
+        :param str range_condition: The range key condition, such as
+            ``#ts > :ts``
+        :param dict expression_attribute_names: The attribute names of the
+            condition and other expressions
+        :param dict expression_attribute_values: The attribute values of the
+            condition and other expressions
+        :param bool scan_index_forward: Merge the items in ascending range
+            key order
+        :param int limit: Return at most this many items
+        :param bool sort: Merge the items in range key order, which requires
+            ``range_key``; otherwise the items of each shard are returned in
+            shard order
+        :param kwargs: Other arguments for
+            :meth:`~sprockets_dynamodb.client.Client.query`
+        :rtype: dict
+
+        The result has the ``Count`` and ``Items`` of the merged items and
+        the total ``ScannedCount`` of the shards.
+
+        """
+        names = dict(expression_attribute_names or {})
+        names['#shard_pk'] = self.partition_key
+        condition = '#shard_pk = :shard_pk'
+        if range_condition:
+            condition += ' AND ' + range_condition
+        pages = yield [self._query_shard(
+            shard, condition, names, expression_attribute_values,
+            scan_index_forward, limit, kwargs)
+            for shard in self.shard_values(value)]
+        scanned = sum(count for _items, count in pages)
+        shards = [[self._logical(item) for item in items]
+                  for items, _count in pages]
+        if sort and self.range_key:
+            items = list(heapq.merge(
+                *shards, key=lambda item: item[self.range_key],
+                reverse=not scan_index_forward))
+        else:
+            items = [item for shard in shards for item in shard]
+        if limit is not None:
+            items = items[:limit]
+        raise gen.Return({'Count': len(items), 'Items': items,
+                          'ScannedCount': scanned})
+
+    @gen.coroutine
+    def _query_shard(self, shard_value, condition, names, values,
+                     scan_index_forward, limit, kwargs):
+        """Read every page of a shard, stopping once ``limit`` items have
+        been read.
+
+        :rtype: (list, int)
+
+        """
+        values = dict(values or {})
+        values[':shard_pk'] = shard_value
+        items, scanned, start = [], 0, None
+        while True:
+            result = yield self.client.query(
+                self.table_name, key_condition_expression=condition,
+                expression_attribute_names=names,
+                expression_attribute_values=values,
+                scan_index_forward=scan_index_forward,
+                exclusive_start_key=start, limit=limit, **kwargs)
+            items.extend(result['Items'])
+            scanned += result['ScannedCount']
+            start = result.get('LastEvaluatedKey')
+            if not start or (limit is not None and len(items) >= limit):
+                break
+        raise gen.Return((items, scanned))
+
+    def _keys(self, key_dict):
+        """Return the key of the shard of an item, or of every shard."""
+        shard = self.shard_of(key_dict)
+        shards = range(self.shards) if shard is None else [shard]
+        return [self._sharded(key_dict, shard) for shard in shards]
+
+    def _sharded(self, values, shard):
+        values = dict(values)
+        values[self.partition_key] = '{}{}{}'.format(
+            values[self.partition_key], self.separator, shard)
+        return values
+
+    def _logical(self, item):
+        item = dict(item)
+        item[self.partition_key] = item[self.partition_key].rsplit(
+            self.separator, 1)[0]
+        return item
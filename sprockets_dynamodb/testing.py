@@ -0,0 +1,1088 @@
+"""
+Testing Support
+===============
+
+An in-process stand-in for DynamoDB that implements enough of the JSON
+protocol to exercise the :class:`~sprockets_dynamodb.client.Client`
+without the ``dynamodb-local`` container. Items are kept in memory and the
+server can inject latency, throttling, server errors and unprocessed batch
+items so that retry, batching and connection pooling behaviour can be load
+tested offline.
+
+.. code:: python
+
+    server = testing.StubServer(latency=0.002, throttle_rate=0.01)
+    client = sprockets_dynamodb.Client(endpoint=server.start())
+
+The following actions are supported: ``CreateTable``, ``DeleteTable``,
+``DescribeTable``, ``ListTables``, ``GetItem``, ``PutItem``,
+``UpdateItem``, ``DeleteItem``, ``Query``, ``Scan``, ``BatchGetItem`` and
+``BatchWriteItem``.  Condition, filter, key condition, projection and
+update expressions are supported with the exception of nested attribute
+paths in projection expressions, which project the whole top level
+attribute.
+
+"""
+import base64
+import collections
+import copy
+import decimal
+import json
+import logging
+import math
+import random
+import re
+import time
+import zlib
+
+from tornado import gen, httpserver, netutil, web
+
+from sprockets_dynamodb import utils
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/x-amz-json-1.0'
+ERROR_PREFIX = 'com.amazonaws.dynamodb.v20120810#'
+MAX_PAGE_SIZE = 1048576
+
+_TOKENS = re.compile(r"""
+    \s*(?:
+        (?P<comparator><>|<=|>=|=|<|>) |
+        (?P<punctuation>[(),+\-]) |
+        (?P<value>:\w+) |
+        (?P<path>\#?\w+(?:\[\d+\])*(?:\.\#?\w+(?:\[\d+\])*)*)
+    )""", re.VERBOSE)
+_SEGMENT = re.compile(r'(\#?\w+)|\[(\d+)\]')
+_KEYWORDS = {'AND', 'BETWEEN', 'IN', 'NOT', 'OR'}
+_CLAUSES = {'ADD', 'DELETE', 'REMOVE', 'SET'}
+
+
+class ResponseError(Exception):
+    """Raised while processing a request to return an error response.
+
+    :param str error_type: The DynamoDB exception name
+    :param str message: The error message
+    :param int status_code: The HTTP status code of the response
+
+    """
+    def __init__(self, error_type, message='', status_code=400):
+        super(ResponseError, self).__init__(error_type, message)
+        self.error_type = error_type
+        self.message = message
+        self.status_code = status_code
+
+
+def _validation(message, *args):
+    return ResponseError('ValidationException', message % args)
+
+
+def _comparable(value):
+    """Return a hashable value for an AttributeValue that compares equal to
+    equivalent values and orders correctly within scalar types.
+
+    :param dict value: The AttributeValue
+    :rtype: tuple
+
+    """
+    (kind, raw), = value.items()
+    if kind == 'N':
+        return kind, decimal.Decimal(raw)
+    elif kind == 'B':
+        return kind, base64.b64decode(raw)
+    elif kind == 'SS':
+        return kind, frozenset(raw)
+    elif kind == 'NS':
+        return kind, frozenset(decimal.Decimal(v) for v in raw)
+    elif kind == 'BS':
+        return kind, frozenset(base64.b64decode(v) for v in raw)
+    elif kind == 'L':
+        return kind, tuple(_comparable(v) for v in raw)
+    elif kind == 'M':
+        return kind, frozenset((k, _comparable(v)) for k, v in raw.items())
+    return kind, raw
+
+
+def _number(value):
+    """Format a :class:`~decimal.Decimal` as a DynamoDB number string.
+
+    :param decimal.Decimal value: The value to format
+    :rtype: str
+
+    """
+    return format(value, 'f')
+
+
+def _item_size(item):
+    """Return the size of an item for page limits and capacity.
+
+    :param dict item: The item as AttributeValues
+    :rtype: int
+
+    """
+    return utils.item_size(item, marshalled=True)
+
+
+class _Parser(object):
+    """Parses condition, key condition, filter, projection and update
+    expressions into a nested tuple syntax tree, resolving attribute name
+    and value placeholders as it goes.
+
+    """
+    def __init__(self, expression, names, values):
+        self.names = names or {}
+        self.values = values or {}
+        self.tokens = []
+        position, expression = 0, expression.strip()
+        while position < len(expression):
+            match = _TOKENS.match(expression, position)
+            if not match or match.end() == position:
+                raise _validation('Invalid expression: Syntax error at %r',
+                                  expression[position:])
+            kind = match.lastgroup
+            text = match.group(kind)
+            if kind == 'path' and text.upper() in _KEYWORDS | _CLAUSES:
+                kind, text = 'keyword', text.upper()
+            self.tokens.append((kind, text))
+            position = match.end()
+        self.offset = 0
+
+    def condition(self):
+        node = self.condition_or()
+        self.finish()
+        return node
+
+    def projection(self):
+        paths = [self.path()]
+        while self.accept('punctuation', ','):
+            paths.append(self.path())
+        self.finish()
+        return paths
+
+    def update(self):
+        clauses = []
+        while self.peek()[0] == 'keyword':
+            clause = self.next()[1]
+            if clause not in _CLAUSES:
+                raise _validation('Invalid UpdateExpression: %s', clause)
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.expect('comparator', '=')
+                    clauses.append((clause, path, self.set_value()))
+                elif clause == 'REMOVE':
+                    clauses.append((clause, path, None))
+                else:
+                    clauses.append((clause, path, self.operand()))
+                if not self.accept('punctuation', ','):
+                    break
+        self.finish()
+        if not clauses:
+            raise _validation('Invalid UpdateExpression: empty expression')
+        return clauses
+
+    def accept(self, kind, text=None):
+        token = self.peek()
+        if token[0] == kind and (text is None or token[1] == text):
+            self.offset += 1
+            return token
+        return None
+
+    def expect(self, kind, text=None):
+        token = self.accept(kind, text)
+        if not token:
+            raise _validation('Invalid expression: expected %s, found %r',
+                              text or kind, self.peek()[1])
+        return token
+
+    def finish(self):
+        if self.offset < len(self.tokens):
+            raise _validation('Invalid expression: unexpected token %r',
+                              self.peek()[1])
+
+    def next(self):
+        token = self.peek()
+        self.offset += 1
+        return token
+
+    def peek(self, offset=0):
+        if self.offset + offset < len(self.tokens):
+            return self.tokens[self.offset + offset]
+        return None, None
+
+    def condition_or(self):
+        node = self.condition_and()
+        while self.accept('keyword', 'OR'):
+            node = ('or', node, self.condition_and())
+        return node
+
+    def condition_and(self):
+        node = self.condition_not()
+        while self.accept('keyword', 'AND'):
+            node = ('and', node, self.condition_not())
+        return node
+
+    def condition_not(self):
+        if self.accept('keyword', 'NOT'):
+            return 'not', self.condition_not()
+        return self.condition_primary()
+
+    def condition_primary(self):
+        if self.accept('punctuation', '('):
+            node = self.condition_or()
+            self.expect('punctuation', ')')
+            return node
+        if self.peek()[0] == 'path' and self.peek(1) == ('punctuation', '('):
+            name = self.peek()[1]
+            if name != 'size':
+                self.offset += 1
+                return 'function', name, self.arguments()
+        operand = self.operand()
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.operand()
+            self.expect('keyword', 'AND')
+            return 'between', operand, low, self.operand()
+        elif self.accept('keyword', 'IN'):
+            return 'in', operand, self.arguments()
+        return 'compare', self.expect('comparator')[1], operand, \
+            self.operand()
+
+    def arguments(self):
+        self.expect('punctuation', '(')
+        arguments = [self.operand()]
+        while self.accept('punctuation', ','):
+            arguments.append(self.operand())
+        self.expect('punctuation', ')')
+        return arguments
+
+    def operand(self):
+        token = self.peek()
+        if token[0] == 'value':
+            self.offset += 1
+            if token[1] not in self.values:
+                raise _validation('An expression attribute value used in '
+                                  'expression is not defined: %s', token[1])
+            return 'value', self.values[token[1]]
+        elif token[0] == 'path' and self.peek(1) == ('punctuation', '('):
+            self.offset += 1
+            return 'function', token[1], self.arguments()
+        return 'path', self.path()
+
+    def set_value(self):
+        node = self.operand()
+        token = self.accept('punctuation', '+') or \
+            self.accept('punctuation', '-')
+        if token:
+            node = ('arithmetic', token[1], node, self.operand())
+        return node
+
+    def path(self):
+        kind, text = self.expect('path')
+        segments = []
+        for name, index in _SEGMENT.findall(text):
+            if index:
+                segments.append(int(index))
+            elif name.startswith('#'):
+                if name not in self.names:
+                    raise _validation('An expression attribute name used in '
+                                      'the document path is not defined: %s',
+                                      name)
+                segments.append(self.names[name])
+            else:
+                segments.append(name)
+        return segments
+
+
+def _resolve(item, path):
+    """Return the AttributeValue at ``path`` in the item or :data:`None`.
+
+    :param dict item: The item as AttributeValues
+    :param list path: The document path segments
+    :rtype: dict or None
+
+    """
+    value = {'M': item}
+    for segment in path:
+        if isinstance(segment, int):
+            values = value.get('L')
+            if values is None or segment >= len(values):
+                return None
+        else:
+            values = value.get('M')
+            if values is None or segment not in values:
+                return None
+        value = values[segment]
+    return value
+
+
+def _operand(node, item):
+    """Evaluate an operand node against an item.
+
+    :param tuple node: The operand node
+    :param dict item: The item as AttributeValues
+    :rtype: dict or None
+
+    """
+    if node[0] == 'value':
+        return node[1]
+    elif node[0] == 'path':
+        return _resolve(item, node[1])
+    elif node[0] == 'function' and node[1] == 'size':
+        value = _operand(node[2][0], item)
+        if value is None:
+            return None
+        (kind, raw), = value.items()
+        if kind == 'B':
+            return {'N': str(len(base64.b64decode(raw)))}
+        return {'N': str(len(raw))}
+    elif node[0] == 'function' and node[1] == 'if_not_exists':
+        value = _operand(node[2][0], item)
+        return value if value is not None else _operand(node[2][1], item)
+    elif node[0] == 'function' and node[1] == 'list_append':
+        first, second = (_operand(arg, item) for arg in node[2])
+        if not first or not second or 'L' not in first or 'L' not in second:
+            raise _validation('An operand in the update expression has an '
+                              'incorrect data type')
+        return {'L': first['L'] + second['L']}
+    elif node[0] == 'arithmetic':
+        left, right = _operand(node[2], item), _operand(node[3], item)
+        if not left or not right or 'N' not in left or 'N' not in right:
+            raise _validation('An operand in the update expression has an '
+                              'incorrect data type')
+        left, right = decimal.Decimal(left['N']), decimal.Decimal(right['N'])
+        return {'N': _number(left + right if node[1] == '+'
+                             else left - right)}
+    raise _validation('Invalid function name: %s', node[1])
+
+
+def _compare(operator, left, right):
+    if left is None or right is None:
+        return operator == '<>' and (left is None) != (right is None)
+    left, right = _comparable(left), _comparable(right)
+    if operator == '=':
+        return left == right
+    elif operator == '<>':
+        return left != right
+    elif left[0] != right[0] or left[0] not in {'N', 'S', 'B'}:
+        return False
+    elif operator == '<':
+        return left[1] < right[1]
+    elif operator == '<=':
+        return left[1] <= right[1]
+    elif operator == '>':
+        return left[1] > right[1]
+    return left[1] >= right[1]
+
+
+def _function(name, arguments, item):
+    """Evaluate a condition function.
+
+    :param str name: The function name
+    :param list arguments: The argument operand nodes
+    :param dict item: The item as AttributeValues
+    :rtype: bool
+
+    """
+    value = _operand(arguments[0], item)
+    if name == 'attribute_exists':
+        return value is not None
+    elif name == 'attribute_not_exists':
+        return value is None
+    elif value is None:
+        return False
+    argument = _operand(arguments[1], item)
+    kind, raw = _comparable(value)
+    if name == 'attribute_type':
+        return kind == argument.get('S')
+    elif name == 'begins_with':
+        other = _comparable(argument)
+        return kind in {'S', 'B'} and kind == other[0] and \
+            raw.startswith(other[1])
+    elif name == 'contains':
+        other = _comparable(argument)
+        if kind in {'S', 'B'}:
+            return kind == other[0] and other[1] in raw
+        elif kind in {'SS', 'NS', 'BS'}:
+            return other[1] in raw
+        elif kind == 'L':
+            return other in raw
+        return False
+    raise _validation('Invalid function name; function: %s', name)
+
+
+def _evaluate(node, item):
+    """Evaluate a condition syntax tree against an item.
+
+    :param tuple node: The condition node
+    :param dict item: The item as AttributeValues
+    :rtype: bool
+
+    """
+    kind = node[0]
+    if kind == 'and':
+        return _evaluate(node[1], item) and _evaluate(node[2], item)
+    elif kind == 'or':
+        return _evaluate(node[1], item) or _evaluate(node[2], item)
+    elif kind == 'not':
+        return not _evaluate(node[1], item)
+    elif kind == 'compare':
+        return _compare(node[1], _operand(node[2], item),
+                        _operand(node[3], item))
+    elif kind == 'between':
+        value = _operand(node[1], item)
+        return _compare('>=', value, _operand(node[2], item)) and \
+            _compare('<=', value, _operand(node[3], item))
+    elif kind == 'in':
+        value = _operand(node[1], item)
+        return any(_compare('=', value, _operand(option, item))
+                   for option in node[2])
+    return _function(node[1], node[2], item)
+
+
+def _assign(item, path, value):
+    """Set the value at ``path`` in the item, appending to a list when the
+    index is past the end of it.
+
+    """
+    parent = _resolve(item, path[:-1]) if len(path) > 1 else {'M': item}
+    segment = path[-1]
+    if isinstance(segment, int) and parent and 'L' in parent:
+        if segment >= len(parent['L']):
+            parent['L'].append(value)
+        else:
+            parent['L'][segment] = value
+    elif not isinstance(segment, int) and parent and 'M' in parent:
+        parent['M'][segment] = value
+    else:
+        raise _validation('The document path provided in the update '
+                          'expression is invalid for update')
+
+
+def _remove(item, path):
+    parent = _resolve(item, path[:-1]) if len(path) > 1 else {'M': item}
+    segment = path[-1]
+    if isinstance(segment, int) and parent and 'L' in parent:
+        if segment < len(parent['L']):
+            del parent['L'][segment]
+    elif parent and 'M' in parent:
+        parent['M'].pop(segment, None)
+
+
+def _apply_update(item, clauses):
+    """Apply parsed update clauses to the item in place. All values are
+    evaluated against the item as it was before the update.
+
+    :param dict item: The item as AttributeValues
+    :param list clauses: The parsed update expression
+    :raises: ResponseError
+
+    """
+    original = copy.deepcopy(item)
+    changes = []
+    for clause, path, node in clauses:
+        value = _operand(node, original) if node else None
+        if clause in {'ADD', 'DELETE'}:
+            current = _resolve(original, path)
+            value = _add_or_delete(clause, current, value)
+        changes.append((path, value))
+    for path, value in changes:
+        if value is None:
+            _remove(item, path)
+        else:
+            _assign(item, path, value)
+
+
+def _add_or_delete(clause, current, value):
+    """Return the result of an ``ADD`` or ``DELETE`` update action, or
+    :data:`None` if the attribute should be removed.
+
+    """
+    (kind, raw), = value.items()
+    if current is not None and kind not in current:
+        raise _validation('An operand in the update expression has an '
+                          'incorrect data type')
+    if clause == 'ADD' and kind == 'N':
+        total = decimal.Decimal(raw)
+        if current is not None:
+            total += decimal.Decimal(current['N'])
+        return {'N': _number(total)}
+    elif kind not in {'SS', 'NS', 'BS'}:
+        raise _validation('Incorrect operand type for operator or function;'
+                          ' operator: %s, operand type: %s', clause, kind)
+    existing = list(current[kind]) if current is not None else []
+    if clause == 'ADD':
+        return {kind: existing + [v for v in raw if v not in existing]}
+    remaining = [v for v in existing if v not in raw]
+    return {kind: remaining} if remaining else None
+
+
+def _project(item, paths):
+    if not paths:
+        return item
+    names = {path[0] for path in paths}
+    return {k: v for k, v in item.items() if k in names}
+
+
+class Table(object):
+    """An in-memory DynamoDB table.
+
+    :param dict definition: The ``CreateTable`` request payload
+
+    """
+    def __init__(self, definition):
+        self.name = definition['TableName']
+        self.definition = definition
+        self.created_at = time.time()
+        self.key = [k['AttributeName'] for k in sorted(
+            definition['KeySchema'], key=lambda k: k['KeyType'])]
+        self.indexes = {}
+        for index in (definition.get('GlobalSecondaryIndexes', []) +
+                      definition.get('LocalSecondaryIndexes', [])):
+            self.indexes[index['IndexName']] = [
+                k['AttributeName'] for k in sorted(
+                    index['KeySchema'], key=lambda k: k['KeyType'])]
+        self.items = {}
+        self._partitions = collections.defaultdict(dict)
+        self._order = None
+
+    def describe(self):
+        description = dict(self.definition)
+        description.update({
+            'CreationDateTime': self.created_at,
+            'ItemCount': len(self.items),
+            'TableSizeBytes': sum(_item_size(i) for i in self.items.values()),
+            'TableStatus': 'ACTIVE'})
+        for key in ['GlobalSecondaryIndexes', 'LocalSecondaryIndexes']:
+            if key in description:
+                description[key] = [dict(index, IndexStatus='ACTIVE')
+                                    for index in description[key]]
+        return description
+
+    def key_of(self, item, attributes=None):
+        """Return the hashable key for an item or key AttributeValues.
+
+        :param dict item: The item or key as AttributeValues
+        :param list attributes: The key attributes, defaulting to the table
+        :rtype: tuple
+        :raises: ResponseError
+
+        """
+        try:
+            return tuple(_comparable(item[name])
+                         for name in attributes or self.key)
+        except KeyError:
+            raise _validation('The provided key element does not match the '
+                              'schema')
+
+    def get(self, key):
+        if len(key) != len(self.key):
+            raise _validation('The provided key element does not match the '
+                              'schema')
+        return self.items.get(self.key_of(key))
+
+    def put(self, item):
+        if _item_size(item) > utils.MAX_ITEM_SIZE:
+            raise _validation('Item size has exceeded the maximum allowed '
+                              'size')
+        key = self.key_of(item)
+        self.items[key] = item
+        self._partitions[key[0]][key] = item
+        self._order = None
+
+    def delete(self, key):
+        key = self.key_of(key)
+        item = self.items.pop(key, None)
+        if item is not None:
+            del self._partitions[key[0]][key]
+            if not self._partitions[key[0]]:
+                del self._partitions[key[0]]
+            self._order = None
+        return item
+
+    def ordered(self):
+        """Return the table items in a stable order for paging scans."""
+        if self._order is None:
+            self._order = sorted(self.items.items(), key=lambda i: i[0])
+        return self._order
+
+    def partition(self, value):
+        return self._partitions.get(_comparable(value), {}).values()
+
+
+class Store(object):
+    """The in-memory DynamoDB data store that implements the actions."""
+
+    def __init__(self):
+        self.tables = collections.OrderedDict()
+
+    def dispatch(self, action, payload):
+        """Perform the action, returning the response payload.
+
+        :param str action: The DynamoDB action name
+        :param dict payload: The request payload
+        :rtype: dict
+        :raises: ResponseError
+
+        """
+        method = getattr(self, '_'.join(
+            re.findall('[A-Z][a-z]*', action)).lower(), None)
+        if not action or method is None:
+            raise ResponseError('UnknownOperationException',
+                                'Unsupported action: {}'.format(action))
+        return method(payload)
+
+    def table(self, name):
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise ResponseError('ResourceNotFoundException',
+                                'Requested resource not found')
+
+    def create_table(self, payload):
+        if not payload.get('KeySchema'):
+            raise _validation('KeySchema must be provided')
+        if payload['TableName'] in self.tables:
+            raise ResponseError('ResourceInUseException',
+                                'Table already exists: {}'.format(
+                                    payload['TableName']))
+        self.tables[payload['TableName']] = Table(payload)
+        return {'TableDescription': self.tables[
+            payload['TableName']].describe()}
+
+    def delete_table(self, payload):
+        table = self.table(payload['TableName'])
+        del self.tables[table.name]
+        return {'TableDescription': dict(table.describe(),
+                                         TableStatus='DELETING')}
+
+    def describe_table(self, payload):
+        return {'Table': self.table(payload['TableName']).describe()}
+
+    def list_tables(self, payload):
+        names = list(self.tables.keys())
+        if payload.get('ExclusiveStartTableName') in names:
+            names = names[names.index(
+                payload['ExclusiveStartTableName']) + 1:]
+        limit = payload.get('Limit', 100)
+        response = {'TableNames': names[:limit]}
+        if len(names) > limit:
+            response['LastEvaluatedTableName'] = names[limit - 1]
+        return response
+
+    def get_item(self, payload):
+        table = self.table(payload['TableName'])
+        item = table.get(payload['Key'])
+        response = {}
+        if item is not None:
+            response['Item'] = _project(item, self._projection(payload))
+        return self._with_capacity(
+            response, payload, table, item, True,
+            payload.get('ConsistentRead'))
+
+    def put_item(self, payload):
+        table = self.table(payload['TableName'])
+        old = table.items.get(table.key_of(payload['Item']))
+        self._check_condition(payload, old)
+        table.put(payload['Item'])
+        response = {}
+        if payload.get('ReturnValues') == 'ALL_OLD' and old is not None:
+            response['Attributes'] = old
+        return self._with_capacity(response, payload, table,
+                                   payload['Item'], False)
+
+    def update_item(self, payload):
+        table = self.table(payload['TableName'])
+        old = table.get(payload['Key'])
+        self._check_condition(payload, old)
+        item = copy.deepcopy(old) if old is not None else \
+            dict(payload['Key'])
+        if payload.get('UpdateExpression'):
+            _apply_update(item, _Parser(
+                payload['UpdateExpression'],
+                payload.get('ExpressionAttributeNames'),
+                payload.get('ExpressionAttributeValues')).update())
+        if table.key_of(item) != table.key_of(payload['Key']):
+            raise _validation('Cannot update attribute in the key')
+        table.put(item)
+        response = {}
+        values = self._return_values(payload.get('ReturnValues'), old, item)
+        if values:
+            response['Attributes'] = values
+        return self._with_capacity(response, payload, table, item, False)
+
+    def delete_item(self, payload):
+        table = self.table(payload['TableName'])
+        old = table.get(payload['Key'])
+        self._check_condition(payload, old)
+        table.delete(payload['Key'])
+        response = {}
+        if payload.get('ReturnValues') == 'ALL_OLD' and old is not None:
+            response['Attributes'] = old
+        return self._with_capacity(response, payload, table, old, False)
+
+    def query(self, payload):
+        table = self.table(payload['TableName'])
+        key = table.key
+        if payload.get('IndexName'):
+            if payload['IndexName'] not in table.indexes:
+                raise _validation('The table does not have the specified '
+                                  'index: %s', payload['IndexName'])
+            key = table.indexes[payload['IndexName']]
+        if not payload.get('KeyConditionExpression'):
+            raise _validation('Either the KeyConditions or '
+                              'KeyConditionExpression parameter must be '
+                              'specified in the request.')
+        condition = self._parse_condition(
+            payload, payload['KeyConditionExpression'])
+        partition = self._partition_value(condition, key[0])
+        if partition is None:
+            raise _validation('Query condition missed key schema element: '
+                              '%s', key[0])
+        if key is table.key:
+            candidates = table.partition(partition)
+        else:
+            candidates = [item for item in table.items.values()
+                          if all(name in item for name in key)]
+        matches = [item for item in candidates
+                   if _evaluate(condition, item)]
+        if len(key) > 1:
+            matches.sort(key=lambda i: _comparable(i[key[1]]),
+                         reverse=not payload.get('ScanIndexForward', True))
+        return self._page(payload, table, matches, key)
+
+    def scan(self, payload):
+        table = self.table(payload['TableName'])
+        key = table.key
+        items = table.ordered()
+        if payload.get('IndexName'):
+            key = table.indexes[payload['IndexName']]
+            items = [(k, v) for k, v in items
+                     if all(name in v for name in key)]
+        segments = payload.get('TotalSegments')
+        if segments:
+            segment = payload.get('Segment', 0)
+            items = [(k, v) for k, v in items
+                     if zlib.crc32(repr(k).encode('utf-8')) % segments ==
+                     segment]
+        return self._page(payload, table, [v for k, v in items], key)
+
+    def batch_get_item(self, payload):
+        requested = sum(len(request['Keys'])
+                        for request in payload['RequestItems'].values())
+        if requested > 100:
+            raise _validation('Too many items requested for the '
+                              'BatchGetItem call')
+        responses, capacity = {}, []
+        for name, request in payload['RequestItems'].items():
+            table = self.table(name)
+            projection = self._projection(request)
+            responses[name], units = [], 0
+            for key in request['Keys']:
+                item = table.get(key)
+                units += self._read_units(item, request.get('ConsistentRead'))
+                if item is not None:
+                    responses[name].append(_project(item, projection))
+            capacity.append({'TableName': name, 'CapacityUnits': units})
+        response = {'Responses': responses, 'UnprocessedKeys': {}}
+        if payload.get('ReturnConsumedCapacity') in {'INDEXES', 'TOTAL'}:
+            response['ConsumedCapacity'] = capacity
+        return response
+
+    def batch_write_item(self, payload, unprocessed=None):
+        requested = sum(len(requests)
+                        for requests in payload['RequestItems'].values())
+        if requested > 25:
+            raise _validation('Too many items requested for the '
+                              'BatchWriteItem call')
+        remaining, capacity = {}, []
+        for name, requests in payload['RequestItems'].items():
+            table, units = self.table(name), 0
+            for request in requests:
+                if unprocessed and unprocessed():
+                    remaining.setdefault(name, []).append(request)
+                elif 'PutRequest' in request:
+                    table.put(request['PutRequest']['Item'])
+                    units += self._write_units(request['PutRequest']['Item'])
+                else:
+                    units += self._write_units(
+                        table.delete(request['DeleteRequest']['Key']))
+            capacity.append({'TableName': name, 'CapacityUnits': units})
+        response = {'UnprocessedItems': remaining}
+        if payload.get('ReturnConsumedCapacity') in {'INDEXES', 'TOTAL'}:
+            response['ConsumedCapacity'] = capacity
+        return response
+
+    def _check_condition(self, payload, item):
+        if payload.get('ConditionExpression'):
+            condition = self._parse_condition(
+                payload, payload['ConditionExpression'])
+            if not _evaluate(condition, item or {}):
+                raise ResponseError('ConditionalCheckFailedException',
+                                    'The conditional request failed')
+
+    def _page(self, payload, table, items, key):
+        """Apply the exclusive start key, limit, page size, filter and
+        projection to the matching items, returning the response.
+
+        """
+        if payload.get('ExclusiveStartKey'):
+            start = table.key_of(payload['ExclusiveStartKey'])
+            for offset, item in enumerate(items):
+                if table.key_of(item) == start:
+                    items = items[offset + 1:]
+                    break
+        limit = payload.get('Limit') or len(items)
+        evaluated, size = [], 0
+        for item in items[:limit]:
+            evaluated.append(item)
+            size += _item_size(item)
+            if size >= MAX_PAGE_SIZE:
+                break
+        matches = evaluated
+        if payload.get('FilterExpression'):
+            condition = self._parse_condition(
+                payload, payload['FilterExpression'])
+            matches = [item for item in evaluated
+                       if _evaluate(condition, item)]
+        response = {'Count': len(matches), 'ScannedCount': len(evaluated)}
+        if payload.get('Select') != 'COUNT':
+            projection = self._projection(payload)
+            response['Items'] = [_project(item, projection)
+                                 for item in matches]
+        if evaluated and len(evaluated) < len(items):
+            last = evaluated[-1]
+            response['LastEvaluatedKey'] = {
+                name: last[name] for name in
+                list(table.key) + [k for k in key if k not in table.key]}
+        units = int(math.ceil(size / 4096.0)) or 1
+        if not payload.get('ConsistentRead'):
+            units /= 2.0
+        return self._with_capacity(response, payload, table, None, True,
+                                   units=units)
+
+    @staticmethod
+    def _parse_condition(payload, expression):
+        return _Parser(expression,
+                       payload.get('ExpressionAttributeNames'),
+                       payload.get('ExpressionAttributeValues')).condition()
+
+    @staticmethod
+    def _partition_value(node, name):
+        """Find the value of the partition key equality condition.
+
+        :rtype: dict or None
+
+        """
+        if node[0] == 'and':
+            return Store._partition_value(node[1], name) or \
+                Store._partition_value(node[2], name)
+        elif node[0] == 'compare' and node[1] == '=' and \
+                node[2] == ('path', [name]) and node[3][0] == 'value':
+            return node[3][1]
+        return None
+
+    @staticmethod
+    def _projection(payload):
+        if not payload.get('ProjectionExpression'):
+            return None
+        return _Parser(payload['ProjectionExpression'],
+                       payload.get('ExpressionAttributeNames'),
+                       None).projection()
+
+    @staticmethod
+    def _read_units(item, consistent=False):
+        return utils.read_units(_item_size(item or {}), consistent)
+
+    @staticmethod
+    def _write_units(item):
+        return utils.write_units(_item_size(item or {}))
+
+    @staticmethod
+    def _return_values(return_values, old, new):
+        if return_values == 'ALL_OLD':
+            return old
+        elif return_values == 'ALL_NEW':
+            return new
+        elif return_values in {'UPDATED_OLD', 'UPDATED_NEW'}:
+            old = old or {}
+            changed = {k for k in set(old) | set(new)
+                       if old.get(k) != new.get(k)}
+            source = old if return_values == 'UPDATED_OLD' else new
+            return {k: v for k, v in source.items() if k in changed}
+        return None
+
+    def _with_capacity(self, response, payload, table, item, read,
+                       consistent=False, units=None):
+        mode = payload.get('ReturnConsumedCapacity')
+        if mode not in {'INDEXES', 'TOTAL'}:
+            return response
+        if units is None:
+            units = self._read_units(item, consistent) if read \
+                else self._write_units(item)
+        response['ConsumedCapacity'] = {'TableName': table.name,
+                                        'CapacityUnits': units}
+        if mode == 'INDEXES':
+            response['ConsumedCapacity']['Table'] = {'CapacityUnits': units}
+        return response
+
+
+class RequestHandler(web.RequestHandler):
+    """Handles the DynamoDB JSON protocol requests for :class:`Application`.
+    Request signatures are not validated.
+
+    """
+    @gen.coroutine
+    def post(self):
+        action = self.request.headers.get('x-amz-target', '').rpartition(
+            '.')[2]
+        self.application.requests[action] += 1
+        latency = self.application.latency
+        if callable(latency):
+            latency = latency()
+        if latency:
+            yield gen.sleep(latency)
+        try:
+            self.application.inject_failure(action)
+            payload = json.loads(self.request.body.decode('utf-8'))
+            if action == 'BatchWriteItem':
+                response = self.application.store.batch_write_item(
+                    payload, self.application.unprocessed)
+            else:
+                response = self.application.store.dispatch(action, payload)
+        except ResponseError as error:
+            self.set_status(error.status_code)
+            response = {'__type': ERROR_PREFIX + error.error_type,
+                        'message': error.message}
+        except (KeyError, TypeError, ValueError) as error:
+            self.set_status(400)
+            response = {'__type': ERROR_PREFIX + 'SerializationException',
+                        'message': str(error)}
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.finish(json.dumps(response).encode('utf-8'))
+
+
+class Application(web.Application):
+    """A Tornado application that serves the DynamoDB JSON protocol from an
+    in-memory :class:`Store`.
+
+    :param Store store: The data store, a new store is used if omitted
+    :param latency: Seconds to delay each response, or a callable that
+        returns the delay for each request
+    :type latency: float or callable
+    :param float throttle_rate: Fraction of requests that fail with
+        ``ProvisionedThroughputExceededException``
+    :param float error_rate: Fraction of requests that fail with a
+        ``500 InternalServerError`` response
+    :param float unprocessed_rate: Fraction of ``BatchWriteItem`` requests
+        that are returned as ``UnprocessedItems``
+    :param int seed: Seed for the random number generator used for fault
+        injection
+
+    """
+    def __init__(self, store=None, latency=0, throttle_rate=0.0,
+                 error_rate=0.0, unprocessed_rate=0.0, seed=None, **settings):
+        super(Application, self).__init__([('/', RequestHandler)],
+                                          **settings)
+        self.store = store or Store()
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.unprocessed_rate = unprocessed_rate
+        self.requests = collections.Counter()
+        self._failures = collections.defaultdict(collections.deque)
+        self._random = random.Random(seed)
+
+    def inject_error(self, action, error_type, count=1, status_code=400):
+        """Fail the next ``count`` requests for ``action`` with the
+        specified DynamoDB error.
+
+        :param str action: The action to fail
+        :param str error_type: The DynamoDB exception name, for example
+            ``ProvisionedThroughputExceededException``
+        :param int count: The number of requests to fail
+        :param int status_code: The HTTP status code of the responses
+
+        """
+        for _offset in range(count):
+            self._failures[action].append(
+                ResponseError(error_type, 'Injected failure', status_code))
+
+    def inject_failure(self, action):
+        """Raise an injected or randomly selected failure for the action.
+
+        :param str action: The action being performed
+        :raises: ResponseError
+
+        """
+        if self._failures.get(action):
+            raise self._failures[action].popleft()
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            raise ResponseError('ProvisionedThroughputExceededException',
+                                'The level of configured provisioned '
+                                'throughput for the table was exceeded.')
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise ResponseError('InternalServerError',
+                                'Internal server error', 500)
+
+    def unprocessed(self):
+        """Returns :data:`True` if a batch write request should be returned
+        unprocessed.
+
+        :rtype: bool
+
+        """
+        return bool(self.unprocessed_rate) and \
+            self._random.random() < self.unprocessed_rate
+
+
+class StubServer(object):
+    """Runs an :class:`Application` on the current IOLoop.
+
+    Keyword arguments are passed to :class:`Application`.
+
+    """
+    def __init__(self, **kwargs):
+        self.application = Application(**kwargs)
+        self.address = None
+        self.port = None
+        self._server = None
+
+    @property
+    def endpoint(self):
+        """The URL to pass as the ``endpoint`` of the client.
+
+        :rtype: str
+
+        """
+        return 'http://{}:{}'.format(self.address, self.port)
+
+    @property
+    def store(self):
+        """The data store for the server.
+
+        :rtype: Store
+
+        """
+        return self.application.store
+
+    def start(self, port=0, address='127.0.0.1'):
+        """Start listening for requests, returning the endpoint URL. An
+        ephemeral port is used unless ``port`` is specified.
+
+        :param int port: The port to listen on
+        :param str address: The address to listen on
+        :rtype: str
+
+        """
+        sockets = netutil.bind_sockets(port, address)
+        self._server = httpserver.HTTPServer(self.application)
+        self._server.add_sockets(sockets)
+        self.address = address
+        self.port = sockets[0].getsockname()[1]
+        LOGGER.debug('Stub DynamoDB listening at %s', self.endpoint)
+        return self.endpoint
+
+    def stop(self):
+        """Stop listening for requests."""
+        if self._server:
+            self._server.stop()
+            self._server = None
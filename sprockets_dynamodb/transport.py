@@ -0,0 +1,455 @@
+"""
+HTTP transport for the DynamoDB client, extending
+:class:`tornado_aws.client.AsyncAWSClient` with support for streaming
+response bodies and a cheaper request signing path.
+
+"""
+import codecs
+import hashlib
+import hmac
+import io
+import json
+import logging
+import re
+import time
+
+from tornado import concurrent, httpclient
+import tornado_aws
+from tornado_aws import exceptions as aws_exceptions
+
+LOGGER = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRUCTURE = re.compile(r'[\[\]{}"]')
+_STRING = re.compile(r'["\\]')
+_TOKEN = re.compile(r'[^ \t\n\r,\]}]*')
+
+_AUTHORIZATION = '{0} Credential={1}/{2}, SignedHeaders={3}, Signature={4}'
+_MAX_HEADER_LAYOUTS = 64
+
+
+class AsyncAWSClient(tornado_aws.AsyncAWSClient):
+    """Extends :class:`tornado_aws.client.AsyncAWSClient` with
+    :meth:`stream`, which passes the body of a successful response to a
+    callback as it is received instead of buffering it.
+
+    Requests are signed with the same SigV4 algorithm as the parent class,
+    but the derived signing key is cached until the date or the secret key
+    changes, the credential scope is cached per date and the sorted,
+    lowercased canonical header names are cached per set of request
+    headers, leaving only the body and canonical request hashes and the
+    signature to be computed for each request.
+
+    """
+    def __init__(self, *args, **kwargs):
+        self._header_layouts = {}
+        self._scope = None, None
+        self._signing_keys = None, None, None
+        super(AsyncAWSClient, self).__init__(*args, **kwargs)
+
+    def stream(self, method, path='/', query_args=None, headers=None,
+               body=None, streaming_callback=None, recursed=False):
+        """Execute a request, invoking ``streaming_callback`` with each chunk
+        of the response body as it is received. Error response bodies are
+        buffered so that they can be processed in the same way as with
+        :meth:`~tornado_aws.client.AsyncAWSClient.fetch`.
+
+        :param str method: HTTP request method
+        :param str path: The request path
+        :param dict query_args: Request query arguments
+        :param dict headers: Request headers
+        :param bytes body: The request body
+        :param callable streaming_callback: Invoked with each body chunk
+        :param bool recursed: Internal use only
+        :rtype: tornado.concurrent.Future
+        :raises: :class:`~tornado.httpclient.HTTPError`
+        :raises: :class:`~tornado_aws.exceptions.AWSError`
+        :raises: :class:`~tornado_aws.exceptions.NoCredentialsError`
+
+        """
+        future = concurrent.Future()
+        status, error_chunks = [None], []
+
+        def on_header(line):
+            if line.startswith('HTTP/'):
+                status[0] = int(line.split(' ', 2)[1])
+
+        def on_chunk(chunk):
+            if status[0] == 200:
+                streaming_callback(chunk)
+            else:
+                error_chunks.append(chunk)
+
+        def on_response(response):
+            aws_error, exc = None, response.exception()
+            if exc:
+                if isinstance(exc, httpclient.HTTPError):
+                    exc = self._buffered_error(exc, error_chunks)
+                    need_credentials, aws_error = self._process_error(exc)
+                    if need_credentials and not recursed:
+                        self._auth_config.reset()
+
+                        def on_retry(retry):
+                            if not self._future_exception(retry, future):
+                                future.set_result(retry.result())
+
+                        request = self.stream(method, path, query_args,
+                                              headers, body,
+                                              streaming_callback, True)
+                        self._ioloop.add_future(request, on_retry)
+                        return
+                    LOGGER.error('Error making request: %s', aws_error or exc)
+                future.set_exception(
+                    aws_error if aws_error else
+                    aws_exceptions.RequestException(error=exc))
+            else:
+                future.set_result(response.result())
+
+        def perform_request():
+            request = self._create_request(
+                method, path, query_args, headers, body)
+            request.header_callback = on_header
+            request.streaming_callback = on_chunk
+            self._ioloop.add_future(
+                self._client.fetch(request, raise_error=True), on_response)
+
+        def on_refreshed(response):
+            if not self._future_exception(response, future):
+                perform_request()
+
+        if self._auth_config.needs_credentials():
+            self._ioloop.add_future(self._auth_config.refresh(), on_refreshed)
+        else:
+            perform_request()
+        return future
+
+    @staticmethod
+    def _buffered_error(error, chunks):
+        """Return the HTTP error with the buffered response body restored,
+        since the response to a streamed request has an empty body.
+
+        :param tornado.httpclient.HTTPError error: The HTTP error
+        :param list chunks: The buffered response body
+        :rtype: tornado.httpclient.HTTPError
+
+        """
+        if error.response is None or not chunks:
+            return error
+        response = httpclient.HTTPResponse(
+            error.response.request, error.code,
+            headers=error.response.headers,
+            buffer=io.BytesIO(b''.join(chunks)),
+            effective_url=error.response.effective_url,
+            reason=error.response.reason)
+        return httpclient.HTTPClientError(error.code, error.message, response)
+
+    def _signed_request(self, method, path, query_args, headers, body):
+        """Create the request signature headers and return updated headers
+        for the request.
+
+        :param str method: HTTP request method
+        :param str path: The request path
+        :param dict query_args: Query string args
+        :param dict headers: Request headers
+        :param bytes body: The request body
+        :rtype: (dict, str)
+
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        query_string = self._query_string(query_args) if query_args else ''
+        amz_date = self._timestamp()
+        payload_hash = hashlib.sha256(body).hexdigest()
+
+        headers['Content-Length'] = str(len(body))
+        headers['Date'] = amz_date
+        headers['X-Amz-Content-sha256'] = payload_hash
+        headers.setdefault('Host', self._host)
+        security_token = self._auth_config.security_token
+        if security_token:
+            headers['X-Amz-Security-Token'] = security_token
+
+        names, signed_headers = self._header_layout(headers)
+        request = '\n'.join([
+            method, path, query_string,
+            ''.join(['{}:{}\n'.format(lower, headers[name])
+                     for name, lower in names]),
+            signed_headers, payload_hash])
+
+        date_stamp = amz_date[:8]
+        scope = self._credential_scope(date_stamp)
+        to_sign = '\n'.join([
+            self.ALGORITHM, amz_date, scope,
+            hashlib.sha256(request.encode('utf-8')).hexdigest()])
+        signature = hmac.new(self._signing_key(date_stamp),
+                             to_sign.encode('utf-8'),
+                             hashlib.sha256).hexdigest()
+        headers['Authorization'] = _AUTHORIZATION.format(
+            self.ALGORITHM, self._auth_config.access_key, scope,
+            signed_headers, signature)
+        return headers, '{0}{1}?{2}'.format(self._endpoint_url, path,
+                                            query_string)
+
+    def _credential_scope(self, date_stamp):
+        """Return the credential scope for the date, caching the most
+        recently used value.
+
+        :param str date_stamp: Date in %Y%m%d format for signing
+        :rtype: str
+
+        """
+        if self._scope[0] != date_stamp:
+            self._scope = date_stamp, '/'.join(
+                [date_stamp, self._region, self._service, 'aws4_request'])
+        return self._scope[1]
+
+    def _header_layout(self, headers):
+        """Return the header names paired with their lowercased form in
+        canonical order, and the signed headers value, for the set of header
+        names in ``headers``.
+
+        :param dict headers: The request headers
+        :rtype: (list, str)
+
+        """
+        key = tuple(headers)
+        layout = self._header_layouts.get(key)
+        if layout is None:
+            lowered = {name.lower(): name for name in headers}
+            names = [(lowered[lower], lower) for lower in sorted(lowered)]
+            layout = names, ';'.join(lower for _name, lower in names)
+            if len(self._header_layouts) >= _MAX_HEADER_LAYOUTS:
+                self._header_layouts.clear()
+            self._header_layouts[key] = layout
+        return layout
+
+    def _signing_key(self, date_stamp):
+        """Return the signature key for the request, deriving it only when
+        the date or the secret key has changed.
+
+        :param str date_stamp: Date in %Y%m%d format for signing
+        :rtype: bytes
+
+        """
+        secret_key = self._auth_config.secret_key
+        if self._signing_keys[:2] != (secret_key, date_stamp):
+            self._signing_keys = (
+                secret_key, date_stamp,
+                super(AsyncAWSClient, self)._signing_key(date_stamp))
+        return self._signing_keys[2]
+
+    @staticmethod
+    def _timestamp():
+        """Return the current time in the ISO 8601 basic format used for
+        the ``Date`` header.
+
+        :rtype: str
+
+        """
+        return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+
+
+class PageDecoder(object):
+    """Incrementally decodes a ``Query`` or ``Scan`` response body, invoking
+    ``item_callback`` with each entry of the ``Items`` array as soon as it
+    has been received. Only a single item is held in memory at a time. The
+    remaining top level values are returned by :meth:`close`.
+
+    Each item is decoded with a single :meth:`json.JSONDecoder.raw_decode`
+    call when it has been received completely. An item that continues in a
+    later chunk is scanned for its end as its chunks arrive, resuming where
+    the previous chunk left off, and is decoded once it is complete, so
+    large items are decoded in linear time and invalid JSON is reported as
+    soon as the value it is in has been received.
+
+    :param callable item_callback: Invoked with each item as a dict of
+        AttributeValues
+
+    """
+    def __init__(self, item_callback):
+        self.size = 0
+        self._buffer = ''
+        self._callback = item_callback
+        self._decoder = json.JSONDecoder()
+        self._key = None
+        self._result = {}
+        self._scanned = 0
+        self._stack = []
+        self._string = False
+        self._state = self._start
+        self._text = codecs.getincrementaldecoder('utf-8')()
+
+    def feed(self, chunk):
+        """Decode a chunk of the response body.
+
+        :param bytes chunk: The chunk to decode
+        :raises: ValueError
+
+        """
+        self.size += len(chunk)
+        self._buffer += self._text.decode(chunk)
+        offset = 0
+        while self._state is not None:
+            position = _WHITESPACE.match(self._buffer, offset).end()
+            if position == len(self._buffer):
+                break
+            consumed = self._state(position)
+            if consumed is None:
+                break
+            offset = consumed
+        self._buffer = self._buffer[offset:]
+
+    def close(self):
+        """Return the response with the ``Items`` removed.
+
+        :rtype: dict
+        :raises: ValueError
+
+        """
+        if self._state is not None:
+            raise ValueError('Incomplete response body')
+        return self._result
+
+    def _start(self, position):
+        if self._buffer[position] != '{':
+            raise ValueError('Expected a JSON object')
+        self._state = self._member
+        return position + 1
+
+    def _member(self, position):
+        char = self._buffer[position]
+        if char == '}':
+            self._state = None
+            return position + 1
+        elif char == ',':
+            return position + 1
+        elif char != '"':
+            raise ValueError('Expected a member name at {}'.format(position))
+        self._key, end = self._decode(position)
+        if end is None:
+            return None
+        end = _WHITESPACE.match(self._buffer, end).end()
+        if end == len(self._buffer):
+            self._state = self._colon
+            return end
+        elif self._buffer[end] != ':':
+            raise ValueError('Expected ":" at {}'.format(end))
+        self._state = self._value
+        return end + 1
+
+    def _colon(self, position):
+        if self._buffer[position] != ':':
+            raise ValueError('Expected ":" at {}'.format(position))
+        self._state = self._value
+        return position + 1
+
+    def _value(self, position):
+        if self._key == 'Items':
+            if self._buffer[position] != '[':
+                raise ValueError('Expected a JSON array for Items')
+            self._state = self._item
+            return position + 1
+        value, end = self._decode(position)
+        if end is None:
+            return None
+        self._result[self._key] = value
+        self._state = self._member
+        return end
+
+    def _item(self, position):
+        char = self._buffer[position]
+        if char == ']':
+            self._state = self._member
+            return position + 1
+        elif char == ',':
+            return position + 1
+        elif char != '{':
+            raise ValueError('Expected an item at {}'.format(position))
+        item, end = self._decode(position)
+        if end is None:
+            return None
+        self._callback(item)
+        return end
+
+    def _decode(self, position):
+        """Decode the value starting at the position once it is complete.
+        The value is decoded directly when it is first seen, as it usually
+        is complete, and is only scanned for its end when it is not.
+
+        :param int position: The start of the value in the buffer
+        :rtype: (mixed, int)
+        :raises: ValueError
+
+        """
+        if not self._scanned:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, position)
+            except ValueError:
+                pass
+            else:
+                # Numbers and literals may continue in the next chunk
+                if end < len(self._buffer) or \
+                        self._buffer[position] in '{["':
+                    return value, end
+        end = self._end(position)
+        if end is None:
+            return None, None
+        value, decoded = self._decoder.raw_decode(self._buffer, position)
+        if decoded != end:
+            raise ValueError('Invalid JSON value at {}'.format(position))
+        return value, end
+
+    def _end(self, position):
+        """Return the end of the value starting at the position, or
+        :data:`None` if it has not been received completely. The scan of an
+        incomplete object, array or string resumes where it stopped when
+        more of the body is received.
+
+        :param int position: The start of the value in the buffer
+        :rtype: int
+        :raises: ValueError
+
+        """
+        buffer = self._buffer
+        if buffer[position] not in '{["':
+            # Numbers and literals end at the next delimiter
+            end = _TOKEN.match(buffer, position).end()
+            return None if end == len(buffer) else end
+        stack, string = self._stack, self._string
+        index = position + self._scanned
+        while True:
+            if string:
+                match = _STRING.search(buffer, index)
+                if match is None:
+                    index = len(buffer)
+                    break
+                elif match.group() == '\\':
+                    if match.end() == len(buffer):
+                        index = match.start()
+                        break
+                    index = match.end() + 1
+                    continue
+                string, index = False, match.end()
+                if stack:
+                    continue
+            else:
+                match = _STRUCTURE.search(buffer, index)
+                if match is None:
+                    index = len(buffer)
+                    break
+                char, index = match.group(), match.end()
+                if char == '"':
+                    string = True
+                    continue
+                elif char in '[{':
+                    stack.append(char)
+                    continue
+                elif not stack or stack.pop() != '[{'[char == '}']:
+                    raise ValueError('Unexpected {!r} at {}'.format(
+                        char, match.start()))
+                elif stack:
+                    continue
+            self._scanned, self._string = 0, False
+            return index
+        self._scanned, self._string = index - position, string
+        return None
@@ -3,6 +3,10 @@ Utilities for working with DynamoDB.
 
 - :func:`.marshall`
 - :func:`.unmarshal`
+- :func:`.item_size`
+- :func:`.read_units`
+- :func:`.write_units`
+- :class:`.CapacityLimiter`
 
 This module contains some helpers that make working with the
 Amazon DynamoDB API a little less painful.  Data is encoded as
@@ -15,16 +19,30 @@ the vast majority of types that we use.
 
 """
 import base64
+import collections.abc
 import datetime
+import math
+import time
 import uuid
 import sys
 
+from sprockets_dynamodb import compression
+
 PYTHON3 = True if sys.version_info > (3, 0, 0) else False
 TEXT_CHARS = bytearray({7, 8, 9, 10, 12, 13, 27} |
                        set(range(0x20, 0x100)) - {0x7f})
 if PYTHON3:  # pragma: nocover
     unicode = str
 
+#: The maximum size of an item in bytes
+MAX_ITEM_SIZE = 409600
+
+#: The maximum number of requests in a ``BatchWriteItem`` request
+MAX_BATCH_WRITE_ITEMS = 25
+
+#: The maximum total size of the items in a ``BatchWriteItem`` request
+MAX_BATCH_WRITE_SIZE = 16777216
+
 
 def is_binary(value):
     """
@@ -70,6 +88,143 @@ def unmarshall(values):
     return unmarshalled
 
 
+def json_default(value):
+    """
+    Encode the unmarshalled values that JSON does not support, for use as
+    the ``default`` of :func:`json.dumps` or :class:`json.JSONEncoder`.
+    Binary values are base64 encoded and sets are encoded as sorted lists.
+
+    :param mixed value: The value to encode
+    :rtype: mixed
+    :raises TypeError: if the value is not supported
+
+    """
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    elif isinstance(value, (set, frozenset)):
+        return sorted(json_default(v) if isinstance(v, bytes) else v
+                      for v in value)
+    elif isinstance(value, collections.abc.Mapping):
+        return dict(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def item_size(values, marshalled=False):
+    """
+    Return the size of an item as DynamoDB accounts for it when enforcing
+    the item size limit and calculating the capacity units it consumes.
+
+    :param dict values: The item values
+    :param bool marshalled: The values are AttributeValues
+    :rtype: int
+    :raises ValueError: if an unsupported type is encountered
+
+    The size is the sum of the UTF-8 encoded length of each attribute name
+    and the size of its value: the UTF-8 encoded length of strings, the
+    length of binary values, one byte per two significant digits of a
+    number plus one, one byte for booleans and nulls, and three bytes plus
+    the size of each element of a list or map.
+
+    """
+    size = _value_size if not marshalled else _attribute_value_size
+    return sum(len(name.encode('utf-8')) + size(value)
+               for name, value in values.items())
+
+
+def split_batch_write(request_items):
+    """
+    Split the marshalled ``RequestItems`` of a ``BatchWriteItem`` request
+    into ``RequestItems`` that are each within the
+    :data:`MAX_BATCH_WRITE_ITEMS` and :data:`MAX_BATCH_WRITE_SIZE` limits,
+    keeping the order of the requests.
+
+    :param dict request_items: A mapping of table names to a list of
+        ``PutRequest`` and ``DeleteRequest`` requests
+    :rtype: iterator
+
+    """
+    batch, count, size = {}, 0, 0
+    for table_name, requests in request_items.items():
+        for request in requests:
+            request_size = item_size(
+                request['PutRequest']['Item'] if 'PutRequest' in request
+                else request['DeleteRequest']['Key'], marshalled=True)
+            if count == MAX_BATCH_WRITE_ITEMS or \
+                    (count and size + request_size > MAX_BATCH_WRITE_SIZE):
+                yield batch
+                batch, count, size = {}, 0, 0
+            batch.setdefault(table_name, []).append(request)
+            count += 1
+            size += request_size
+    if batch:
+        yield batch
+
+
+def read_units(size, consistent=False, transactional=False):
+    """
+    Return the read capacity units consumed by reading an item.
+
+    :param int size: The size of the item, see :func:`item_size`
+    :param bool consistent: The read is strongly consistent
+    :param bool transactional: The read is part of a transaction
+    :rtype: float
+
+    """
+    units = max(1, int(math.ceil(size / 4096.0)))
+    if transactional:
+        return units * 2.0
+    return float(units) if consistent else units / 2.0
+
+
+def write_units(size, transactional=False):
+    """
+    Return the write capacity units consumed by writing an item.
+
+    :param int size: The size of the item, see :func:`item_size`
+    :param bool transactional: The write is part of a transaction
+    :rtype: float
+
+    """
+    units = max(1, int(math.ceil(size / 1024.0)))
+    return units * 2.0 if transactional else float(units)
+
+
+class CapacityLimiter(object):
+    """Paces the consumption of capacity units to a target rate per second,
+    for bulk operations that should not use all of the capacity of a
+    table. Up to ``burst`` seconds of units can be consumed at once before
+    the caller is asked to wait.
+
+    :param float rate: The target capacity units per second
+    :param float burst: The number of seconds of units that can be consumed
+        without waiting
+
+    """
+    def __init__(self, rate, burst=1.0):
+        if rate <= 0:
+            raise ValueError('rate must be greater than zero')
+        self.rate = float(rate)
+        self.burst = burst
+        self._next = None
+
+    def delay(self, units):
+        """Record the consumption of capacity units, returning the number of
+        seconds to wait before consuming more. Units that were recorded in
+        advance of a request, for example from the :func:`write_units` of
+        its items, can be corrected once the consumed units are known by
+        recording the difference, which may be negative.
+
+        :param float units: The capacity units consumed
+        :rtype: float
+
+        """
+        now = time.monotonic()
+        if self._next is None or self._next < now:
+            self._next = now
+        self._next += units / self.rate
+        return max(self._next - now - self.burst, 0.0)
+
+
 def _encode_binary_set(value):
     """Base64 encode binary values in list of values.
 
@@ -138,6 +293,137 @@ def _marshall_value(value):
     raise ValueError('Unsupported type: %s' % type(value))
 
 
+def _value_size(value):
+    """Return the size of a value as it is marshalled by
+    :func:`_marshall_value`.
+
+    :param mixed value: The value
+    :rtype: int
+    :raises ValueError: for unsupported types
+
+    """
+    size = _SIZES.get(value.__class__)
+    if size is not None:
+        return size(value)
+    elif isinstance(value, bytes):
+        return len(value) or 1
+    elif isinstance(value, str):
+        return len(value.encode('utf-8')) or 1
+    elif isinstance(value, dict):
+        return _map_size(value)
+    elif isinstance(value, bool):
+        return 1
+    elif isinstance(value, int):
+        return _int_size(value)
+    elif isinstance(value, float):
+        return _number_size(str(value))
+    elif isinstance(value, datetime.datetime):
+        return len(value.isoformat())
+    elif isinstance(value, uuid.UUID):
+        return 36
+    elif isinstance(value, list):
+        return _list_size(value)
+    elif isinstance(value, set):
+        return sum(_value_size(item) for item in value)
+    raise ValueError('Unsupported type: %s' % type(value))
+
+
+def _map_size(value):
+    return 3 + sum(len(key.encode('utf-8')) + _value_size(item) + 1
+                   for key, item in value.items())
+
+
+def _list_size(value):
+    return 3 + sum(_value_size(item) + 1 for item in value)
+
+
+def _set_size(value):
+    return sum(_value_size(item) for item in value)
+
+
+def _int_size(value):
+    """Return the size of an integer, see :func:`_number_size`.
+
+    :param int value: The number
+    :rtype: int
+
+    """
+    digits = len(str(value).lstrip('-').rstrip('0'))
+    return (digits + 1) // 2 + 1 + (value < 0)
+
+
+def _attribute_value_size(value):
+    """Return the size of an AttributeValue.
+
+    :param dict value: The AttributeValue
+    :rtype: int
+    :raises ValueError: if an unsupported type code is encountered
+
+    """
+    for key, data in value.items():
+        if key == 'S':
+            return len(data.encode('utf-8'))
+        elif key == 'N':
+            return _number_size(data)
+        elif key == 'B':
+            return _binary_size(data)
+        elif key == 'BOOL' or key == 'NULL':
+            return 1
+        elif key == 'M':
+            return 3 + sum(len(name.encode('utf-8')) +
+                           _attribute_value_size(item) + 1
+                           for name, item in data.items())
+        elif key == 'L':
+            return 3 + sum(_attribute_value_size(item) + 1 for item in data)
+        elif key == 'SS':
+            return sum(len(item.encode('utf-8')) for item in data)
+        elif key == 'NS':
+            return sum(_number_size(item) for item in data)
+        elif key == 'BS':
+            return sum(_binary_size(item) for item in data)
+        raise ValueError('Unsupported value type: %s' % key)
+    raise ValueError('Empty AttributeValue')
+
+
+def _binary_size(value):
+    """Return the decoded length of a base64 encoded binary value.
+
+    :param str|bytes value: The base64 encoded value
+    :rtype: int
+
+    """
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+    return len(value) * 3 // 4 - value[-2:].count('=')
+
+
+def _number_size(value):
+    """Return the size of a number from its string form: one byte per two
+    significant digits, plus one byte, plus one byte if it is negative.
+
+    :param str value: The number
+    :rtype: int
+
+    """
+    digits = value.lstrip('-').split('e')[0].split('E')[0]
+    digits = digits.replace('.', '').strip('0')
+    return (len(digits) + 1) // 2 + 1 + value.startswith('-')
+
+
+_SIZES = {
+    str: lambda value: len(value.encode('utf-8')) or 1,
+    bytes: lambda value: len(value) or 1,
+    int: _int_size,
+    float: lambda value: _number_size(str(value)),
+    bool: lambda value: 1,
+    type(None): lambda value: 1,
+    dict: _map_size,
+    list: _list_size,
+    set: _set_size,
+    uuid.UUID: lambda value: 36
+}
+
+
 def _to_number(value):
     """
     Convert the string containing a number to a number
@@ -156,11 +442,24 @@ def _unmarshall_dict(value):
     :param dict value: The value to unmarshall
     :rtype: mixed
     :raises ValueError: if an unsupported type code is encountered
+    :raises sprockets_dynamodb.compression.UnsupportedCodec: if a value is
+        compressed with a codec that is not supported or not installed
 
     """
     key = list(value.keys()).pop()
     if key == 'B':
-        return base64.b64decode(value[key].encode('ascii'))
+        data = base64.b64decode(value[key].encode('ascii'))
+        if not data.startswith(compression.MAGIC):
+            return data
+        try:
+            original = compression.decompress(data)
+        except compression.UnsupportedCodec:
+            raise
+        except ValueError:
+            return data
+        if original is None or 'B' in original:
+            return data if original is None else original['B']
+        return _unmarshall_dict(original)
     elif key == 'BS':
         return set([base64.b64decode(v.encode('ascii'))
                     for v in value[key]])
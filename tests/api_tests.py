@@ -1,5 +1,7 @@
 import collections
+from concurrent import futures
 import datetime
+import json
 import logging
 from unittest import mock
 import os
@@ -13,7 +15,7 @@ from tornado import concurrent, gen, httpclient, locks, testing
 from tornado_aws import exceptions as aws_exceptions
 
 import sprockets_dynamodb as dynamodb
-from sprockets_dynamodb import utils
+from sprockets_dynamodb import testing as stub, utils
 
 LOGGER = logging.getLogger(__name__)
 
@@ -71,6 +73,55 @@ class AsyncTestCase(testing.AsyncTestCase):
         return True
 
 
+class StubServerMixin(object):
+    """Runs the test case against in-process stub servers instead of the
+    DynamoDB endpoint, stopping them and closing the client on tear down.
+
+    """
+    client_kwargs = {}
+    server_kwargs = {}
+
+    def setUp(self):
+        self.servers = []
+        super(StubServerMixin, self).setUp()
+
+    def tearDown(self):
+        self.client.close()
+        for server in self.servers:
+            server.stop()
+        super(StubServerMixin, self).tearDown()
+
+    def get_client(self):
+        self.server = self.start_server(**self.server_kwargs)
+        return dynamodb.Client(endpoint=self.server.endpoint,
+                               **self.client_kwargs)
+
+    def start_server(self, **kwargs):
+        server = stub.StubServer(**kwargs)
+        server.start()
+        self.servers.append(server)
+        return server
+
+    def create_stub_table(self, range_key=None):
+        """Create a table keyed by ``id`` in each of the stub servers,
+        optionally with a numeric range key, returning its name.
+
+        """
+        definition = self.generic_table_definition()
+        if range_key:
+            definition['AttributeDefinitions'].append(
+                {'AttributeName': range_key, 'AttributeType': 'N'})
+            definition['KeySchema'].append(
+                {'AttributeName': range_key, 'KeyType': 'RANGE'})
+        for server in self.servers:
+            server.store.create_table(definition)
+        return definition['TableName']
+
+
+class StubServerTestCase(StubServerMixin, AsyncTestCase):
+    pass
+
+
 class AsyncItemTestCase(AsyncTestCase):
 
     def setUp(self):
@@ -230,6 +281,285 @@ class AWSClientTests(AsyncTestCase):
         yield wait_for_measurements.wait()
 
 
+class ConsumedCapacityTests(AsyncTestCase):
+
+    def get_client(self):
+        return dynamodb.Client(endpoint=self.endpoint,
+                               return_consumed_capacity='INDEXES')
+
+    @staticmethod
+    def fetch_response(payload):
+        future = concurrent.Future()
+        future.set_result(
+            mock.Mock(body=json.dumps(payload).encode('utf-8')))
+        return future
+
+    def test_invalid_return_consumed_capacity_raises(self):
+        with self.assertRaises(ValueError):
+            dynamodb.Client(endpoint=self.endpoint,
+                            return_consumed_capacity='ALL')
+
+    def test_measurement_fields_default(self):
+        from sprockets_dynamodb import client
+        measurement = client.Measurement(
+            1.0, 'GetItem', 'foo', 1, 0.1, None)
+        self.assertEqual(measurement.capacity, ())
+        self.assertEqual(measurement.hot_keys, ())
+
+    def test_consumed_capacity_by_table_and_index(self):
+        from sprockets_dynamodb import client
+        result = {'ConsumedCapacity': {
+            'TableName': 'foo',
+            'CapacityUnits': 3.0,
+            'Table': {'CapacityUnits': 1.0},
+            'GlobalSecondaryIndexes': {'bar': {'CapacityUnits': 2.0}}}}
+        self.assertEqual(
+            client._consumed_capacity('PutItem', result),
+            (client.Capacity('foo', None, 0.0, 1.0),
+             client.Capacity('foo', 'bar', 0.0, 2.0)))
+
+    def test_consumed_capacity_aggregates_batch_responses(self):
+        from sprockets_dynamodb import client
+        result = {'ConsumedCapacity': [
+            {'TableName': 'foo', 'CapacityUnits': 1.5},
+            {'TableName': 'bar', 'CapacityUnits': 0.5},
+            {'TableName': 'foo', 'CapacityUnits': 1.0}]}
+        self.assertEqual(
+            client._consumed_capacity('BatchGetItem', result),
+            (client.Capacity('foo', None, 2.5, 0.0),
+             client.Capacity('bar', None, 0.5, 0.0)))
+
+    def test_consumed_capacity_without_capacity(self):
+        from sprockets_dynamodb import client
+        self.assertEqual(client._consumed_capacity('Scan', {'Count': 0}), ())
+
+    @testing.gen_test
+    def test_capacity_is_measured_and_removed_from_result(self):
+        measured = []
+        self.client.set_instrumentation_callback(measured.extend)
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = self.fetch_response({
+                'Item': {'id': {'S': 'foo'}},
+                'ConsumedCapacity': {'TableName': 'foo',
+                                     'CapacityUnits': 0.5}})
+            result = yield self.client.get_item('foo', {'id': 'foo'})
+            body = json.loads(fetch.call_args[1]['body'].decode('utf-8'))
+        self.assertEqual(body['ReturnConsumedCapacity'], 'INDEXES')
+        self.assertEqual(result, {'Item': {'id': 'foo'}})
+        self.assertEqual(measured[0].capacity,
+                         (dynamodb.client.Capacity('foo', None, 0.5, 0.0),))
+
+    @testing.gen_test
+    def test_requested_capacity_is_returned(self):
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = self.fetch_response({
+                'ConsumedCapacity': {'TableName': 'foo',
+                                     'CapacityUnits': 1.0}})
+            result = yield self.client.put_item(
+                'foo', {'id': 'foo'}, return_consumed_capacity='TOTAL')
+            body = json.loads(fetch.call_args[1]['body'].decode('utf-8'))
+        self.assertEqual(body['ReturnConsumedCapacity'], 'TOTAL')
+        self.assertEqual(result['ConsumedCapacity']['CapacityUnits'], 1.0)
+
+
+class CountingExecutor(futures.ThreadPoolExecutor):
+
+    def __init__(self):
+        super(CountingExecutor, self).__init__(1)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super(CountingExecutor, self).submit(*args, **kwargs)
+
+
+class DecodeExecutorTests(AsyncTestCase):
+
+    PAGE = {'Count': 2, 'ScannedCount': 2,
+            'Items': [{'id': {'S': 'a'}, 'n': {'N': '1'}},
+                      {'id': {'S': 'b'}, 'n': {'N': '2.5'}}],
+            'LastEvaluatedKey': {'id': {'S': 'b'}},
+            'ConsumedCapacity': {'TableName': 'foo', 'CapacityUnits': 1.0}}
+
+    def get_client(self):
+        self.executor = CountingExecutor()
+        return dynamodb.Client(endpoint=self.endpoint,
+                               decode_executor=self.executor,
+                               decode_threshold=64,
+                               return_consumed_capacity='TOTAL')
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(DecodeExecutorTests, self).tearDown()
+
+    @staticmethod
+    def fetch_response(payload):
+        future = concurrent.Future()
+        future.set_result(
+            mock.Mock(body=json.dumps(payload).encode('utf-8')))
+        return future
+
+    @testing.gen_test
+    def test_large_response_is_decoded_in_executor(self):
+        measured = []
+        self.client.set_instrumentation_callback(measured.extend)
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = self.fetch_response(self.PAGE)
+            result = yield self.client.scan('foo')
+        self.assertEqual(self.executor.submitted, 1)
+        self.assertEqual(result, {
+            'Count': 2, 'ScannedCount': 2,
+            'Items': [{'id': 'a', 'n': 1}, {'id': 'b', 'n': 2.5}],
+            'LastEvaluatedKey': {'id': 'b'}})
+        self.assertEqual(measured[0].capacity,
+                         (dynamodb.client.Capacity('foo', None, 1.0, 0.0),))
+
+    @testing.gen_test
+    def test_small_response_is_decoded_inline(self):
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = self.fetch_response({'Item': {}})
+            result = yield self.client.get_item('foo', {'id': 'a'})
+        self.assertEqual(self.executor.submitted, 0)
+        self.assertEqual(result, {'Item': {}})
+
+    @testing.gen_test
+    def test_decode_error_in_executor(self):
+        future = concurrent.Future()
+        future.set_result(mock.Mock(body=b'{"Items": [' + b' ' * 128))
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = future
+            with self.assertRaises(ValueError):
+                yield self.client.scan('foo')
+        self.assertEqual(self.executor.submitted, 1)
+
+    @testing.gen_test
+    def test_process_pool_with_schema(self):
+        from sprockets_dynamodb import schema
+        self.client.register_schema('foo', schema.Schema({'n': 'N'}))
+        executor = futures.ProcessPoolExecutor(1)
+        self.client._decode_executor = executor
+        try:
+            with mock.patch(
+                    'tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+                fetch.return_value = self.fetch_response(self.PAGE)
+                result = yield self.client.scan('foo')
+        finally:
+            executor.shutdown()
+        self.assertEqual(result['Items'][1], {'id': 'b', 'n': 2.5})
+
+    def test_records_are_not_decoded_in_process_pool(self):
+        from sprockets_dynamodb import schema
+        response = self.fetch_response(self.PAGE)
+        records = schema.Schema({'n': 'N'}, records=True)
+        self.assertTrue(self.client._offload_decode(response, records))
+        with futures.ProcessPoolExecutor(1) as executor:
+            self.client._decode_executor = executor
+            self.assertFalse(self.client._offload_decode(response, records))
+            self.assertTrue(self.client._offload_decode(response, None))
+
+
+class RecordingTracer(object):
+
+    class Span(object):
+
+        def __init__(self, tracer, name, attributes):
+            self.attributes = dict(attributes)
+            self.exception = None
+            self.name = name
+            self.parent = tracer.active
+            self.tracer = tracer
+
+        def __enter__(self):
+            self.tracer.active = self
+            self.tracer.spans.append(self)
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.exception = exc_value
+            self.tracer.active = self.parent
+
+        def set_attribute(self, key, value):
+            self.attributes[key] = value
+
+    def __init__(self):
+        self.active = None
+        self.spans = []
+
+    def start_as_current_span(self, name, attributes=None):
+        return self.Span(self, name, attributes or {})
+
+
+class TracingTests(AsyncTestCase):
+
+    def setUp(self):
+        super(TracingTests, self).setUp()
+        self.tracer = RecordingTracer()
+        self.client.set_tracer(self.tracer)
+
+    @testing.gen_test
+    def test_no_spans_without_tracer(self):
+        self.client.set_tracer(None)
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = ConsumedCapacityTests.fetch_response({})
+            yield self.client.put_item('foo', {'id': 'foo'})
+        self.assertEqual(self.tracer.spans, [])
+
+    @testing.gen_test
+    def test_action_and_attempt_spans(self):
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = ConsumedCapacityTests.fetch_response({
+                'Item': {'id': {'S': 'foo'}},
+                'ConsumedCapacity': {'TableName': 'foo',
+                                     'CapacityUnits': 0.5}})
+            yield self.client.get_item('foo', {'id': 'foo'})
+        action, attempt = self.tracer.spans
+        self.assertEqual(action.name, 'DynamoDB.GetItem')
+        self.assertIsNone(action.parent)
+        self.assertEqual(action.attributes['db.operation'], 'GetItem')
+        self.assertEqual(action.attributes['aws.dynamodb.table_names'],
+                         ['foo'])
+        self.assertIs(attempt.parent, action)
+        self.assertEqual(attempt.attributes['aws.dynamodb.attempt'], 1)
+        self.assertNotIn('error.type', attempt.attributes)
+        self.assertEqual(
+            json.loads(
+                attempt.attributes['aws.dynamodb.consumed_capacity'][0]),
+            {'table': 'foo', 'index': None,
+             'read_units': 0.5, 'write_units': 0.0})
+        self.assertGreater(attempt.attributes['http.request.body.size'], 0)
+        self.assertGreater(attempt.attributes['http.response.body.size'], 0)
+
+    @testing.gen_test
+    def test_successful_spans_exit_without_exception(self):
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            fetch.return_value = ConsumedCapacityTests.fetch_response({
+                'Item': {'id': {'S': 'foo'}}})
+            result = yield self.client.get_item('foo', {'id': 'foo'})
+        self.assertEqual(result['Item'], {'id': 'foo'})
+        self.assertEqual([span.exception for span in self.tracer.spans],
+                         [None, None])
+
+    @testing.gen_test
+    def test_retried_attempts_have_spans(self):
+        with mock.patch('tornado_aws.client.AsyncAWSClient.fetch') as fetch:
+            future = concurrent.Future()
+            future.set_exception(dynamodb.ServiceUnavailable())
+            fetch.return_value = future
+            with mock.patch.object(self.client, '_sleep_duration') as sleep:
+                sleep.return_value = 0
+                with self.assertRaises(dynamodb.ServiceUnavailable):
+                    yield self.client.create_table(
+                        self.generic_table_definition())
+        action, attempts = self.tracer.spans[0], self.tracer.spans[1:]
+        self.assertIsInstance(action.exception, dynamodb.ServiceUnavailable)
+        self.assertEqual([span.attributes['aws.dynamodb.attempt']
+                          for span in attempts], [1, 2, 3])
+        for span in attempts:
+            self.assertIs(span.parent, action)
+            self.assertEqual(span.attributes['error.type'],
+                             'ServiceUnavailable')
+
+
 class CreateTableTests(AsyncTestCase):
 
     @testing.gen_test
@@ -0,0 +1,182 @@
+import os
+import shutil
+import tempfile
+
+from tornado import httpserver, netutil, testing as tornado_testing, web
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import blobstore, compression, utils
+from tests import api_tests
+
+TEXT = 'x' * 1024
+
+
+class BucketHandler(web.RequestHandler):
+
+    def initialize(self, objects):
+        self.objects = objects
+
+    def put(self, path):
+        self.objects[path] = self.request.body
+
+    def get(self, path):
+        if path not in self.objects:
+            raise web.HTTPError(404)
+        self.write(self.objects[path])
+
+    def delete(self, path):
+        self.objects.pop(path, None)
+        self.set_status(204)
+
+
+class OffloadTests(tornado_testing.AsyncTestCase):
+
+    def setUp(self):
+        super(OffloadTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.offload = blobstore.Offload(
+            blobstore.FileStore(self.path), threshold=512)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(OffloadTests, self).tearDown()
+
+    @tornado_testing.gen_test
+    def test_round_trip(self):
+        item = {'id': 'a', 'body': TEXT, 'blob': TEXT.encode('ascii'),
+                'doc': {'lines': [TEXT]}, 'small': 'value'}
+        values = yield self.offload.offload('example', utils.marshall(item))
+        self.assertEqual(values['id'], {'S': 'a'})
+        self.assertEqual(values['small'], {'S': 'value'})
+        stored = utils.unmarshall(values)
+        for name in ('body', 'blob', 'doc'):
+            self.assertTrue(blobstore.is_pointer(stored[name]))
+        self.assertLess(utils.item_size(stored), 512)
+        self.assertEqual(len(os.listdir(os.path.join(self.path, 'example'))),
+                         2)
+        loaded = yield self.offload.load(stored)
+        self.assertEqual(loaded, item)
+        partial = yield self.offload.load(stored, ['body'])
+        self.assertEqual(partial['body'], TEXT)
+        self.assertTrue(blobstore.is_pointer(partial['doc']))
+
+    @tornado_testing.gen_test
+    def test_nothing_to_offload(self):
+        values = utils.marshall({'id': 'a', 'small': 'value'})
+        result = yield self.offload.offload('example', values)
+        self.assertIs(result, values)
+        self.assertEqual(os.listdir(self.path), [])
+
+    @tornado_testing.gen_test
+    def test_attributes(self):
+        offload = blobstore.Offload(self.offload.store, 512, ['body'])
+        values = yield offload.offload('example', utils.marshall(
+            {'body': TEXT, 'other': TEXT}))
+        self.assertIn('M', values['body'])
+        self.assertEqual(values['other'], {'S': TEXT})
+
+    @tornado_testing.gen_test
+    def test_compressed_values(self):
+        codec = compression.Compression(['blob'], threshold=0, codec='zlib')
+        value = os.urandom(256) * 8
+        values = yield self.offload.offload('example', codec.compress(
+            utils.marshall({'blob': value})))
+        item = yield self.offload.load(utils.unmarshall(values))
+        self.assertEqual(item['blob'], value)
+
+    @tornado_testing.gen_test
+    def test_file_store(self):
+        store = blobstore.FileStore(self.path)
+        yield store.put('table/key', b'data')
+        yield store.put('table/key', b'data')
+        data = yield store.get('table/key')
+        self.assertEqual(data, b'data')
+        yield store.delete('table/key')
+        yield store.delete('table/key')
+        with self.assertRaises(FileNotFoundError):
+            yield store.get('table/key')
+        with self.assertRaises(ValueError):
+            store.get('../key')
+
+    @tornado_testing.gen_test
+    def test_s3_store(self):
+        objects = {}
+        sockets = netutil.bind_sockets(0, '127.0.0.1')
+        server = httpserver.HTTPServer(web.Application(
+            [(r'/(.*)', BucketHandler, {'objects': objects})]))
+        server.add_sockets(sockets)
+        try:
+            client = dynamodb.Client(endpoint='http://127.0.0.1:1',
+                                     refresh_credentials=False)
+            store = blobstore.S3Store(
+                'bucket', 'blobs/', endpoint='http://127.0.0.1:{}'.format(
+                    sockets[0].getsockname()[1]), client=client)
+            self.assertIs(store._client._auth_config,
+                          client._client._auth_config)
+            yield store.put('table/key', b'data')
+            self.assertEqual(objects, {'bucket/blobs/table/key': b'data'})
+            data = yield store.get('table/key')
+            self.assertEqual(data, b'data')
+            yield store.delete('table/key')
+            self.assertEqual(objects, {})
+            store.close()
+            client.close()
+        finally:
+            server.stop()
+
+
+class ClientOffloadTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(ClientOffloadTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.table = self.create_stub_table()
+        self.offload = blobstore.Offload(blobstore.FileStore(self.path))
+        self.client.register_offload(self.table, self.offload)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(ClientOffloadTests, self).tearDown()
+
+    @tornado_testing.gen_test
+    def test_large_items_offloaded(self):
+        body = 'y' * utils.MAX_ITEM_SIZE
+        item = {'id': 'a', 'body': body}
+        yield self.client.put_item(self.table, item)
+        self.assertEqual(item, {'id': 'a', 'body': body})
+        yield self.client.batch_write_item({self.table: [
+            {'PutRequest': {'Item': {'id': 'b', 'body': body + 'z'}}},
+            {'DeleteRequest': {'Key': {'id': 'c'}}}]})
+        result = yield self.client.get_item(self.table, {'id': 'a'})
+        self.assertTrue(blobstore.is_pointer(result['Item']['body']))
+        loaded = yield self.offload.load(result['Item'])
+        self.assertEqual(loaded, item)
+        result = yield self.client.get_item(self.table, {'id': 'b'})
+        loaded = yield self.offload.load(result['Item'])
+        self.assertEqual(loaded['body'], body + 'z')
+
+    @tornado_testing.gen_test
+    def test_oversized_items_rejected_before_offload(self):
+        self.client.register_offload(self.table, blobstore.Offload(
+            self.offload.store, attributes=['body']))
+        item = {'id': 'a', 'body': 'y' * 100000,
+                'other': 'z' * utils.MAX_ITEM_SIZE}
+        with self.assertRaises(dynamodb.ValidationException):
+            yield self.client.put_item(self.table, item)
+        with self.assertRaises(dynamodb.ValidationException):
+            yield self.client.batch_write_item(
+                {self.table: [{'PutRequest': {'Item': item}}]})
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_retained_size(self):
+        values = utils.marshall({'id': 'a', 'body': TEXT, 'other': TEXT})
+        offload = blobstore.Offload(self.offload.store, 512, ['body'])
+        self.assertEqual(offload.retained_size(values), utils.item_size(
+            utils.marshall({'id': 'a', 'other': TEXT}), marshalled=True))
+
+    @tornado_testing.gen_test
+    def test_unregistered_tables_not_offloaded(self):
+        self.client.register_offload(self.table, None)
+        with self.assertRaises(dynamodb.ValidationException):
+            yield self.client.put_item(
+                self.table, {'id': 'a', 'body': 'y' * utils.MAX_ITEM_SIZE})
@@ -0,0 +1,107 @@
+import unittest
+
+from tornado import testing as tornado_testing
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import bloom, utils
+from tests import api_tests
+
+
+class BloomFilterTests(unittest.TestCase):
+
+    def test_added_keys_present(self):
+        keys = bloom.BloomFilter(1000)
+        for offset in range(1000):
+            keys.add(utils.marshall({'id': str(offset)}))
+        for offset in range(1000):
+            self.assertIn(utils.marshall({'id': str(offset)}), keys)
+        self.assertEqual(keys.count, 1000)
+
+    def test_false_positive_rate(self):
+        keys = bloom.BloomFilter(1000, 0.01)
+        for offset in range(1000):
+            keys.add(utils.marshall({'id': str(offset)}))
+        false_positives = sum(
+            1 for offset in range(1000, 11000)
+            if utils.marshall({'id': str(offset)}) in keys)
+        self.assertLess(false_positives, 300)
+
+    def test_key_names_project_items(self):
+        keys = bloom.BloomFilter(10, key_names=['id'])
+        keys.add(utils.marshall({'id': 'a', 'value': 1}))
+        self.assertIn(utils.marshall({'id': 'a'}), keys)
+        self.assertNotIn(utils.marshall({'id': 'b'}), keys)
+
+    def test_sizing(self):
+        keys = bloom.BloomFilter(1000, 0.01)
+        self.assertEqual(keys.size, 9586)
+        self.assertEqual(keys.hashes, 7)
+
+
+class BuildTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(BuildTests, self).setUp()
+        self.measurements = []
+        self.client.set_instrumentation_callback(self.measurements.extend)
+        self.table = self.create_stub_table('seq')
+        for offset in range(50):
+            self.server.store.tables[self.table].put(utils.marshall(
+                {'id': str(offset), 'seq': offset, 'value': 'x' * 100}))
+
+    @tornado_testing.gen_test
+    def test_build(self):
+        keys = yield bloom.build(self.client, self.table, segments=3)
+        self.assertTrue(keys.ready)
+        self.assertEqual(keys.count, 50)
+        self.assertEqual(keys.key_names, ('id', 'seq'))
+        self.assertIs(self.client._bloom_filters[self.table], keys)
+        del self.measurements[:]
+        result = yield self.client.get_item(
+            self.table, {'id': '1', 'seq': 1})
+        self.assertEqual(result['Item']['value'], 'x' * 100)
+        result = yield self.client.get_item(
+            self.table, {'id': 'missing', 'seq': 1})
+        self.assertIsNone(result)
+        self.assertEqual(len(self.measurements), 1)
+
+    @tornado_testing.gen_test
+    def test_writes_added(self):
+        yield bloom.build(self.client, self.table)
+        yield self.client.put_item(self.table,
+                                   {'id': 'new', 'seq': 1, 'value': 'y'})
+        yield self.client.batch_write_item({self.table: [
+            {'PutRequest': {'Item': {'id': 'batch', 'seq': 2}}}]})
+        result = yield self.client.get_item(
+            self.table, {'id': 'new', 'seq': 1})
+        self.assertEqual(result['Item']['value'], 'y')
+        result = yield self.client.get_item(
+            self.table, {'id': 'batch', 'seq': 2})
+        self.assertEqual(result['Item'], {'id': 'batch', 'seq': 2})
+
+    @tornado_testing.gen_test
+    def test_writes_without_key_attributes(self):
+        keys = yield bloom.build(self.client, self.table)
+        count = keys.count
+        with self.assertRaises(dynamodb.ValidationException):
+            yield self.client.put_item(self.table, {'id': 'new'})
+        self.assertEqual(keys.count, count)
+
+    @tornado_testing.gen_test
+    def test_consistent_reads_not_filtered(self):
+        yield bloom.build(self.client, self.table)
+        self.server.store.tables[self.table].put(
+            utils.marshall({'id': 'other', 'seq': 1}))
+        result = yield self.client.get_item(
+            self.table, {'id': 'other', 'seq': 1}, consistent_read=True)
+        self.assertEqual(result['Item'], {'id': 'other', 'seq': 1})
+
+    @tornado_testing.gen_test
+    def test_statements_disable(self):
+        keys = yield bloom.build(self.client, self.table)
+        with self.assertRaises(dynamodb.DynamoDBException):
+            yield self.client.execute('ExecuteStatement', {
+                'Statement': 'INSERT INTO x VALUE {}'})
+        self.assertFalse(keys.ready)
+        self.assertEqual(
+            [m.action for m in self.measurements][-1], 'ExecuteStatement')
@@ -0,0 +1,334 @@
+import collections
+import time
+import unittest
+
+from tornado import testing as tornado_testing
+
+from sprockets_dynamodb import cache, utils
+from tests import api_tests
+
+
+def query(value, **kwargs):
+    parameters = {
+        'TableName': 'example',
+        'KeyConditionExpression': '#id = :id AND seq > :seq',
+        'ExpressionAttributeNames': {'#id': 'id'},
+        'ExpressionAttributeValues': utils.marshall(
+            {':id': value, ':seq': 1})}
+    parameters.update(kwargs)
+    return parameters
+
+
+def result(*values):
+    return {'Count': len(values), 'ScannedCount': len(values),
+            'Items': [{'id': value} for value in values]}
+
+
+class QueryCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.QueryCache()
+
+    def put(self, parameters, value):
+        self.cache.put(parameters, value, self.cache.generation(
+            parameters['TableName']))
+
+    def test_miss_and_hit(self):
+        self.assertIsNone(self.cache.get(query('a')))
+        self.put(query('a'), result('a'))
+        self.assertEqual(self.cache.get(query('a')), result('a'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_key_is_canonical(self):
+        self.put(query('a'), result('a'))
+        parameters = collections.OrderedDict(
+            reversed(list(query('a').items())))
+        self.assertEqual(self.cache.get(parameters), result('a'))
+        self.assertIsNone(self.cache.get(query('b')))
+        self.assertIsNone(self.cache.get(query('a', Limit=10)))
+
+    def test_hits_return_copies(self):
+        self.put(query('a'), result('a'))
+        self.cache.get(query('a'))['Items'].append({'id': 'x'})
+        self.assertEqual(self.cache.get(query('a')), result('a'))
+
+    def test_puts_store_copies(self):
+        value = result('a')
+        self.put(query('a'), value)
+        del value['Items'][:]
+        value['Count'] = 0
+        self.assertEqual(self.cache.get(query('a')), result('a'))
+
+    def test_ttl(self):
+        self.put(query('a'), result('a'))
+        self.cache._entries[cache._digest(query('a'))].expires = \
+            time.monotonic() - 1
+        self.assertIsNone(self.cache.get(query('a')))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_lru_eviction(self):
+        size = cache._sizeof(result('a'))
+        self.cache.max_size = size * 2
+        self.put(query('a'), result('a'))
+        self.put(query('b'), result('b'))
+        self.cache.get(query('a'))
+        self.put(query('c'), result('c'))
+        self.assertIsNotNone(self.cache.get(query('a')))
+        self.assertIsNone(self.cache.get(query('b')))
+        self.assertIsNotNone(self.cache.get(query('c')))
+        self.assertLessEqual(self.cache.size, self.cache.max_size)
+
+    def test_oversized_results_not_cached(self):
+        self.cache.max_size = 10
+        self.put(query('a'), result('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_in_flight_queries_not_cached(self):
+        generation = self.cache.generation('example')
+        self.cache.invalidate_write('PutItem', {
+            'TableName': 'example', 'Item': utils.marshall({'id': 'z'})})
+        self.cache.put(query('a'), result('a'), generation)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_write_invalidates_partition(self):
+        self.put(query('a'), result('a'))
+        self.put(query('b'), result('b'))
+        self.cache.invalidate_write('UpdateItem', {
+            'TableName': 'example',
+            'Key': utils.marshall({'id': 'a', 'seq': 2})})
+        self.assertIsNone(self.cache.get(query('a')))
+        self.assertIsNotNone(self.cache.get(query('b')))
+
+    def test_put_invalidates_partition(self):
+        self.put(query('a'), result('a'))
+        self.cache.invalidate_write('PutItem', {
+            'TableName': 'example',
+            'Item': utils.marshall({'id': 'a', 'seq': 2, 'value': 'x'})})
+        self.assertIsNone(self.cache.get(query('a')))
+
+    def test_other_tables_not_invalidated(self):
+        self.put(query('a'), result('a'))
+        self.cache.invalidate_write('DeleteItem', {
+            'TableName': 'other', 'Key': utils.marshall({'id': 'a'})})
+        self.assertIsNotNone(self.cache.get(query('a')))
+
+    def test_batch_write_invalidates(self):
+        self.put(query('a'), result('a'))
+        self.put(query('b'), result('b'))
+        self.cache.invalidate_write('BatchWriteItem', {'RequestItems': {
+            'example': [
+                {'DeleteRequest': {'Key': utils.marshall({'id': 'b'})}}]}})
+        self.assertIsNotNone(self.cache.get(query('a')))
+        self.assertIsNone(self.cache.get(query('b')))
+
+    def test_transact_write_invalidates(self):
+        self.put(query('a'), result('a'))
+        self.cache.invalidate_write('TransactWriteItems', {'TransactItems': [
+            {'Put': {'TableName': 'example',
+                     'Item': utils.marshall({'id': 'a'})}}]})
+        self.assertIsNone(self.cache.get(query('a')))
+
+    def test_index_queries_invalidated_by_any_write(self):
+        self.put(query('a', IndexName='by-value'), result('a'))
+        self.cache.invalidate_write('PutItem', {
+            'TableName': 'example', 'Item': utils.marshall({'id': 'z'})})
+        self.assertIsNone(self.cache.get(query('a', IndexName='by-value')))
+
+    def test_invalidate_table(self):
+        self.put(query('a'), result('a'))
+        self.cache.invalidate('example')
+        self.assertEqual(len(self.cache), 0)
+        self.put(query('a'), result('a'))
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_numeric_keys_normalized(self):
+        parameters = query(1)
+        self.put(parameters, result(1))
+        self.cache.invalidate_write('DeleteItem', {
+            'TableName': 'example', 'Key': {'id': {'N': '1.0'}}})
+        self.assertIsNone(self.cache.get(parameters))
+
+    def test_partition_keys(self):
+        self.assertEqual(cache._partition_keys(query('a')),
+                         (cache._partition_key('id', {'S': 'a'}),))
+        self.assertEqual(cache._partition_keys({
+            'KeyConditionExpression': ':id = id',
+            'ExpressionAttributeValues': {':id': {'N': '1.00'}}}),
+            (cache._partition_key('id', {'N': '1'}),))
+        self.assertEqual(cache._partition_keys({'KeyConditions': {}}),
+                         (None,))
+
+
+class ClientQueryCacheTests(api_tests.StubServerTestCase):
+
+    client_kwargs = {'query_cache': True}
+
+    def setUp(self):
+        super(ClientQueryCacheTests, self).setUp()
+        self.measurements = []
+        self.client.set_instrumentation_callback(self.measurements.extend)
+        self.table = self.create_stub_table('seq')
+
+    def query(self, value, **kwargs):
+        return self.client.query(
+            self.table, key_condition_expression='id = :id',
+            expression_attribute_values={':id': value}, **kwargs)
+
+    @tornado_testing.gen_test
+    def test_repeated_queries_cached(self):
+        yield self.client.put_item(self.table, {'id': 'a', 'seq': 1})
+        first = yield self.query('a')
+        second = yield self.query('a')
+        self.assertEqual(first, second)
+        self.assertEqual([m.action for m in self.measurements],
+                         ['PutItem', 'Query'])
+
+    @tornado_testing.gen_test
+    def test_missed_results_not_shared(self):
+        yield self.client.put_item(self.table, {'id': 'a', 'seq': 1})
+        first = yield self.query('a')
+        del first['Items'][:]
+        second = yield self.query('a')
+        self.assertEqual(second['Count'], 1)
+        self.assertEqual(second['Items'], [{'id': 'a', 'seq': 1}])
+
+    @tornado_testing.gen_test
+    def test_writes_invalidate(self):
+        yield self.client.put_item(self.table, {'id': 'a', 'seq': 1})
+        yield self.query('a')
+        yield self.query('b')
+        yield self.client.put_item(self.table, {'id': 'a', 'seq': 2})
+        result = yield self.query('a')
+        self.assertEqual(result['Count'], 2)
+        yield self.query('b')
+        self.assertEqual([m.action for m in self.measurements],
+                         ['PutItem', 'Query', 'Query', 'PutItem', 'Query'])
+
+    @tornado_testing.gen_test
+    def test_consistent_reads_not_cached(self):
+        yield self.query('a', consistent_read=True)
+        yield self.query('a', consistent_read=True)
+        self.assertEqual(len(self.measurements), 2)
+        self.assertEqual(len(self.client.query_cache), 0)
+
+
+class NegativeCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.NegativeCache()
+        self.key = utils.marshall({'id': 'a'})
+
+    def add(self, key, table='example'):
+        self.cache.add(table, key, self.cache.generation(table))
+
+    def test_missing_keys_remembered(self):
+        self.assertNotIn(('example', self.key), self.cache)
+        self.add(self.key)
+        self.assertIn(('example', self.key), self.cache)
+        self.assertNotIn(('other', self.key), self.cache)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_ttl(self):
+        self.add(self.key)
+        for entry in self.cache._entries:
+            self.cache._entries[entry] = time.monotonic() - 1
+        self.assertNotIn(('example', self.key), self.cache)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_max_entries(self):
+        self.cache.max_entries = 2
+        for value in 'abc':
+            self.add(utils.marshall({'id': value}))
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn(('example', self.key), self.cache)
+
+    def test_numbers_normalized(self):
+        self.add({'id': {'N': '1.0'}})
+        self.assertIn(('example', {'id': {'N': '1'}}), self.cache)
+
+    def test_put_invalidates(self):
+        self.add(self.key)
+        self.cache.invalidate_write('PutItem', {
+            'TableName': 'example',
+            'Item': utils.marshall({'id': 'a', 'value': 1})})
+        self.assertNotIn(('example', self.key), self.cache)
+
+    def test_in_flight_lookups_not_remembered(self):
+        generation = self.cache.generation('example')
+        self.cache.invalidate_write('UpdateItem', {
+            'TableName': 'example', 'Key': self.key})
+        self.cache.add('example', self.key, generation)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_read_variants(self):
+        projected = cache.read_variant({
+            'ProjectionExpression': '#v', 'ExpressionAttributeNames': {
+                '#v': 'value'}})
+        self.cache.add('example', self.key,
+                       self.cache.generation('example'), projected)
+        self.assertIn(('example', self.key, projected), self.cache)
+        self.assertNotIn(('example', self.key), self.cache)
+        self.assertNotIn(('example', self.key, cache.read_variant(
+            {'ConsistentRead': True})), self.cache)
+        self.add(self.key)
+        self.cache.invalidate_write('DeleteItem', {
+            'TableName': 'example', 'Key': self.key})
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache._variants, {})
+
+    def test_statements_invalidate_everything(self):
+        self.add(self.key)
+        self.add(self.key, 'other')
+        self.cache.invalidate_write('ExecuteStatement', {'Statement': ''})
+        self.assertEqual(len(self.cache), 0)
+
+
+class ClientNegativeCacheTests(api_tests.StubServerTestCase):
+
+    client_kwargs = {'negative_cache': True}
+
+    def setUp(self):
+        super(ClientNegativeCacheTests, self).setUp()
+        self.measurements = []
+        self.client.set_instrumentation_callback(self.measurements.extend)
+        self.table = self.create_stub_table()
+
+    @tornado_testing.gen_test
+    def test_misses_cached_until_written(self):
+        first = yield self.client.get_item(self.table, {'id': 'a'})
+        second = yield self.client.get_item(self.table, {'id': 'a'})
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.measurements), 1)
+        yield self.client.put_item(self.table, {'id': 'a', 'value': 1})
+        result = yield self.client.get_item(self.table, {'id': 'a'})
+        self.assertEqual(result['Item'], {'id': 'a', 'value': 1})
+        self.assertEqual([m.action for m in self.measurements],
+                         ['GetItem', 'PutItem', 'GetItem'])
+
+    @tornado_testing.gen_test
+    def test_consistent_reads_not_cached(self):
+        yield self.client.get_item(self.table, {'id': 'a'},
+                                   consistent_read=True)
+        yield self.client.get_item(self.table, {'id': 'a'},
+                                   consistent_read=True)
+        self.assertEqual(len(self.measurements), 2)
+
+    @tornado_testing.gen_test
+    def test_projected_misses_not_shared(self):
+        self.server.store.tables[self.table].put({'id': {'S': 'a'}})
+        result = yield self.client.get_item(
+            self.table, {'id': 'a'}, projection_expression='#v',
+            expression_attribute_names={'#v': 'value'})
+        self.assertFalse(result and result.get('Item'))
+        result = yield self.client.get_item(self.table, {'id': 'a'})
+        self.assertEqual(result['Item'], {'id': 'a'})
+        self.assertEqual(len(self.measurements), 2)
+
+    @tornado_testing.gen_test
+    def test_misses_with_capacity(self):
+        result = yield self.client.get_item(
+            self.table, {'id': 'a'}, return_consumed_capacity='TOTAL')
+        self.assertEqual(result['Item'], {})
+        self.assertIn('ConsumedCapacity', result)
@@ -0,0 +1,102 @@
+import unittest
+
+from tornado import testing as tornado_testing
+
+from sprockets_dynamodb import columnar, utils
+from tests import api_tests
+
+ITEMS = [
+    {'id': 'a', 'count': 1, 'active': True, 'tags': {'x'}},
+    {'id': 'b', 'active': False, 'extra': 'late'},
+    {'id': 'c', 'count': 3, 'active': None}
+]
+
+
+class ColumnsTests(unittest.TestCase):
+
+    def columns(self, items, types=None):
+        columns = columnar.Columns(types)
+        columns.extend(utils.marshall(item) for item in items)
+        return columns
+
+    def test_buffers(self):
+        columns = self.columns(ITEMS)
+        self.assertEqual(len(columns), 3)
+        count = columns.columns['count']
+        self.assertEqual(count.kind, columnar.NUMBER)
+        self.assertEqual(list(count.values), [1, 0, 3])
+        self.assertEqual(list(count.mask), [0, 1, 0])
+        active = columns.columns['active']
+        self.assertEqual(active.kind, columnar.BOOL)
+        self.assertEqual(list(active.mask), [0, 0, 1])
+        self.assertEqual(columns.columns['id'].values, ['a', 'b', 'c'])
+        self.assertEqual(columns.columns['extra'].values, [None, 'late'])
+
+    def test_numbers_widen_to_float(self):
+        columns = self.columns([{'n': 1}, {'n': 2.5}, {'n': 2 ** 70}])
+        values = columns.columns['n'].values
+        self.assertEqual(values.typecode, 'd')
+        self.assertEqual(list(values), [1.0, 2.5, float(2 ** 70)])
+
+    def test_mixed_types_become_objects(self):
+        columns = self.columns([{'v': 1}, {}, {'v': 'one'}, {'v': None}])
+        column = columns.columns['v']
+        self.assertEqual(column.kind, columnar.OBJECT)
+        self.assertEqual(column.values, [1, None, 'one', None])
+
+    def test_numbers_become_objects_as_unmarshalled(self):
+        items = [{'v': 1}, {'v': 2.0}, {'v': 2 ** 70 + 1}, {'v': 3},
+                 {'v': None}, {'v': 'one'}]
+        column = self.columns(items).columns['v']
+        expected = [utils.unmarshall(utils.marshall(item))['v']
+                    for item in items]
+        self.assertEqual(column.values, expected)
+        self.assertEqual([type(value) for value in column.values],
+                         [type(value) for value in expected])
+
+    def test_declared_types(self):
+        columns = self.columns([{'id': 'a'}, {'id': 'b', 'n': 1}],
+                               {'n': 'N', 'flag': 'BOOL', 'id': 'S'})
+        self.assertEqual(columns.columns['id'].values, ['a', 'b'])
+        self.assertEqual(list(columns.columns['n'].mask), [1, 0])
+        self.assertEqual(columns.columns['flag'].kind, columnar.BOOL)
+
+    @unittest.skipIf(columnar.numpy is None, 'numpy is not installed')
+    def test_arrays(self):
+        arrays = self.columns(ITEMS).arrays()
+        self.assertEqual(arrays['count'].dtype, columnar.numpy.int64)
+        self.assertEqual(arrays['count'].sum(), 4)
+        self.assertEqual(list(arrays['count'].mask), [False, True, False])
+        self.assertEqual(arrays['active'].tolist(), [True, False, None])
+        self.assertEqual(arrays['id'].dtype, object)
+        self.assertEqual(arrays['extra'].tolist(), [None, 'late', None])
+        self.assertEqual(arrays['tags'][0], {'x'})
+
+
+class ColumnarScanTests(api_tests.StubServerTestCase):
+
+    @tornado_testing.gen_test
+    def test_scan_pages(self):
+        definition = self.generic_table_definition()
+        yield self.client.create_table(definition)
+        for offset in range(25):
+            self.server.store.tables[definition['TableName']].put(
+                utils.marshall({'id': str(offset), 'value': offset}))
+        columns = yield columnar.scan(self.client, definition['TableName'],
+                                      limit=10)
+        self.assertEqual(len(columns), 25)
+        self.assertEqual(sorted(columns.columns['value'].values),
+                         list(range(25)))
+        self.assertEqual(self.server.application.requests['Scan'], 3)
+
+    @tornado_testing.gen_test
+    def test_raw_items(self):
+        definition = self.generic_table_definition()
+        yield self.client.create_table(definition)
+        yield self.client.put_item(definition['TableName'], {'id': 'a'})
+        items = []
+        yield self.client.query(
+            definition['TableName'], key_condition_expression='id = :id',
+            expression_attribute_values={':id': 'a'},
+            item_callback=items.append, raw_items=True)
+        self.assertEqual(items, [{'id': {'S': 'a'}}])
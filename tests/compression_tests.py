@@ -0,0 +1,132 @@
+import base64
+import os
+import unittest
+import zlib
+from unittest import mock
+
+from tornado import testing as tornado_testing
+
+from sprockets_dynamodb import compression, schema, utils
+from tests import api_tests
+
+TEXT = 'All work and no play makes Jack a dull boy. ' * 100
+
+
+class CompressionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.compression = compression.Compression(
+            ['body', 'blob', 'doc', 'flag'], threshold=256, codec='zlib')
+
+    def round_trip(self, item):
+        marshalled = self.compression.compress(utils.marshall(item))
+        return marshalled, utils.unmarshall(marshalled)
+
+    def test_strings(self):
+        marshalled, item = self.round_trip({'id': 'a', 'body': TEXT})
+        self.assertIn('B', marshalled['body'])
+        self.assertEqual(marshalled['id'], {'S': 'a'})
+        self.assertLess(len(marshalled['body']['B']), len(TEXT) / 4)
+        self.assertEqual(item, {'id': 'a', 'body': TEXT})
+
+    def test_binary(self):
+        value = TEXT.encode('utf-8')
+        marshalled, item = self.round_trip({'blob': value})
+        self.assertTrue(base64.b64decode(marshalled['blob']['B']).startswith(
+            compression.MAGIC))
+        self.assertEqual(item, {'blob': value})
+
+    def test_documents(self):
+        value = {'lines': [TEXT[:45]] * 20, 'count': 20, 'tags': {'a', 'b'}}
+        marshalled, item = self.round_trip({'doc': value, 'flag': True})
+        self.assertIn('B', marshalled['doc'])
+        self.assertEqual(marshalled['flag'], {'BOOL': True})
+        self.assertEqual(item, {'doc': value, 'flag': True})
+
+    def test_small_and_other_values_not_compressed(self):
+        values = utils.marshall({'body': 'short', 'other': TEXT})
+        self.assertIs(self.compression.compress(values), values)
+
+    def test_incompressible_values_not_compressed(self):
+        value = os.urandom(512)
+        self.assertIsNone(self.compression.compress_value(
+            utils.marshall({'blob': value})['blob']))
+
+    def test_uncompressed_binary_unchanged(self):
+        value = b'\xffSD'
+        self.assertEqual(utils.unmarshall(utils.marshall({'b': value})),
+                         {'b': value})
+
+    def test_invalid_compressed_values_unchanged(self):
+        for value in (compression.MAGIC + b'zS' + b'not zlib data',
+                      compression.MAGIC + b'zQ' + zlib.compress(b'value'),
+                      compression.MAGIC + b'zS' + zlib.compress(b'\xff'),
+                      compression.MAGIC + b'zJ' + zlib.compress(b'{')):
+            self.assertEqual(utils.unmarshall(utils.marshall({'b': value})),
+                             {'b': value})
+        with self.assertRaises(ValueError):
+            compression.decompress(compression.MAGIC + b'zS' + b'invalid')
+
+    def test_unsupported_codec(self):
+        with self.assertRaises(compression.UnsupportedCodec):
+            compression.Compression(['body'], codec='lzma')
+        data = compression.MAGIC + b'xS' + zlib.compress(b'value')
+        with self.assertRaises(compression.UnsupportedCodec):
+            compression.decompress(data)
+        with self.assertRaises(compression.UnsupportedCodec):
+            utils.unmarshall(utils.marshall({'b': data}))
+
+    def test_zstd_values_require_zstandard(self):
+        data = compression.MAGIC + b'sS' + b'(\xb5/\xfd value'
+        with mock.patch.object(compression, 'zstandard', None):
+            with self.assertRaises(compression.UnsupportedCodec):
+                compression.Compression(['body'], codec='zstd')
+            with self.assertRaises(compression.UnsupportedCodec):
+                utils.unmarshall(utils.marshall({'b': data}))
+
+    def test_default_codec(self):
+        self.assertEqual(compression.Compression(['body']).codec,
+                         compression.ZLIB)
+
+    @unittest.skipIf(compression.zstandard is None, 'zstandard not installed')
+    def test_zstd(self):
+        codec = compression.Compression(['body'], codec='zstd')
+        marshalled = codec.compress(utils.marshall({'body': TEXT}))
+        self.assertEqual(utils.unmarshall(marshalled), {'body': TEXT})
+
+    def test_schema_values_decompressed(self):
+        codec = schema.Schema({'id': 'S', 'body': 'S', 'blob': 'B'})
+        marshalled = self.compression.compress(codec.marshall(
+            {'id': 'a', 'body': TEXT, 'blob': TEXT.encode('utf-8')}))
+        self.assertEqual(codec.unmarshall(marshalled), {
+            'id': 'a', 'body': TEXT, 'blob': TEXT.encode('utf-8')})
+
+
+class ClientCompressionTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(ClientCompressionTests, self).setUp()
+        self.table = self.create_stub_table()
+        self.client.register_compression(
+            self.table, compression.Compression(['body'], codec='zlib'))
+
+    @tornado_testing.gen_test
+    def test_items_compressed(self):
+        yield self.client.put_item(self.table, {'id': 'a', 'body': TEXT})
+        yield self.client.batch_write_item({self.table: [
+            {'PutRequest': {'Item': {'id': 'b', 'body': TEXT}}}]})
+        stored = self.server.store.tables[self.table].items
+        for item in stored.values():
+            self.assertIn('B', item['body'])
+        result = yield self.client.get_item(self.table, {'id': 'a'})
+        self.assertEqual(result['Item'], {'id': 'a', 'body': TEXT})
+        result = yield self.client.scan(self.table)
+        self.assertEqual([item['body'] for item in result['Items']],
+                         [TEXT, TEXT])
+
+    @tornado_testing.gen_test
+    def test_unregister(self):
+        self.client.register_compression(self.table, None)
+        yield self.client.put_item(self.table, {'id': 'a', 'body': TEXT})
+        stored = self.server.store.tables[self.table].items
+        self.assertEqual(list(stored.values())[0]['body'], {'S': TEXT})
@@ -0,0 +1,99 @@
+from unittest import mock
+
+from tornado import gen, testing as tornado_testing
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import counters, utils
+from tests import api_tests
+
+
+class CounterAggregatorTests(api_tests.StubServerTestCase):
+
+    client_kwargs = {'max_retries': 1}
+
+    def setUp(self):
+        super(CounterAggregatorTests, self).setUp()
+        self.measurements = []
+        self.client.set_instrumentation_callback(self.measurements.extend)
+        self.table = self.create_stub_table()
+        self.counters = counters.CounterAggregator(self.client, interval=60)
+
+    def stored(self, value):
+        item = self.server.store.tables[self.table].get(
+            utils.marshall({'id': value}))
+        return utils.unmarshall(item) if item else None
+
+    @tornado_testing.gen_test
+    def test_increments_merged(self):
+        futures = []
+        for _offset in range(10):
+            futures.append(self.counters.increment(
+                self.table, {'id': 'a'}, 'views'))
+        futures.append(self.counters.increment(
+            self.table, {'id': 'a'}, 'bytes', 512))
+        futures.append(self.counters.increment(
+            self.table, {'id': 'b'}, 'views', -2))
+        self.assertEqual(len(self.counters), 2)
+        yield self.counters.flush()
+        yield futures
+        self.assertEqual(self.stored('a'),
+                         {'id': 'a', 'views': 10, 'bytes': 512})
+        self.assertEqual(self.stored('b'), {'id': 'b', 'views': -2})
+        self.assertEqual([m.action for m in self.measurements],
+                         ['UpdateItem', 'UpdateItem'])
+        self.assertEqual(len(self.counters), 0)
+
+    @tornado_testing.gen_test
+    def test_flushes_accumulate(self):
+        for _offset in range(2):
+            self.counters.increment(self.table, {'id': 'a'}, 'views', 3)
+            yield self.counters.flush()
+        self.assertEqual(self.stored('a')['views'], 6)
+
+    @tornado_testing.gen_test
+    def test_net_zero_not_written(self):
+        future = self.counters.increment(self.table, {'id': 'a'}, 'views')
+        self.counters.increment(self.table, {'id': 'a'}, 'views', -1)
+        yield self.counters.flush()
+        yield future
+        self.assertEqual(self.measurements, [])
+
+    @tornado_testing.gen_test
+    def test_max_pending_flushes(self):
+        self.counters.max_pending = 3
+        futures = [self.counters.increment(self.table, {'id': 'a'}, 'views')
+                   for _offset in range(3)]
+        yield futures
+        self.assertEqual(self.stored('a')['views'], 3)
+
+    @tornado_testing.gen_test
+    def test_interval_flushes_and_stop(self):
+        self.counters.interval = 0.01
+        self.counters.start()
+        yield self.counters.increment(self.table, {'id': 'a'}, 'views')
+        self.counters.increment(self.table, {'id': 'a'}, 'views')
+        yield self.counters.stop()
+        self.assertEqual(self.stored('a')['views'], 2)
+        self.assertIsNone(self.counters._callback)
+
+    @tornado_testing.gen_test
+    def test_concurrent_flushes_are_ordered(self):
+        self.counters.increment(self.table, {'id': 'a'}, 'views')
+        first = self.counters.flush()
+        self.counters.increment(self.table, {'id': 'a'}, 'views')
+        second = self.counters.flush()
+        self.assertIs(self.counters.flush(), second)
+        yield [first, second]
+        self.assertEqual(self.stored('a')['views'], 2)
+
+    @tornado_testing.gen_test
+    def test_failures_resolve_futures(self):
+        self.server.application.inject_error(
+            'UpdateItem', 'ValidationException')
+        future = self.counters.increment(self.table, {'id': 'a'}, 'views')
+        with mock.patch.object(counters.LOGGER, 'error') as error:
+            yield self.counters.flush()
+        self.assertTrue(error.called)
+        with self.assertRaises(dynamodb.ValidationException):
+            yield future
+        yield gen.moment
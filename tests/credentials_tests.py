@@ -0,0 +1,193 @@
+import os
+import time
+from unittest import mock
+
+from tornado import concurrent, gen, testing
+from tornado_aws import config
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import credentials, exceptions
+
+
+class FakeAuthorization(object):
+
+    def __init__(self, access_key='ACCESS', expiration=None):
+        self._access_key = access_key
+        self._expiration = expiration
+        self.local_credentials = False
+        self.pending = []
+        self.resets = 0
+
+    @property
+    def access_key(self):
+        return self._access_key
+
+    @property
+    def secret_key(self):
+        return 'SECRET' if self._access_key else None
+
+    @property
+    def security_token(self):
+        return None
+
+    def needs_credentials(self):
+        return not self._access_key
+
+    def refresh(self):
+        self.pending.append(concurrent.Future())
+        return self.pending[-1]
+
+    def reset(self):
+        self.resets += 1
+        self._access_key = None
+
+    def complete(self, access_key, expiration=None):
+        self._access_key = access_key
+        self._expiration = expiration
+        self.pending.pop(0).set_result(True)
+
+
+def expires_in(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                         time.gmtime(time.time() + seconds))
+
+
+class CredentialProviderTests(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(CredentialProviderTests, self).setUp()
+        self.authorization = FakeAuthorization(expiration=expires_in(3600))
+        self.provider = credentials.CredentialProvider(self.authorization)
+
+    def tearDown(self):
+        self.provider.stop()
+        super(CredentialProviderTests, self).tearDown()
+
+    def test_refresh_scheduled_before_expiration(self):
+        self.assertAlmostEqual(self.provider._refresh_delay(),
+                               3600 - self.provider.REFRESH_MARGIN, delta=5)
+
+    def test_refresh_interval_without_expiration(self):
+        self.authorization._expiration = None
+        self.assertEqual(self.provider._refresh_delay(),
+                         self.provider.REFRESH_INTERVAL)
+
+    def test_refresh_retried_when_expiration_is_close(self):
+        self.authorization._expiration = expires_in(10)
+        self.assertEqual(self.provider._refresh_delay(),
+                         self.provider.RETRY_INTERVAL)
+
+    @testing.gen_test
+    def test_concurrent_refreshes_are_collapsed(self):
+        first = self.provider.refresh()
+        second = self.provider.refresh()
+        self.assertIs(first, second)
+        self.assertEqual(len(self.authorization.pending), 1)
+        self.assertFalse(self.provider.needs_credentials())
+        self.authorization.complete('ROTATED', expires_in(7200))
+        yield first
+        self.assertEqual(self.provider.access_key, 'ROTATED')
+        self.assertIsNotNone(self.provider._timeout)
+        self.assertIsNot(self.provider.refresh(), first)
+
+    @testing.gen_test
+    def test_reset_during_refresh_keeps_credentials(self):
+        future = self.provider.refresh()
+        self.provider.reset()
+        self.assertEqual(self.authorization.resets, 0)
+        self.authorization.complete('ROTATED')
+        yield future
+        self.provider.reset()
+        self.assertTrue(self.provider.needs_credentials())
+
+    @testing.gen_test
+    def test_failed_refresh_is_retried(self):
+        self.authorization.refresh = mock.Mock(
+            side_effect=exceptions.NoCredentialsError)
+        with mock.patch.object(self.provider, '_schedule') as schedule:
+            with self.assertRaises(exceptions.NoCredentialsError):
+                yield self.provider.refresh()
+            schedule.assert_called_once_with(self.provider.RETRY_INTERVAL)
+        self.assertEqual(self.provider.access_key, 'ACCESS')
+
+    @testing.gen_test
+    def test_start_loads_missing_credentials(self):
+        self.authorization._access_key = None
+        self.provider.start()
+        yield gen.moment
+        self.assertEqual(len(self.authorization.pending), 1)
+        self.authorization.complete('LOADED')
+        yield self.provider._refreshing
+        self.assertFalse(self.provider.needs_credentials())
+
+
+class StaticCredentialsTests(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(StaticCredentialsTests, self).setUp()
+        environ = {key: value for key, value in os.environ.items()
+                   if not key.startswith('AWS_')}
+        environ['AWS_SHARED_CREDENTIALS_FILE'] = '/nonexistent'
+        patcher = mock.patch.dict(os.environ, environ, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.provider = credentials.CredentialProvider(config.Authorization(
+            'default', access_key='EXPLICIT', secret_key='SECRET'))
+
+    def test_not_scheduled(self):
+        self.assertTrue(self.provider.static)
+        self.assertIsNone(self.provider.expiration)
+        self.provider.start()
+        self.assertIsNone(self.provider._timeout)
+
+    @testing.gen_test
+    def test_explicit_keys_survive_refresh(self):
+        yield self.provider._refresh()
+        self.provider.reset()
+        yield self.provider.refresh()
+        self.assertEqual(self.provider.access_key, 'EXPLICIT')
+        self.assertEqual(self.provider.secret_key, 'SECRET')
+        self.assertFalse(self.provider.needs_credentials())
+        self.assertIsNone(self.provider._timeout)
+
+
+class ClientCredentialsTests(testing.AsyncTestCase):
+
+    def test_client_uses_provider(self):
+        client = dynamodb.Client()
+        self.assertIsInstance(client._client._auth_config,
+                              credentials.CredentialProvider)
+        self.assertTrue(client._credentials.static)
+        self.assertIsNone(client._credentials._timeout)
+
+    @testing.gen_test
+    def test_close_stops_refresh(self):
+        authorization = FakeAuthorization(expiration=expires_in(3600))
+        with mock.patch('tornado_aws.config.Authorization') as factory:
+            factory.return_value = authorization
+            client = dynamodb.Client()
+        self.assertIsNotNone(client._credentials._timeout)
+        with mock.patch.object(client._client, 'close') as close:
+            client.close()
+            close.assert_called_once_with()
+        self.assertIsNone(client._credentials._timeout)
+        client._credentials._on_timeout()
+        self.assertEqual(authorization.pending, [])
+        authorization._access_key = None
+        future = client._credentials.refresh()
+        authorization.complete('LOADED', expires_in(3600))
+        yield future
+        self.assertIsNone(client._credentials._timeout)
+
+    def test_close_closes_endpoint_clients(self):
+        client = dynamodb.Client(endpoints=['http://127.0.0.1:1',
+                                            'http://127.0.0.1:2'])
+        with mock.patch('tornado_aws.client.AsyncAWSClient.close') as close:
+            client.close()
+        self.assertEqual(close.call_count, 2)
+
+    def test_refresh_disabled(self):
+        client = dynamodb.Client(refresh_credentials=False)
+        self.assertIsNone(client._credentials)
+        self.assertNotIsInstance(client._client._auth_config,
+                                 credentials.CredentialProvider)
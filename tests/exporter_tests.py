@@ -0,0 +1,142 @@
+import base64
+import glob
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from tornado import gen, testing as tornado_testing
+
+from sprockets_dynamodb import exporter, utils
+from tests import api_tests
+
+
+class ExporterTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(ExporterTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.table = self.create_stub_table()
+        self.items = [{'id': str(offset), 'value': offset, 'tags': {'a'},
+                       'blob': b'\x00'} for offset in range(60)]
+        for item in self.items:
+            self.server.store.tables[self.table].put(utils.marshall(item))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(ExporterTests, self).tearDown()
+
+    def read(self, decode=None, pattern='*.ndjson*'):
+        items = []
+        for path in glob.glob(os.path.join(self.path, pattern)):
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt') as handle:
+                items.extend((decode or dict)(json.loads(line))
+                             for line in handle)
+        return sorted(items, key=lambda item: int(item['id']))
+
+    @tornado_testing.gen_test
+    def test_export(self):
+        progress = []
+        export = exporter.Exporter(self.client, self.table, self.path,
+                                   segments=3, limit=7,
+                                   progress_callback=progress.append)
+        result = yield export.run()
+        self.assertEqual(result.items, 60)
+        self.assertEqual(result.segments_done, 3)
+        self.assertGreater(result.read_units, 0)
+        self.assertEqual(progress[-1].items, 60)
+        self.assertEqual(
+            len(glob.glob(os.path.join(self.path, '*.ndjson'))), 3)
+        self.assertEqual(self.read(), [
+            {'id': item['id'], 'value': item['value'], 'tags': ['a'],
+             'blob': base64.b64encode(b'\x00').decode('ascii')}
+            for item in self.items])
+
+    @tornado_testing.gen_test
+    def test_compressed_rolled_files(self):
+        export = exporter.Exporter(self.client, self.table, self.path,
+                                   segments=2, compress=True, limit=5,
+                                   max_file_size=100, raw_items=True)
+        yield export.run()
+        self.assertGreater(
+            len(glob.glob(os.path.join(self.path, '*.ndjson.gz'))), 2)
+        self.assertEqual(self.read(utils.unmarshall), self.items)
+
+    @tornado_testing.gen_test
+    def test_resume_from_checkpoint(self):
+        pages = []
+
+        def fail_after_two_pages(progress):
+            pages.append(progress)
+            if len(pages) == 2:
+                raise RuntimeError('interrupted')
+
+        export = exporter.Exporter(self.client, self.table, self.path,
+                                   segments=1, limit=10, compress=True,
+                                   progress_callback=fail_after_two_pages)
+        with self.assertRaises(RuntimeError):
+            yield export.run()
+        path, = glob.glob(os.path.join(self.path, '*.gz'))
+        with open(path, 'ab') as handle:
+            handle.write(b'partial page')
+        export = exporter.Exporter(self.client, self.table, self.path,
+                                   segments=1, limit=10, compress=True)
+        result = yield export.run()
+        self.assertEqual(result.items, 40)
+        self.assertEqual([item['id'] for item in self.read()],
+                         [item['id'] for item in self.items])
+        result = yield export.run()
+        self.assertEqual(result.items, 0)
+
+    @tornado_testing.gen_test
+    def test_files_written_on_executor(self):
+        executor = api_tests.CountingExecutor()
+        self.addCleanup(executor.shutdown)
+        yield exporter.Exporter(self.client, self.table, self.path,
+                                segments=2, limit=20, compress=True,
+                                executor=executor).run()
+        self.assertGreater(executor.submitted, 4)
+        self.assertEqual(len(self.read()), 60)
+
+    @tornado_testing.gen_test
+    def test_failed_segment_stops_others(self):
+        scans = []
+        scan = self.client.scan
+
+        def fail_segment(table_name, **kwargs):
+            scans.append(kwargs['segment'])
+            if kwargs['segment'] == 0:
+                raise RuntimeError('failed')
+            return scan(table_name, **kwargs)
+
+        export = exporter.Exporter(self.client, self.table, self.path,
+                                   segments=2, limit=5)
+        with mock.patch.object(self.client, 'scan', fail_segment):
+            with self.assertRaises(RuntimeError):
+                yield export.run()
+            count = len(scans)
+            yield gen.sleep(0.05)
+        self.assertEqual(len(scans), count)
+        self.assertEqual(scans.count(1), 1)
+        self.assertEqual(export.progress().segments_done, 0)
+
+    @tornado_testing.gen_test
+    def test_checkpoint_settings_mismatch(self):
+        yield exporter.Exporter(self.client, self.table, self.path,
+                                segments=2).run()
+        with self.assertRaises(ValueError):
+            yield exporter.Exporter(self.client, self.table, self.path,
+                                    segments=3).run()
+
+    @tornado_testing.gen_test
+    def test_read_capacity_limit(self):
+        export = exporter.Exporter(self.client, self.table, self.path,
+                                   segments=1, limit=10, read_capacity=1)
+        with mock.patch('tornado.gen.sleep',
+                        side_effect=lambda delay: gen.moment
+                        ) as sleep:
+            yield export.run()
+        self.assertTrue(sleep.called)
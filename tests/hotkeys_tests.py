@@ -0,0 +1,154 @@
+import time
+import unittest
+
+from tornado import testing as tornado_testing
+
+from sprockets_dynamodb import hotkeys, utils
+from tests import api_tests
+
+
+class CountMinSketchTests(unittest.TestCase):
+
+    def test_estimates_never_undercount(self):
+        sketch = hotkeys.CountMinSketch(width=64, depth=3)
+        for value in range(1000):
+            sketch.add(hash(str(value)), value % 7)
+        for value in range(1000):
+            self.assertGreaterEqual(sketch.estimate(hash(str(value))),
+                                    value % 7)
+
+    def test_add_returns_estimate(self):
+        sketch = hotkeys.CountMinSketch()
+        sketch.add(1)
+        self.assertEqual(sketch.add(1, 2), 3)
+        self.assertEqual(sketch.estimate(1), 3)
+
+    def test_decay(self):
+        sketch = hotkeys.CountMinSketch()
+        sketch.add(1, 9)
+        sketch.decay()
+        self.assertEqual(sketch.estimate(1), 4)
+
+
+class HotKeyTrackerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = hotkeys.HotKeyTracker(top=3, window=None)
+
+    def record(self, key, count, throttled=False, table='example'):
+        for _offset in range(count):
+            self.tracker.record(table, utils.marshall({'id': key}),
+                                throttled)
+
+    def test_top_keys(self):
+        for offset in range(50):
+            self.record('cold-{}'.format(offset), 1)
+        self.record('hot', 100)
+        self.record('warm', 40)
+        self.record('tepid', 10)
+        self.assertEqual(
+            [(hot_key.key, hot_key.requests)
+             for hot_key in self.tracker.top('example')],
+            [({'id': 'hot'}, 100), ({'id': 'warm'}, 40),
+             ({'id': 'tepid'}, 10)])
+        self.assertEqual(len(self.tracker.top('example', 1)), 1)
+
+    def test_heap_bounded(self):
+        for offset in range(1000):
+            self.record(str(offset % 20), offset % 20 + 1)
+        self.assertEqual(len(self.tracker._tables['example'].top), 3)
+        self.assertLessEqual(len(self.tracker._tables['example'].heap), 12)
+
+    def test_throttle_rate(self):
+        self.record('hot', 10)
+        self.record('hot', 4, True)
+        hot_key = self.tracker.top('example')[0]
+        self.assertEqual(hot_key.throttles, 4)
+        self.assertAlmostEqual(hot_key.throttle_rate, 0.4)
+
+    def test_tables_are_separate(self):
+        self.record('hot', 5)
+        self.record('other', 2, table='other')
+        self.assertEqual(
+            [hot_key.key for hot_key in self.tracker.top('other')],
+            [{'id': 'other'}])
+        self.assertEqual(self.tracker.top('missing'), [])
+
+    def test_window_decay(self):
+        tracker = hotkeys.HotKeyTracker(window=60)
+        for _offset in range(10):
+            tracker.record('example', utils.marshall({'id': 'hot'}))
+        tracker._tables['example'].decayed -= 61
+        tracker.record('example', utils.marshall({'id': 'hot'}))
+        self.assertEqual(tracker.top('example')[0].requests, 6)
+
+    def test_report_interval(self):
+        tracker = hotkeys.HotKeyTracker(report_interval=60)
+        self.assertEqual(tracker.report('example'), ())
+        tracker.record('example', utils.marshall({'id': 'hot'}))
+        self.assertEqual(tracker.report('example'), ())
+        tracker._tables['example'].reported = time.monotonic() - 61
+        self.assertEqual(len(tracker.report('example')), 1)
+        self.assertEqual(tracker.report('example'), ())
+
+    def test_reset(self):
+        self.record('hot', 5)
+        self.tracker.reset('example')
+        self.assertEqual(self.tracker.top('example'), [])
+
+    def test_item_key(self):
+        item = utils.marshall({'id': 'a', 'value': 1})
+        self.assertIsNone(self.tracker.item_key(
+            {'TableName': 'example', 'Item': item}))
+        key = utils.marshall({'id': 'a'})
+        self.assertEqual(self.tracker.item_key(
+            {'TableName': 'example', 'Key': key}), ('example', key))
+        self.assertEqual(self.tracker.item_key(
+            {'TableName': 'example', 'Item': item}), ('example', key))
+
+
+class ClientHotKeyTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(ClientHotKeyTests, self).setUp()
+        self.measurements = []
+        self.client.set_instrumentation_callback(self.measurements.extend)
+        self.table = self.create_stub_table()
+
+    def get_client(self):
+        self.client_kwargs = {
+            'max_retries': 2,
+            'hot_keys': hotkeys.HotKeyTracker(report_interval=0)}
+        return super(ClientHotKeyTests, self).get_client()
+
+    @tornado_testing.gen_test
+    def test_keys_tracked(self):
+        yield self.client.get_item(self.table, {'id': 'a'})
+        for _offset in range(3):
+            yield self.client.put_item(self.table, {'id': 'a', 'value': 1})
+        yield self.client.update_item(
+            self.table, {'id': 'b'}, update_expression='SET #v = :v',
+            expression_attribute_names={'#v': 'value'},
+            expression_attribute_values={':v': 2})
+        yield self.client.delete_item(self.table, {'id': 'b'})
+        self.assertEqual(
+            [(hot_key.key, hot_key.requests)
+             for hot_key in self.client.hot_keys.top(self.table)],
+            [({'id': 'a'}, 4), ({'id': 'b'}, 2)])
+        self.assertEqual(self.measurements[-1].hot_keys,
+                         tuple(self.client.hot_keys.top(self.table)))
+
+    @tornado_testing.gen_test
+    def test_throttles_tracked(self):
+        self.server.application.inject_error(
+            'GetItem', 'ProvisionedThroughputExceededException')
+        yield self.client.get_item(self.table, {'id': 'a'})
+        hot_key = self.client.hot_keys.top(self.table)[0]
+        self.assertEqual((hot_key.requests, hot_key.throttles), (2, 1))
+        self.assertEqual(hot_key.throttle_rate, 0.5)
+
+    @tornado_testing.gen_test
+    def test_other_actions_not_tracked(self):
+        yield self.client.scan(self.table)
+        self.assertEqual(self.client.hot_keys.top(self.table), [])
+        self.assertEqual(self.measurements[-1].hot_keys, ())
@@ -0,0 +1,156 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from tornado import testing as tornado_testing
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import exporter, importer, utils
+from tests import api_tests
+
+
+class ImporterTests(api_tests.StubServerTestCase):
+
+    server_kwargs = {'seed': 1}
+
+    def setUp(self):
+        super(ImporterTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.table = self.create_stub_table()
+        self.items = [{'id': str(offset), 'value': offset, 'flag': True}
+                      for offset in range(60)]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(ImporterTests, self).tearDown()
+
+    def write(self, name, lines, opener=open):
+        path = os.path.join(self.path, name)
+        with opener(path, 'wt') as handle:
+            handle.writelines(line + '\n' for line in lines)
+        return path
+
+    def stored(self):
+        items = self.server.store.tables[self.table].items.values()
+        return sorted((utils.unmarshall(item) for item in items),
+                      key=lambda item: (not item['id'].isdigit(),
+                                        item['id'].zfill(8)))
+
+    @tornado_testing.gen_test
+    def test_ndjson(self):
+        path = self.write('items.ndjson',
+                          [json.dumps(item) for item in self.items] + [''])
+        progress = []
+        result = yield importer.Importer(
+            self.client, self.table, path, concurrency=2,
+            progress_callback=progress.append).run()
+        self.assertEqual(result.items, 60)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(result.bytes, os.path.getsize(path))
+        self.assertGreater(result.write_units, 0)
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(self.stored(), self.items)
+        self.assertEqual(
+            self.server.application.requests['BatchWriteItem'], 3)
+
+    @tornado_testing.gen_test
+    def test_csv(self):
+        path = self.write('items.csv', ['id,value,flag,note'] + [
+            '{},{},{},'.format(item['id'], item['value'], 'true')
+            for item in self.items] + ['x,1,false,"multi\nline"'])
+        yield importer.Importer(
+            self.client, self.table, path,
+            types={'value': 'N', 'flag': 'BOOL'}).run()
+        stored = self.stored()
+        self.assertEqual(stored[:-1], self.items)
+        self.assertEqual(stored[-1], {'id': 'x', 'value': 1, 'flag': False,
+                                      'note': 'multi\nline'})
+
+    @tornado_testing.gen_test
+    def test_exported_attribute_values(self):
+        for item in self.items:
+            self.server.store.tables[self.table].put(utils.marshall(item))
+        yield exporter.Exporter(self.client, self.table, self.path,
+                                segments=1, compress=True,
+                                raw_items=True).run()
+        self.server.store.tables[self.table].items.clear()
+        path = os.path.join(self.path, '{}-0000-0000.ndjson.gz'.format(
+            self.table))
+        yield importer.Importer(self.client, self.table, path,
+                                raw_items=True).run()
+        self.assertEqual(self.stored(), self.items)
+
+    @tornado_testing.gen_test
+    def test_unprocessed_items_are_retried(self):
+        self.server.application.unprocessed_rate = 0.5
+        path = self.write('items.ndjson',
+                          [json.dumps(item) for item in self.items],
+                          gzip.open)
+        path, compressed = path + '.gz', path
+        os.rename(compressed, path)
+        with mock.patch.object(importer.Importer, 'RETRY_DELAY', 0):
+            result = yield importer.Importer(self.client, self.table,
+                                             path).run()
+        self.assertGreater(result.retries, 0)
+        self.assertEqual(self.stored(), self.items)
+
+    @tornado_testing.gen_test
+    def test_unprocessed_retries_exhausted(self):
+        self.server.application.unprocessed_rate = 1.0
+        path = self.write('items.ndjson', [json.dumps(self.items[0])])
+        with mock.patch.object(importer.Importer, 'RETRY_DELAY', 0):
+            with self.assertRaises(dynamodb.ThroughputExceeded):
+                yield importer.Importer(self.client, self.table, path,
+                                        max_retries=2).run()
+        self.assertEqual(
+            self.server.application.requests['BatchWriteItem'], 3)
+
+    @tornado_testing.gen_test
+    def test_batches_split_by_size(self):
+        path = self.write('items.ndjson',
+                          [json.dumps(item) for item in self.items])
+        size = max(utils.item_size(item) for item in self.items)
+        with mock.patch.object(utils, 'MAX_BATCH_WRITE_SIZE', size * 10):
+            result = yield importer.Importer(self.client, self.table,
+                                             path).run()
+        self.assertEqual(result.batches, 6)
+        self.assertEqual(self.stored(), self.items)
+
+    @tornado_testing.gen_test
+    def test_oversized_items_rejected(self):
+        path = self.write('items.ndjson', [json.dumps(
+            {'id': 'big', 'value': 'x' * utils.MAX_ITEM_SIZE})])
+        with self.assertRaises(dynamodb.ValidationException):
+            yield importer.Importer(self.client, self.table, path).run()
+        self.assertEqual(
+            self.server.application.requests['BatchWriteItem'], 0)
+
+    @tornado_testing.gen_test
+    def test_write_capacity_charged_in_advance(self):
+        path = self.write('items.ndjson',
+                          [json.dumps(item) for item in self.items])
+        charged = []
+        delay = utils.CapacityLimiter.delay
+
+        def record(limiter, units):
+            charged.append(units)
+            return delay(limiter, units)
+
+        with mock.patch.object(utils.CapacityLimiter, 'delay', record):
+            result = yield importer.Importer(self.client, self.table, path,
+                                             write_capacity=10000).run()
+        self.assertEqual(charged[0], 25.0)
+        self.assertAlmostEqual(sum(charged), result.write_units)
+
+    @tornado_testing.gen_test
+    def test_empty_file(self):
+        path = self.write('items.ndjson', [])
+        result = yield importer.Importer(self.client, self.table, path).run()
+        self.assertEqual(result.items, 0)
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            importer.Importer(self.client, self.table, 'items.xml')
@@ -1,9 +1,16 @@
+import contextvars
+import json
+import logging
 import os
 import unittest
+import uuid
+from unittest import mock
 
-from tornado import web
+from tornado import gen, testing as tornado_testing, web
 
-from sprockets_dynamodb import exceptions, mixin
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import client, exceptions, mixin, testing, utils
+from tests import api_tests
 
 
 class NoCredentials429TestCase(unittest.TestCase):
@@ -56,3 +63,236 @@ class MixinExceptionTestCase(unittest.TestCase):
             self.mixin._on_dynamodb_exception(error)
         except web.HTTPError as error:
             self.assertEqual(error.status_code, 429)
+
+
+class CapacityTallyTestCase(unittest.TestCase):
+
+    MEASUREMENTS = [client.Measurement(
+        1.0, 'Query', 'foo', 1, 0.1, None,
+        (client.Capacity('foo', None, 1.0, 0.0),
+         client.Capacity('foo', 'bar', 0.5, 0.0)))]
+
+    @staticmethod
+    def handler(tally):
+        # Tornado executes each request in a task with a copy of the context
+        class Handler(mixin.DynamoDBMixin, web.RequestHandler):
+            DYNAMODB_CAPACITY_TALLY = tally
+
+        handler = Handler.__new__(Handler)
+        handler.application = mock.Mock()
+        handler.context = contextvars.copy_context()
+        handler.context.run(handler.initialize)
+        return handler
+
+    def record(self, handler):
+        handler.context.run(mixin.DynamoDBMixin._record_dynamodb_execution,
+                            self.MEASUREMENTS)
+
+    def test_capacity_is_tallied(self):
+        handler = self.handler(True)
+        callback = handler.application.dynamodb.set_instrumentation_callback
+        callback.assert_called_once_with(handler._record_dynamodb_execution)
+        self.record(handler)
+        self.record(handler)
+        self.assertEqual(handler.dynamodb_read_units[('foo', None)], 2.0)
+        self.assertEqual(handler.dynamodb_read_units[('foo', 'bar')], 1.0)
+        self.assertEqual(handler.dynamodb_write_units[('foo', None)], 0.0)
+
+    def test_capacity_is_not_tallied_by_default(self):
+        handler = self.handler(False)
+        self.assertFalse(
+            handler.application.dynamodb.set_instrumentation_callback.called)
+        self.assertIsNone(handler.context.run(mixin._CAPACITY_TALLY.get))
+        self.record(handler)
+        self.assertEqual(handler.dynamodb_read_units, {})
+        self.assertEqual(handler.dynamodb_write_units, {})
+
+    def test_handlers_tallied_separately(self):
+        first, second, other = (
+            self.handler(True), self.handler(True), self.handler(False))
+        self.record(first)
+        self.record(other)
+        self.assertEqual(first.dynamodb_read_units[('foo', None)], 1.0)
+        self.assertEqual(second.dynamodb_read_units, {})
+        self.assertEqual(other.dynamodb_read_units, {})
+
+
+class RequestScopeTestCase(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(RequestScopeTestCase, self).setUp()
+        self.measurements = []
+        self.client.set_instrumentation_callback(self.measurements.extend)
+        self.scope = mixin.RequestScope(self.client)
+        self.table = self.create_stub_table()
+        for value in 'abc':
+            self.server.store.tables[self.table].put(
+                {'id': {'S': value}, 'value': {'N': '1'}})
+
+    def actions(self):
+        return [measurement.action for measurement in self.measurements]
+
+    @tornado_testing.gen_test
+    def test_concurrent_gets_batched(self):
+        results = yield [self.scope.get_item(self.table, {'id': value})
+                         for value in 'abcd']
+        self.assertEqual([result and result['Item']['id']
+                          for result in results], ['a', 'b', 'c', None])
+        self.assertEqual(self.actions(), ['BatchGetItem'])
+        self.assertEqual(self.scope.stats['batches'], 1)
+
+    @tornado_testing.gen_test
+    def test_gets_memoized(self):
+        first = yield self.scope.get_item(self.table, {'id': 'a'})
+        second = yield self.scope.get_item(self.table, {'id': 'a'})
+        self.assertIs(first, second)
+        yield self.scope.get_item(self.table, {'id': 'a'},
+                                  consistent_read=True)
+        self.assertEqual(self.actions(), ['GetItem', 'GetItem'])
+        self.assertEqual(
+            (self.scope.stats['calls'], self.scope.stats['hits'],
+             self.scope.stats['requests']), (3, 1, 2))
+        self.assertGreater(self.scope.stats['duration'], 0)
+
+    @tornado_testing.gen_test
+    def test_queries_memoized(self):
+        for _offset in range(2):
+            result = yield self.scope.query(
+                self.table, key_condition_expression='id = :id',
+                expression_attribute_values={':id': 'a'})
+            self.assertEqual(result['Count'], 1)
+        self.assertEqual(self.actions(), ['Query'])
+
+    @tornado_testing.gen_test
+    def test_writes_forget_reads(self):
+        yield self.scope.get_item(self.table, {'id': 'a'})
+        yield self.scope.put_item(self.table, {'id': 'a', 'value': 2})
+        result = yield self.scope.get_item(self.table, {'id': 'a'})
+        self.assertEqual(result['Item']['value'], 2)
+        self.assertEqual(self.actions(), ['GetItem', 'PutItem', 'GetItem'])
+
+    @tornado_testing.gen_test
+    def test_passthrough_writes_forget_reads(self):
+        writes = [
+            lambda value: self.scope.batch_write_item({self.table: [
+                {'PutRequest': {'Item': {'id': 'a', 'value': value}}}]}),
+            lambda value: self.scope.execute('PutItem', {
+                'TableName': self.table,
+                'Item': utils.marshall({'id': 'a', 'value': value})}),
+            lambda value: self.scope.execute('BatchWriteItem', {
+                'RequestItems': {self.table: [{'PutRequest': {
+                    'Item': utils.marshall({'id': 'a', 'value': value})}}]}})]
+        for value, write in enumerate(writes, 2):
+            yield self.scope.get_item(self.table, {'id': 'a'})
+            yield write(value)
+            result = yield self.scope.get_item(self.table, {'id': 'a'})
+            self.assertEqual(result['Item']['value'], value)
+
+    def test_write_tables(self):
+        self.assertEqual(mixin._write_tables({'TransactItems': [
+            {'Put': {'TableName': 'a'}}, {'Delete': {'TableName': 'b'}},
+            {'ConditionCheck': {'TableName': 'a'}}]}), {'a', 'b'})
+        self.assertEqual(mixin._write_tables({'Statement': 'UPDATE a'}),
+                         set())
+
+    @tornado_testing.gen_test
+    def test_unknown_writes_forget_every_read(self):
+        yield self.scope.get_item(self.table, {'id': 'a'})
+        self.scope._forget(mixin._write_tables({'Statement': 'UPDATE a'}))
+        self.assertEqual(self.scope._memo, {})
+
+    @tornado_testing.gen_test
+    def test_failures_not_memoized(self):
+        self.server.application.inject_error(
+            'BatchGetItem', 'ValidationException')
+        with self.assertRaises(exceptions.ValidationException):
+            yield [self.scope.get_item(self.table, {'id': value})
+                   for value in 'ab']
+        results = yield [self.scope.get_item(self.table, {'id': value})
+                         for value in 'ab']
+        self.assertEqual(len(results), 2)
+
+    def test_client_methods_passed_through(self):
+        self.assertEqual(self.scope.describe_table,
+                         self.client.describe_table)
+
+    def test_summary_logged(self):
+
+        class Handler(mixin.DynamoDBMixin, web.RequestHandler):
+            pass
+
+        handler = Handler.__new__(Handler)
+        handler.application = mock.Mock()
+        handler.initialize()
+        with self.assertLogs(mixin.LOGGER, logging.DEBUG) as logs:
+            handler.dynamodb.stats.update(calls=2, hits=1, requests=1)
+            handler.on_finish()
+        self.assertIn('2 calls, 1 cache hits, 1 requests', logs.output[0])
+
+
+class StreamHandler(mixin.DynamoDBMixin, web.RequestHandler):
+
+    @gen.coroutine
+    def get(self, action):
+        count = yield self.stream_dynamodb_items(
+            action, self.application.settings['table'],
+            ndjson=self.get_argument('ndjson', None) is not None,
+            limit=2)
+        self.application.settings['counts'].append(count)
+
+
+class StreamItemsTestCase(tornado_testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        self.server = testing.StubServer()
+        self.table = str(uuid.uuid4())
+        self.counts = []
+        super(StreamItemsTestCase, self).setUp()
+        self.server.store.create_table({
+            'TableName': self.table,
+            'AttributeDefinitions': [
+                {'AttributeName': 'id', 'AttributeType': 'S'}],
+            'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}]})
+
+    def tearDown(self):
+        self.server.stop()
+        super(StreamItemsTestCase, self).tearDown()
+
+    def get_app(self):
+        application = web.Application(
+            [(r'/(\w+)', StreamHandler)], table=self.table,
+            counts=self.counts)
+        application.dynamodb = dynamodb.Client(endpoint=self.server.start())
+        return application
+
+    def put(self, *values):
+        for value in values:
+            self.server.store.tables[self.table].put(
+                {'id': {'S': value}, 'data': {'B': 'AA=='}})
+
+    def test_json_array(self):
+        self.put('a', 'b', 'c', 'd', 'e')
+        response = self.fetch('/scan')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        body = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(sorted(item['id'] for item in body), list('abcde'))
+        self.assertEqual(body[0]['data'], 'AA==')
+        self.assertEqual(self.counts, [5])
+        self.assertEqual(self.server.application.requests['Scan'], 3)
+
+    def test_empty_array(self):
+        response = self.fetch('/scan')
+        self.assertEqual(json.loads(response.body.decode('utf-8')), [])
+
+    def test_ndjson(self):
+        self.put('a', 'b', 'c')
+        response = self.fetch('/scan?ndjson')
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/x-ndjson')
+        lines = response.body.decode('utf-8').splitlines()
+        self.assertEqual(sorted(json.loads(line)['id'] for line in lines),
+                         list('abc'))
+
+    def test_unsupported_action(self):
+        self.assertEqual(self.fetch('/get').code, 500)
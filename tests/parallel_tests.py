@@ -0,0 +1,93 @@
+import functools
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from tornado import testing as tornado_testing
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import parallel, utils
+from tests import api_tests
+
+
+def write_page(path, segment, items):
+    with open(os.path.join(path, str(os.getpid())), 'a') as handle:
+        for item in items:
+            handle.write(json.dumps({'id': item['id'],
+                                     'segment': segment}) + '\n')
+
+
+class ParallelScanTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(ParallelScanTests, self).setUp()
+        self.table = self.create_stub_table()
+        for offset in range(40):
+            self.server.store.tables[self.table].put(utils.marshall(
+                {'id': str(offset), 'tags': {'a'}, 'blob': b'\x00'}))
+
+    def scan(self, **kwargs):
+        return parallel.ParallelScan(
+            self.table, processes=2, segments_per_process=2,
+            client_kwargs={'endpoint': self.server.endpoint}, **kwargs)
+
+    @tornado_testing.gen_test(timeout=60)
+    def test_items_are_streamed_to_parent(self):
+        items = []
+        result = yield self.scan(batch_size=3, limit=5).run(items.append)
+        self.assertEqual(result.items, 40)
+        self.assertGreater(result.read_units, 0)
+        self.assertEqual(sorted(int(item['id']) for item in items),
+                         list(range(40)))
+        self.assertEqual(items[0]['tags'], {'a'})
+        self.assertEqual(items[0]['blob'], b'\x00')
+        self.assertEqual(self.server.application.requests['Scan'],
+                         result.pages)
+
+    @tornado_testing.gen_test(timeout=60)
+    def test_pages_are_processed_in_workers(self):
+        path = tempfile.mkdtemp()
+        try:
+            result = yield self.scan().run_in_workers(
+                functools.partial(write_page, path))
+            outputs = os.listdir(path)
+            items = []
+            for name in outputs:
+                with open(os.path.join(path, name)) as handle:
+                    items.extend(json.loads(line) for line in handle)
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual(result.items, 40)
+        self.assertEqual(len(outputs), 2)
+        self.assertEqual(sorted(int(item['id']) for item in items),
+                         list(range(40)))
+        self.assertEqual(sorted({item['segment'] for item in items}),
+                         [0, 1, 2, 3])
+
+    @tornado_testing.gen_test(timeout=60)
+    def test_worker_error(self):
+        scan = parallel.ParallelScan(
+            'missing', processes=2,
+            client_kwargs={'endpoint': self.server.endpoint})
+        with self.assertRaises(dynamodb.DynamoDBException) as context:
+            yield scan.run(lambda item: None)
+        self.assertIn('ResourceNotFound', str(context.exception))
+
+    @tornado_testing.gen_test(timeout=60)
+    def test_batches_received_off_the_ioloop(self):
+        threads, items = set(), []
+        receive = parallel._Worker.receive
+
+        def record(worker):
+            threads.add(threading.current_thread())
+            return receive(worker)
+
+        with mock.patch.object(parallel._Worker, 'receive', record):
+            result = yield self.scan(batch_size=3).run(
+                lambda item: items.append(threading.current_thread()))
+        self.assertEqual(result.items, 40)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(set(items), {threading.current_thread()})
@@ -0,0 +1,169 @@
+import time
+import unittest
+
+from tornado import testing as tornado_testing
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import client, exceptions, routing
+from tests import api_tests
+
+
+def measurement(duration, error=None):
+    return client.Measurement(time.time(), 'GetItem', 'example', 1,
+                              duration, error, ())
+
+
+class RouterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoints = [routing.Endpoint(name, None)
+                          for name in ('primary', 'secondary')]
+        self.router = routing.Router(self.endpoints, probe_rate=0)
+
+    def test_requires_endpoints(self):
+        with self.assertRaises(ValueError):
+            routing.Router([])
+
+    def test_writes_pinned_to_primary(self):
+        self.router.record(self.endpoints[0], measurement(1.0))
+        self.router.record(self.endpoints[1], measurement(0.1))
+        self.assertIs(self.router.select(False), self.endpoints[0])
+
+    def test_reads_prefer_fastest(self):
+        self.router.record(self.endpoints[0], measurement(1.0))
+        self.router.record(self.endpoints[1], measurement(0.1))
+        self.assertIs(self.router.select(True), self.endpoints[1])
+
+    def test_untried_endpoints_selected_first(self):
+        self.router.record(self.endpoints[0], measurement(0.01))
+        self.assertIs(self.router.select(True), self.endpoints[1])
+
+    def test_moving_average(self):
+        self.router.record(self.endpoints[0], measurement(1.0))
+        self.router.record(self.endpoints[0], measurement(2.0))
+        self.assertAlmostEqual(self.endpoints[0].latency, 1.2)
+
+    def test_service_unavailable_cooldown(self):
+        self.router.record(self.endpoints[0], measurement(0.01))
+        self.router.record(self.endpoints[1], measurement(0.1))
+        self.router.record(self.endpoints[0],
+                           measurement(0.01, 'ServiceUnavailable'))
+        self.assertIs(self.router.select(True), self.endpoints[1])
+        self.endpoints[0].unavailable_until = time.monotonic() - 1
+        self.assertIs(self.router.select(True), self.endpoints[0])
+
+    def test_error_rate_threshold(self):
+        self.router.record(self.endpoints[0], measurement(0.01))
+        self.router.record(self.endpoints[1], measurement(0.1))
+        for _attempt in range(4):
+            self.router.record(self.endpoints[0],
+                               measurement(0.01, 'InternalServerError'))
+        self.assertGreater(self.endpoints[0].error_rate, 0.5)
+        self.assertIs(self.router.select(True), self.endpoints[1])
+
+    def test_unhealthy_endpoint_recovers(self):
+        router = routing.Router(self.endpoints, probe_rate=0.5, seed=1)
+        router.record(self.endpoints[0], measurement(0.1))
+        for _attempt in range(10):
+            router.record(self.endpoints[1],
+                          measurement(0.01, 'InternalServerError'))
+        selected = {router.select(True) for _offset in range(50)}
+        self.assertEqual(selected, {self.endpoints[0]})
+        self.endpoints[1].failed_at -= router.cooldown
+        for _offset in range(50):
+            endpoint = router.select(True)
+            router.record(endpoint, measurement(
+                0.1 if endpoint is self.endpoints[0] else 0.01))
+        self.assertLess(self.endpoints[1].error_rate, 0.5)
+        router.probe_rate = 0
+        self.assertIs(router.select(True), self.endpoints[1])
+
+    def test_client_errors_do_not_count(self):
+        self.router.record(self.endpoints[0],
+                           measurement(0.01, 'ValidationException'))
+        self.assertEqual(self.endpoints[0].error_rate, 0.0)
+
+    def test_excluded_endpoints(self):
+        self.assertIs(self.router.select(True, {self.endpoints[0]}),
+                      self.endpoints[1])
+        self.assertIs(self.router.select(True, set(self.endpoints)),
+                      self.endpoints[0])
+
+    def test_unhealthy_fallback(self):
+        for endpoint in self.endpoints:
+            self.router.record(endpoint,
+                               measurement(0.01, 'ServiceUnavailable'))
+        self.assertIn(self.router.select(True), self.endpoints)
+
+    def test_probes(self):
+        router = routing.Router(self.endpoints, probe_rate=1, seed=1)
+        self.router.record(self.endpoints[0], measurement(0.01))
+        self.router.record(self.endpoints[1], measurement(1.0))
+        selected = {router.select(True) for _offset in range(20)}
+        self.assertEqual(selected, set(self.endpoints))
+
+
+class ClientRoutingTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(ClientRoutingTests, self).setUp()
+        self.table = self.create_stub_table()
+
+    def get_client(self):
+        self.start_server(latency=0.02)
+        self.start_server()
+        return dynamodb.Client(
+            endpoints=[server.endpoint for server in self.servers],
+            routing={'probe_rate': 0})
+
+    def put_everywhere(self, item):
+        for server in self.servers:
+            server.store.tables[self.table].put(
+                dynamodb.utils.marshall(item))
+
+    @tornado_testing.gen_test
+    def test_writes_pinned_to_primary(self):
+        for offset in range(5):
+            yield self.client.put_item(self.table, {'id': str(offset)})
+        self.assertEqual(
+            len(self.servers[0].store.tables[self.table].items), 5)
+        self.assertEqual(
+            len(self.servers[1].store.tables[self.table].items), 0)
+
+    @tornado_testing.gen_test
+    def test_reads_prefer_fastest(self):
+        self.put_everywhere({'id': 'a', 'value': 1})
+        for _attempt in range(5):
+            result = yield self.client.get_item(self.table, {'id': 'a'})
+            self.assertEqual(result['Item'], {'id': 'a', 'value': 1})
+        primary, secondary = self.client._router.endpoints
+        self.assertLess(secondary.latency, primary.latency)
+        self.assertEqual(primary.requests, 1)
+        self.assertEqual(secondary.requests, 4)
+
+    @tornado_testing.gen_test
+    def test_reads_fail_over(self):
+        self.put_everywhere({'id': 'a', 'value': 1})
+        primary, secondary = self.client._router.endpoints
+        primary.latency, secondary.latency = 0.02, 0.01
+        self.servers[1].application.inject_error(
+            'GetItem', 'ServiceUnavailable')
+        measurements = []
+        self.client.set_instrumentation_callback(measurements.extend)
+        start = time.monotonic()
+        result = yield self.client.get_item(self.table, {'id': 'a'})
+        self.assertEqual(result['Item'], {'id': 'a', 'value': 1})
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual([m.error for m in measurements],
+                         ['ServiceUnavailable', None])
+        self.assertGreater(secondary.unavailable_until, time.monotonic())
+        self.assertEqual(secondary.requests, 1)
+        self.assertEqual(primary.requests, 1)
+
+    @tornado_testing.gen_test
+    def test_write_errors_not_failed_over(self):
+        self.servers[0].application.inject_error(
+            'PutItem', 'ServiceUnavailable', count=3)
+        with self.assertRaises(exceptions.ServiceUnavailable):
+            yield self.client.put_item(self.table, {'id': 'a'})
+        self.assertEqual(self.client._router.endpoints[1].requests, 0)
@@ -0,0 +1,173 @@
+import datetime
+import unittest
+import uuid
+
+from tornado import testing as tornado_testing
+
+from sprockets_dynamodb import schema, utils
+from tests import api_tests
+
+ITEM = {
+    'id': str(uuid.uuid4()),
+    'count': 10,
+    'score': 1.5,
+    'active': True,
+    'blob': b'\x00\x01',
+    'tags': {'a', 'b'},
+    'numbers': {1, 2, 3},
+    'values': [1, 'two', {'three': 3}],
+    'address': {'street': '1 Main St', 'zip': '10001', 'extra': 1},
+    'created_at': datetime.datetime(2019, 11, 17, 12, 0, 0),
+    'unknown': 'not in the schema'
+}
+
+SCHEMA = {'id': 'S', 'count': 'N', 'score': 'N', 'active': 'BOOL',
+          'blob': 'B', 'tags': 'SS', 'numbers': 'NS', 'values': 'L',
+          'address': {'street': 'S', 'zip': 'S'}, 'created_at': 'S'}
+
+
+class SchemaTests(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = schema.Schema(SCHEMA)
+
+    def test_marshall_matches_generic(self):
+        self.assertEqual(self.schema.marshall(ITEM), utils.marshall(ITEM))
+
+    def test_unmarshall_matches_generic(self):
+        value = utils.marshall(ITEM)
+        self.assertEqual(self.schema.unmarshall(value),
+                         utils.unmarshall(value))
+
+    def test_mismatched_types_use_generic(self):
+        item = {'id': 1, 'count': '10', 'active': None, 'tags': {1, 2},
+                'address': 'not a map', 'score': '', 'blob': b''}
+        self.assertEqual(self.schema.marshall(item), utils.marshall(item))
+        value = utils.marshall(item)
+        self.assertEqual(self.schema.unmarshall(value),
+                         utils.unmarshall(value))
+
+    def test_missing_attributes(self):
+        self.assertEqual(self.schema.marshall({'id': 'a'}),
+                         {'id': {'S': 'a'}})
+        self.assertEqual(self.schema.unmarshall({}), {})
+
+    def test_unsupported_values_raise(self):
+        with self.assertRaises(ValueError):
+            self.schema.marshall({'id': object()})
+        with self.assertRaises(ValueError):
+            self.schema.unmarshall({'id': {'X': 'a'}})
+
+    def test_invalid_type(self):
+        with self.assertRaises(ValueError):
+            schema.Schema({'id': 'STRING'})
+
+    def test_attribute_names_are_not_evaluated(self):
+        names = {'a"b': 'S', "c'd\\": 'N', 'e\nf': 'BOOL'}
+        item = {'a"b': 'x', "c'd\\": 1, 'e\nf': False}
+        compiled = schema.Schema(names)
+        self.assertEqual(compiled.marshall(item), utils.marshall(item))
+
+    def test_infer(self):
+        inferred = schema.Schema.infer(
+            {'id': 'a', 'count': 1, 'map': {'x': 'y'}, 'mixed': 1,
+             'empty': None},
+            {'id': 'b', 'count': 2.5, 'map': {'z': 1}, 'mixed': 'one'})
+        self.assertEqual(inferred.attributes['id'], 'S')
+        self.assertEqual(inferred.attributes['count'], 'N')
+        self.assertEqual(inferred.attributes['map'].attributes,
+                         {'x': 'S', 'z': 'N'})
+        self.assertNotIn('mixed', inferred.attributes)
+        self.assertNotIn('empty', inferred.attributes)
+
+
+class RecordTests(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = schema.Schema(
+            dict(SCHEMA, **{'class': 'S', 'as_dict': 'N', 'a b': 'S'}),
+            records=True)
+
+    def test_unmarshall_matches_generic(self):
+        value = utils.marshall(ITEM)
+        record = self.schema.unmarshall(value)
+        self.assertIsInstance(record, self.schema.record_class)
+        self.assertEqual(record, utils.unmarshall(value))
+        self.assertEqual(record.as_dict(), utils.unmarshall(value))
+        self.assertEqual(len(record), len(ITEM))
+
+    def test_attribute_access(self):
+        record = self.schema.unmarshall(
+            {'id': {'S': 'a'}, 'count': {'N': '2'}, 'class': {'S': 'c'},
+             'as_dict': {'N': '1'}, 'a b': {'S': 'd'}})
+        self.assertEqual(record.id, 'a')
+        self.assertEqual(record.count, 2)
+        self.assertEqual(record['class'], 'c')
+        self.assertEqual(record['as_dict'], 1)
+        self.assertEqual(record['a b'], 'd')
+        self.assertEqual(record.as_dict()['as_dict'], 1)
+
+    def test_missing_attributes(self):
+        record = self.schema.unmarshall({'id': {'S': 'a'}})
+        self.assertEqual(record, {'id': 'a'})
+        self.assertNotIn('count', record)
+        self.assertIsNone(record.get('unknown'))
+        with self.assertRaises(KeyError):
+            record['count']
+        self.assertFalse(self.schema.unmarshall({}))
+
+    def test_records_are_slotted(self):
+        record = self.schema.unmarshall(utils.marshall(ITEM))
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.unknown = True
+
+    def test_marshall_record(self):
+        record = self.schema.record_class(
+            {'id': 'a', 'count': 1, 'unknown': 'x'})
+        self.assertEqual(record, {'id': 'a', 'count': 1, 'unknown': 'x'})
+        self.assertEqual(self.schema.marshall(record),
+                         utils.marshall(record.as_dict()))
+
+    def test_infer_records(self):
+        inferred = schema.Schema.infer({'id': 'a'}, records=True)
+        self.assertEqual(inferred.unmarshall({'id': {'S': 'a'}}).id, 'a')
+        self.assertIsNone(schema.Schema.infer({'id': 'a'}).record_class)
+
+
+class ClientSchemaTests(api_tests.StubServerTestCase):
+
+    @tornado_testing.gen_test
+    def test_round_trip_with_schema(self):
+        definition = self.generic_table_definition()
+        yield self.client.create_table(definition)
+        compiled = schema.Schema(SCHEMA)
+        self.client.register_schema(definition['TableName'], compiled)
+        item = dict(ITEM, created_at=ITEM['created_at'].isoformat())
+        yield self.client.put_item(definition['TableName'], item)
+        result = yield self.client.get_item(definition['TableName'],
+                                            {'id': item['id']})
+        self.assertEqual(result['Item'], item)
+        scanned = []
+        yield self.client.scan(definition['TableName'],
+                               item_callback=scanned.append)
+        self.assertEqual(scanned, [item])
+        self.client.register_schema(definition['TableName'], None)
+        self.assertNotIn(definition['TableName'], self.client._schemas)
+
+    @tornado_testing.gen_test
+    def test_records(self):
+        definition = self.generic_table_definition()
+        yield self.client.create_table(definition)
+        compiled = schema.Schema(SCHEMA, records=True)
+        self.client.register_schema(definition['TableName'], compiled)
+        item = dict(ITEM, created_at=ITEM['created_at'].isoformat())
+        yield self.client.put_item(definition['TableName'], item)
+        result = yield self.client.get_item(definition['TableName'],
+                                            {'id': item['id']})
+        self.assertIsInstance(result['Item'], compiled.record_class)
+        self.assertEqual(result['Item'], item)
+        result = yield self.client.scan(definition['TableName'])
+        self.assertEqual(result['Items'][0].id, item['id'])
+        yield self.client.put_item(definition['TableName'],
+                                   result['Items'][0])
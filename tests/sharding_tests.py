@@ -0,0 +1,85 @@
+
+from tornado import testing as tornado_testing
+
+from sprockets_dynamodb import sharding, utils
+from tests import api_tests
+
+
+class ShardedTableTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(ShardedTableTests, self).setUp()
+        self.measurements = []
+        self.client.set_instrumentation_callback(self.measurements.extend)
+        self.table = self.create_stub_table('ts')
+        self.sharded = sharding.ShardedTable(
+            self.client, self.table, 'id', 4, range_key='ts')
+
+    def stored_keys(self):
+        items = self.server.store.tables[self.table].items.values()
+        return {utils.unmarshall(item)['id'] for item in items}
+
+    @tornado_testing.gen_test
+    def test_writes_spread_over_shards(self):
+        self.sharded._random.seed(1)
+        for ts in range(40):
+            yield self.sharded.put_item({'id': 'hot', 'ts': ts})
+        self.assertEqual(self.stored_keys(),
+                         set(self.sharded.shard_values('hot')))
+
+    @tornado_testing.gen_test
+    def test_query_merges_shards_in_order(self):
+        for ts in range(20):
+            yield self.sharded.put_item({'id': 'hot', 'ts': ts, 'n': ts})
+        yield self.sharded.put_item({'id': 'other', 'ts': 5})
+        del self.measurements[:]
+        result = yield self.sharded.query(
+            'hot', '#ts >= :ts', expression_attribute_names={'#ts': 'ts'},
+            expression_attribute_values={':ts': 5})
+        self.assertEqual([item['ts'] for item in result['Items']],
+                         list(range(5, 20)))
+        self.assertEqual(result['Items'][0], {'id': 'hot', 'ts': 5, 'n': 5})
+        self.assertEqual(result['Count'], 15)
+        self.assertEqual(len(self.measurements), 4)
+        result = yield self.sharded.query('hot', scan_index_forward=False,
+                                          limit=3)
+        self.assertEqual([item['ts'] for item in result['Items']],
+                         [19, 18, 17])
+
+    @tornado_testing.gen_test
+    def test_get_and_delete_fan_out(self):
+        yield self.sharded.put_item({'id': 'hot', 'ts': 1, 'n': 1})
+        del self.measurements[:]
+        result = yield self.sharded.get_item({'id': 'hot', 'ts': 1})
+        self.assertEqual(result['Item'], {'id': 'hot', 'ts': 1, 'n': 1})
+        self.assertEqual(len(self.measurements), 4)
+        result = yield self.sharded.get_item({'id': 'hot', 'ts': 2})
+        self.assertFalse(result and result.get('Item'))
+        yield self.sharded.delete_item({'id': 'hot', 'ts': 1})
+        self.assertEqual(self.stored_keys(), set())
+        with self.assertRaises(ValueError):
+            yield self.sharded.update_item({'id': 'hot', 'ts': 1})
+
+    @tornado_testing.gen_test
+    def test_shard_by_addresses_one_shard(self):
+        sharded = sharding.ShardedTable(self.client, self.table, 'id', 4,
+                                        range_key='ts', shard_by='ts')
+        for ts in range(8):
+            yield sharded.put_item({'id': 'hot', 'ts': ts})
+        self.assertGreater(len(self.stored_keys()), 1)
+        del self.measurements[:]
+        result = yield sharded.get_item({'id': 'hot', 'ts': 3})
+        self.assertEqual(result['Item'], {'id': 'hot', 'ts': 3})
+        result = yield sharded.update_item(
+            {'id': 'hot', 'ts': 3}, update_expression='SET #n = :n',
+            expression_attribute_names={'#n': 'n'},
+            expression_attribute_values={':n': 1}, return_values='ALL_NEW')
+        self.assertEqual(result['Attributes'], {'id': 'hot', 'ts': 3, 'n': 1})
+        yield sharded.delete_item({'id': 'hot', 'ts': 3})
+        self.assertEqual(len(self.measurements), 3)
+        self.assertEqual(sharded.shard_of({'ts': 3}),
+                         sharded.shard_of({'ts': 3}))
+
+    def test_invalid_shards(self):
+        with self.assertRaises(ValueError):
+            sharding.ShardedTable(self.client, self.table, 'id', 0)
@@ -0,0 +1,218 @@
+from unittest import mock
+
+from tornado import gen, testing as tornado_testing
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import testing, utils
+from tests import api_tests
+
+
+class CreateTableStubTests(api_tests.StubServerMixin,
+                           api_tests.CreateTableTests):
+    pass
+
+
+class DeleteTableStubTests(api_tests.StubServerMixin,
+                           api_tests.DeleteTableTests):
+    pass
+
+
+class DescribeTableStubTests(api_tests.StubServerMixin,
+                             api_tests.DescribeTableTests):
+    pass
+
+
+class ListTableStubTests(api_tests.StubServerMixin,
+                         api_tests.ListTableTests):
+    pass
+
+
+class ItemLifecycleStubTests(api_tests.StubServerMixin,
+                             api_tests.ItemLifecycleTests):
+
+    def put_item(self, item):
+        # DynamoDB Local does not report the capacity consumed by a put of
+        # a new item, which the lifecycle test relies upon
+        return self.client.put_item(self.definition['TableName'], item,
+                                    return_values='ALL_OLD')
+
+
+class TableQueryStubTests(api_tests.StubServerMixin,
+                          api_tests.TableQueryTests):
+    pass
+
+
+class TableScanStubTests(api_tests.StubServerMixin,
+                         api_tests.TableScanTests):
+    pass
+
+
+class StubServerTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(StubServerTests, self).setUp()
+        self.table = self.create_stub_table('seq')
+
+    @gen.coroutine
+    def put_items(self, count, key='a'):
+        for seq in range(count):
+            yield self.client.put_item(
+                self.table, {'id': key, 'seq': seq, 'tags': {'x', 'y'},
+                             'doc': {'name': 'item-{}'.format(seq)}})
+
+    @tornado_testing.gen_test
+    def test_query_range_and_direction(self):
+        yield self.put_items(10)
+        yield self.put_items(3, 'b')
+        result = yield self.client.query(
+            self.table,
+            key_condition_expression='id = :id AND seq BETWEEN :lo AND :hi',
+            expression_attribute_values={':id': 'a', ':lo': 2, ':hi': 5},
+            scan_index_forward=False)
+        self.assertEqual([i['seq'] for i in result['Items']], [5, 4, 3, 2])
+
+    @tornado_testing.gen_test
+    def test_query_filter_and_projection(self):
+        yield self.put_items(5)
+        result = yield self.client.query(
+            self.table,
+            key_condition_expression='id = :id',
+            filter_expression='seq > :seq AND #doc.#name <> :name',
+            projection_expression='seq',
+            expression_attribute_names={'#doc': 'doc', '#name': 'name'},
+            expression_attribute_values={':id': 'a', ':seq': 1,
+                                         ':name': 'item-3'})
+        self.assertEqual(result['Items'], [{'seq': 2}, {'seq': 4}])
+        self.assertEqual(result['ScannedCount'], 5)
+
+    @tornado_testing.gen_test
+    def test_update_expression(self):
+        yield self.put_items(1)
+        result = yield self.client.update_item(
+            self.table, {'id': 'a', 'seq': 0},
+            update_expression='SET #doc.#name = :name, hits = '
+                              'if_not_exists(hits, :zero) + :one '
+                              'ADD tags :tags REMOVE missing',
+            condition_expression='attribute_exists(id) AND '
+                                 'contains(tags, :x)',
+            expression_attribute_names={'#doc': 'doc', '#name': 'name'},
+            expression_attribute_values={
+                ':name': 'updated', ':zero': 0, ':one': 1, ':x': 'x',
+                ':tags': {'z'}},
+            return_values='ALL_NEW')
+        self.assertEqual(result['Attributes']['doc'], {'name': 'updated'})
+        self.assertEqual(result['Attributes']['hits'], 1)
+        self.assertEqual(result['Attributes']['tags'], {'x', 'y', 'z'})
+
+    @tornado_testing.gen_test
+    def test_condition_failure(self):
+        yield self.put_items(1)
+        with self.assertRaises(dynamodb.ConditionalCheckFailedException):
+            yield self.client.put_item(
+                self.table, {'id': 'a', 'seq': 0},
+                condition_expression='attribute_not_exists(id)')
+
+    @tornado_testing.gen_test
+    def test_segmented_scan(self):
+        yield self.put_items(20)
+        seen = []
+        for segment in range(3):
+            result = yield self.client.scan(self.table, segment=segment,
+                                            total_segments=3)
+            seen += [item['seq'] for item in result['Items']]
+        self.assertEqual(sorted(seen), list(range(20)))
+
+    @tornado_testing.gen_test
+    def test_batch_operations(self):
+        yield self.client.execute('BatchWriteItem', {'RequestItems': {
+            self.table: [{'PutRequest': {'Item': utils.marshall(
+                {'id': 'a', 'seq': seq})}} for seq in range(5)]}})
+        result = yield self.client.execute('BatchGetItem', {'RequestItems': {
+            self.table: {'Keys': [utils.marshall({'id': 'a', 'seq': seq})
+                                  for seq in [1, 3, 7]]}}})
+        self.assertEqual(sorted(utils.unmarshall(item)['seq']
+                                for item in result['Responses'][self.table]),
+                         [1, 3])
+
+    @tornado_testing.gen_test
+    def test_client_batch_write_item(self):
+        result = yield self.client.batch_write_item({self.table: [
+            {'PutRequest': {'Item': {'id': 'a', 'seq': 1}}},
+            {'PutRequest': {'Item': {'id': 'a', 'seq': 2}}}]})
+        self.assertEqual(result['UnprocessedItems'], {})
+        self.server.application.unprocessed_rate = 1.0
+        result = yield self.client.batch_write_item(
+            {self.table: [{'DeleteRequest': {'Key': {'id': 'a', 'seq': 1}}}]},
+            return_consumed_capacity='TOTAL')
+        self.assertEqual(result['UnprocessedItems'], {self.table: [
+            {'DeleteRequest': {'Key': {'id': 'a', 'seq': 1}}}]})
+        self.assertEqual(len(self.server.store.tables[self.table].items), 2)
+
+    @tornado_testing.gen_test
+    def test_client_batch_write_item_split_by_count(self):
+        result = yield self.client.batch_write_item({self.table: [
+            {'PutRequest': {'Item': {'id': 'a', 'seq': seq}}}
+            for seq in range(60)]}, return_consumed_capacity='TOTAL')
+        self.assertEqual(self.server.application.requests['BatchWriteItem'],
+                         3)
+        self.assertEqual(len(result['ConsumedCapacity']), 3)
+        self.assertEqual(len(self.server.store.tables[self.table].items), 60)
+
+    @tornado_testing.gen_test
+    def test_client_batch_write_item_split_by_size(self):
+        items = [{'id': 'a', 'seq': seq, 'body': 'x' * 1000}
+                 for seq in range(10)]
+        size = max(utils.item_size(item) for item in items)
+        self.server.application.unprocessed_rate = 1.0
+        with mock.patch.object(utils, 'MAX_BATCH_WRITE_SIZE', size * 4):
+            result = yield self.client.batch_write_item({self.table: [
+                {'PutRequest': {'Item': item}} for item in items]})
+        self.assertEqual(self.server.application.requests['BatchWriteItem'],
+                         3)
+        self.assertEqual(result['UnprocessedItems'], {self.table: [
+            {'PutRequest': {'Item': item}} for item in items]})
+
+    @tornado_testing.gen_test
+    def test_client_rejects_oversized_items(self):
+        item = {'id': 'a', 'seq': 1, 'body': 'x' * utils.MAX_ITEM_SIZE}
+        with self.assertRaises(dynamodb.ValidationException):
+            yield self.client.put_item(self.table, item)
+        with self.assertRaises(dynamodb.ValidationException):
+            yield self.client.batch_write_item(
+                {self.table: [{'PutRequest': {'Item': item}}]})
+        with self.assertRaises(dynamodb.ValidationException):
+            yield self.client.execute('TransactWriteItems', {
+                'TransactItems': [{'Put': {
+                    'TableName': self.table,
+                    'Item': utils.marshall(item)}}]})
+        self.assertEqual(self.server.application.requests['PutItem'], 0)
+        self.assertEqual(self.server.application.requests['BatchWriteItem'],
+                         0)
+
+    @tornado_testing.gen_test
+    def test_injected_throttle_is_retried(self):
+        self.server.application.inject_error(
+            'GetItem', 'ProvisionedThroughputExceededException')
+        result = yield self.client.get_item(self.table, {'id': 'a', 'seq': 0})
+        self.assertIsNone(result)
+        self.assertEqual(self.server.application.requests['GetItem'], 2)
+
+    @tornado_testing.gen_test
+    def test_injected_server_error(self):
+        self.server.application.error_rate = 1.0
+        with self.assertRaises(dynamodb.RequestException):
+            yield self.client.get_item(self.table, {'id': 'a', 'seq': 0})
+
+    @tornado_testing.gen_test
+    def test_unprocessed_batch_items(self):
+        self.server.application.unprocessed_rate = 1.0
+        result = yield self.client.execute('BatchWriteItem', {'RequestItems': {
+            self.table: [{'PutRequest': {'Item': utils.marshall(
+                {'id': 'a', 'seq': 1})}}]}})
+        self.assertEqual(len(result['UnprocessedItems'][self.table]), 1)
+        self.assertEqual(self.server.store.tables[self.table].items, {})
+
+    def test_invalid_expression(self):
+        with self.assertRaises(testing.ResponseError) as context:
+            testing._Parser('id = = :id', {}, {':id': {'S': 'a'}}).condition()
+        self.assertEqual(context.exception.error_type, 'ValidationException')
@@ -0,0 +1,162 @@
+import datetime
+import json
+import unittest
+from unittest import mock
+import uuid
+
+from tornado import testing as tornado_testing
+import tornado_aws
+
+import sprockets_dynamodb as dynamodb
+from sprockets_dynamodb import client, transport, utils
+from tests import api_tests
+
+
+class SigningTests(unittest.TestCase):
+
+    TIMESTAMP = datetime.datetime(2019, 11, 17, 12, 30, 15)
+
+    def setUp(self):
+        self.client = transport.AsyncAWSClient(
+            'dynamodb', region='us-east-1', access_key='ACCESS',
+            secret_key='SECRET', endpoint='http://localhost:8000')
+
+    def sign(self, signer, body=b'{"TableName": "example"}'):
+        headers = {'x-amz-target': 'DynamoDB_20120810.GetItem',
+                   'Content-Type': 'application/x-amz-json-1.0'}
+        with mock.patch('tornado_aws.client.datetime') as dt, \
+                mock.patch.object(transport.AsyncAWSClient, '_timestamp',
+                                  return_value='20191117T123015Z'):
+            dt.datetime.utcnow.return_value = self.TIMESTAMP
+            return signer(self.client, 'POST', '/', {}, headers, body)
+
+    def test_matches_tornado_aws_signature(self):
+        for body in [b'{}', b'{"TableName": "example"}', '{"x": "\u00e9"}']:
+            self.assertEqual(
+                self.sign(transport.AsyncAWSClient._signed_request, body),
+                self.sign(tornado_aws.AsyncAWSClient._signed_request, body))
+
+    def test_matches_with_security_token(self):
+        self.client._auth_config._security_token = 'TOKEN'
+        self.assertEqual(
+            self.sign(transport.AsyncAWSClient._signed_request),
+            self.sign(tornado_aws.AsyncAWSClient._signed_request))
+
+    def test_signing_key_is_cached(self):
+        with mock.patch.object(tornado_aws.AsyncAWSClient, '_signing_key',
+                               return_value=b'key') as signing_key:
+            self.client._signing_key('20191117')
+            self.client._signing_key('20191117')
+            self.assertEqual(signing_key.call_count, 1)
+            self.client._signing_key('20191118')
+            self.assertEqual(signing_key.call_count, 2)
+            self.client._auth_config._secret_key = 'ROTATED'
+            self.client._signing_key('20191118')
+            self.assertEqual(signing_key.call_count, 3)
+
+
+class PageDecoderTests(unittest.TestCase):
+
+    RESPONSE = {
+        'Count': 3,
+        'Items': [{'id': {'S': 'a'}, 'note': {'S': 'Items": [ }'}},
+                  {'id': {'S': 'éè'}, 'n': {'N': '12'}},
+                  {'id': {'S': 'c'}, 'l': {'L': [{'N': '1'}]}}],
+        'ScannedCount': 10,
+        'LastEvaluatedKey': {'id': {'S': 'c'}}}
+
+    def decode(self, body, chunk_size):
+        items = []
+        decoder = transport.PageDecoder(items.append)
+        for offset in range(0, len(body), chunk_size):
+            decoder.feed(body[offset:offset + chunk_size])
+        return items, decoder.close()
+
+    def test_every_chunk_size(self):
+        for separators in [(',', ':'), (', ', ': ')]:
+            body = json.dumps(self.RESPONSE, separators=separators,
+                              ensure_ascii=False).encode('utf-8')
+            for chunk_size in range(1, len(body) + 1):
+                items, result = self.decode(body, chunk_size)
+                self.assertEqual(items, self.RESPONSE['Items'])
+                self.assertEqual(result, {
+                    'Count': 3, 'ScannedCount': 10,
+                    'LastEvaluatedKey': {'id': {'S': 'c'}}})
+
+    def test_complete_values_decoded_directly(self):
+        body = json.dumps(self.RESPONSE).encode('utf-8')
+        with mock.patch.object(transport.PageDecoder, '_end') as end:
+            items, _result = self.decode(body, len(body))
+        self.assertEqual(items, self.RESPONSE['Items'])
+        end.assert_not_called()
+
+    def test_incomplete_body(self):
+        decoder = transport.PageDecoder(lambda item: None)
+        decoder.feed(b'{"Count": 1, "Items": [{"id": {"S": "a"}}')
+        with self.assertRaises(ValueError):
+            decoder.close()
+
+    def test_invalid_item_raises_when_received(self):
+        for body in (b'{"Items": [{"id": {"S": "a"}]',
+                     b'{"Items": [{"id": {"S" "a"}}',
+                     b'{"Items": [{"n": {"N": 1.}}',
+                     b'{"Count": 1.,'):
+            decoder = transport.PageDecoder(lambda item: None)
+            with self.assertRaises(ValueError):
+                decoder.feed(body)
+
+    def test_large_item_in_small_chunks(self):
+        item = {'id': {'S': 'a'}, 'body': {'S': '\\"{[' * 50000},
+                'list': {'L': [{'M': {'n': {'N': str(n)}}}
+                               for n in range(5000)]}}
+        body = json.dumps({'Items': [item], 'Count': 1}).encode('utf-8')
+        items, result = self.decode(body, 7)
+        self.assertEqual(items, [item])
+        self.assertEqual(result, {'Count': 1})
+
+    def test_retry_skips_delivered_items(self):
+        items = []
+        stream = client._ItemStream(items.append)
+        first = stream.decoder()
+        first.feed(b'{"Items": [{"id": {"S": "a"}}, {"id": {"S": "b"}}')
+        second = stream.decoder()
+        second.feed(b'{"Items": [{"id": {"S": "a"}}, {"id": {"S": "b"}}, '
+                    b'{"id": {"S": "c"}}], "Count": 3}')
+        self.assertEqual([item['id'] for item in items], ['a', 'b', 'c'])
+
+
+class StreamingTests(api_tests.StubServerTestCase):
+
+    def setUp(self):
+        super(StreamingTests, self).setUp()
+        self.table = self.create_stub_table()
+        for offset in range(50):
+            self.server.store.tables[self.table].put(utils.marshall(
+                {'id': str(offset), 'payload': 'x' * 1024}))
+
+    @tornado_testing.gen_test
+    def test_scan_with_item_callback(self):
+        items = []
+        result = yield self.client.scan(self.table, limit=40,
+                                        item_callback=items.append)
+        self.assertEqual(result['Items'], [])
+        self.assertEqual(result['Count'], 40)
+        self.assertIn('LastEvaluatedKey', result)
+        self.assertEqual(len(items), 40)
+        self.assertEqual(items[0]['payload'], 'x' * 1024)
+
+    @tornado_testing.gen_test
+    def test_query_with_item_callback(self):
+        items = []
+        result = yield self.client.query(
+            self.table, key_condition_expression='id = :id',
+            expression_attribute_values={':id': '7'},
+            item_callback=items.append)
+        self.assertEqual(result['Count'], 1)
+        self.assertEqual([item['id'] for item in items], ['7'])
+
+    @tornado_testing.gen_test
+    def test_streamed_error_response(self):
+        with self.assertRaises(dynamodb.ResourceNotFound):
+            yield self.client.scan(str(uuid.uuid4()),
+                                   item_callback=lambda item: None)
@@ -1,6 +1,8 @@
 import base64
 import datetime
+import json
 import sys
+from unittest import mock
 import unittest
 import uuid
 
@@ -140,3 +142,100 @@ class UnmarshallTests(unittest.TestCase):
 
     def test_value_error_raised_on_unsupported_type(self):
         self.assertRaises(ValueError, utils.unmarshall, {'key': {'T': 1}})
+
+
+class JSONDefaultTests(unittest.TestCase):
+
+    def test_unsupported_values_encoded(self):
+        value = {'binary': b'\x00', 'set': {'b', 'a'}, 'bset': {b'\x01'}}
+        self.assertEqual(json.loads(json.dumps(
+            value, default=utils.json_default)), {
+                'binary': 'AA==', 'set': ['a', 'b'], 'bset': ['AQ==']})
+
+    def test_type_error_raised_on_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            utils.json_default(object())
+
+
+class ItemSizeTests(unittest.TestCase):
+
+    def test_sizes(self):
+        self.assertEqual(utils.item_size({'id': 'abc'}), 5)
+        self.assertEqual(utils.item_size({'name': 'caf\xe9'}), 9)
+        self.assertEqual(utils.item_size({'b': b'1234'}), 5)
+        self.assertEqual(utils.item_size({'n': 12345}), 5)
+        self.assertEqual(utils.item_size({'n': -1.5}), 4)
+        self.assertEqual(utils.item_size({'n': 1000}), 3)
+        self.assertEqual(utils.item_size({'t': True, 'z': None}), 4)
+        self.assertEqual(utils.item_size({'m': {}}), 4)
+        self.assertEqual(utils.item_size({'m': {'a': 'b'}}), 7)
+        self.assertEqual(utils.item_size({'l': ['a', 1]}), 9)
+        self.assertEqual(utils.item_size({'s': {'ab', 'c'}}), 4)
+
+    def test_marshalled_size_matches(self):
+        item = {'id': uuid.uuid4(), 'name': 'caf\xe9', 'blob': b'\x00' * 7,
+                'count': 123.456, 'when': datetime.datetime(2017, 1, 1),
+                'tags': {'a', 'bc'}, 'ids': {1, 22, 333},
+                'bins': {b'x', b'yz'}, 'empty': '', 'nested': {
+                    'list': [1, 'two', {'three': [None, False]}]}}
+        self.assertEqual(utils.item_size(item),
+                         utils.item_size(utils.marshall(item), True))
+
+    def test_value_error_raised_on_unsupported_type(self):
+        self.assertRaises(ValueError, utils.item_size, {'key': object()})
+        self.assertRaises(ValueError, utils.item_size, {'key': {'T': 1}},
+                          True)
+
+    def test_capacity_units(self):
+        self.assertEqual(utils.read_units(1), 0.5)
+        self.assertEqual(utils.read_units(4097, consistent=True), 2.0)
+        self.assertEqual(utils.read_units(4096, transactional=True), 2.0)
+        self.assertEqual(utils.write_units(0), 1.0)
+        self.assertEqual(utils.write_units(1025), 2.0)
+        self.assertEqual(utils.write_units(1024, transactional=True), 2.0)
+
+
+class SplitBatchWriteTests(unittest.TestCase):
+
+    def test_split_by_count_across_tables(self):
+        requests = [{'DeleteRequest': {'Key': utils.marshall({'id': str(i)})}}
+                    for i in range(30)]
+        batches = list(utils.split_batch_write(
+            {'a': requests[:20], 'b': requests[20:]}))
+        self.assertEqual(batches, [
+            {'a': requests[:20], 'b': requests[20:25]},
+            {'b': requests[25:]}])
+
+    def test_split_by_size(self):
+        requests = [{'PutRequest': {'Item': utils.marshall(
+            {'id': str(i), 'body': 'x' * 100})}} for i in range(5)]
+        size = utils.item_size(requests[0]['PutRequest']['Item'],
+                               marshalled=True)
+        with mock.patch.object(utils, 'MAX_BATCH_WRITE_SIZE', size * 2):
+            batches = list(utils.split_batch_write({'a': requests}))
+        self.assertEqual([len(batch['a']) for batch in batches], [2, 2, 1])
+
+    def test_empty(self):
+        self.assertEqual(list(utils.split_batch_write({})), [])
+
+
+class CapacityLimiterTests(unittest.TestCase):
+
+    def test_burst_is_not_delayed(self):
+        limiter = utils.CapacityLimiter(100)
+        self.assertEqual(limiter.delay(50), 0)
+        self.assertEqual(limiter.delay(50), 0)
+
+    def test_delay_after_burst(self):
+        limiter = utils.CapacityLimiter(100)
+        limiter.delay(100)
+        self.assertAlmostEqual(limiter.delay(200), 2.0, delta=0.1)
+
+    def test_correction(self):
+        limiter = utils.CapacityLimiter(100)
+        limiter.delay(300)
+        self.assertEqual(limiter.delay(-200), 0)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            utils.CapacityLimiter(0)